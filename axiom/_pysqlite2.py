@@ -7,7 +7,7 @@ These provide a uniform interface on top of PySQLite2 for Axiom, particularly
 including error handling behavior and exception types.
 """
 
-import time, sys
+import io, time, sys
 
 try:
     # Prefer the third-party module, as it is easier to update, and so may
@@ -32,7 +32,14 @@ class Connection(object):
 
     @type closed: L{bool}
     @ivar closed: Has this cursor been closed?
+
+    @type incrementalBlobs: L{bool}
+    @ivar incrementalBlobs: Whether L{openBlob} uses the incremental BLOB I/O
+        of the SQLite module, when it has it, rather than reading and writing
+        a piece of the BLOB at a time with SQL.
     """
+    incrementalBlobs = True
+
     def __init__(self, connection, timeout=None):
         self._connection = connection
         self._timeout = timeout
@@ -59,9 +66,42 @@ class Connection(object):
         message = e.args[0]
         if message.startswith("table") and message.endswith("already exists"):
             return errors.TableAlreadyExists(sql, args, e)
+        if message.startswith("UNIQUE constraint failed"):
+            return errors.UniqueConstraintViolation(sql, args, e)
         return errors.SQLError(sql, args, e)
 
 
+    def openBlob(self, databaseName, table, column, row, writable=False):
+        """
+        Open a BLOB in the database for incremental I/O.
+
+        @param databaseName: The name of the database containing C{table},
+            such as C{"main"}.
+        @param table: The unqualified name of the table.
+        @param column: The unqualified name of the column.
+        @param row: The rowid of the row.
+        @param writable: Whether the BLOB will be written to.
+
+        @rtype: L{Blob}
+        """
+        description = 'BLOB %s.%s.%s[%d]' % (databaseName, table, column, row)
+        try:
+            if (self.incrementalBlobs and
+                    hasattr(self._connection, 'blobopen')):
+                blob = self._connection.blobopen(
+                    table, column, row, readonly=not writable,
+                    name=databaseName)
+            else:
+                # The SQLite module cannot do it (before Python 3.11).
+                blob = _SQLBlob(
+                    self._connection, databaseName, table, column, row)
+        except (dbapi2.ProgrammingError,
+                dbapi2.InterfaceError,
+                dbapi2.OperationalError) as e:
+            raise self.identifySQLError(description, (), e)
+        return Blob(self, blob, description, writable)
+
+
     def close(self):
         """
         Close the underlying connection.
@@ -71,6 +111,183 @@ class Connection(object):
 
 
 
+def _byteView(data):
+    """
+    Get a C{memoryview} of the bytes of an object supporting the buffer
+    protocol.
+    """
+    view = memoryview(data)
+    if hasattr(view, 'cast'):
+        view = view.cast('B')
+    return view
+
+
+
+class _SQLBlob(object):
+    """
+    A stand-in for an SQLite3 C{Blob} object, for SQLite modules without
+    incremental BLOB I/O, which reads and writes a piece of the BLOB at a time
+    with C{substr}.  Each piece is still copied through memory in full, but
+    the rest of the value is not.
+    """
+    def __init__(self, connection, databaseName, table, column, row):
+        self._cursor = connection.cursor()
+        self._row = row
+        self._position = 0
+        self._table = '"%s"."%s"' % (databaseName, table)
+        self._column = '"%s"' % (column,)
+        self._cursor.execute(
+            'SELECT typeof(%s), length(%s) FROM %s WHERE oid = ?' % (
+                self._column, self._column, self._table),
+            [row])
+        result = self._cursor.fetchone()
+        if result is None:
+            raise dbapi2.OperationalError("no such rowid: %d" % (row,))
+        if result[0] not in ('blob', 'text'):
+            raise dbapi2.OperationalError(
+                "cannot open value of type %s" % (result[0],))
+        self._length = result[1]
+
+
+    def __len__(self):
+        return self._length
+
+
+    def read(self, size=-1):
+        remaining = self._length - self._position
+        if size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            return b''
+        self._cursor.execute(
+            'SELECT substr(%s, ?, ?) FROM %s WHERE oid = ?' % (
+                self._column, self._table),
+            [self._position + 1, size, self._row])
+        result = self._cursor.fetchone()
+        if result is None:
+            raise dbapi2.OperationalError("no such rowid: %d" % (self._row,))
+        data = bytes(result[0])
+        self._position += len(data)
+        return data
+
+
+    def write(self, data):
+        data = _byteView(data).tobytes()
+        end = self._position + len(data)
+        if end > self._length:
+            raise ValueError("data longer than blob length")
+        # Concatenation makes text of its operands, so the result is made a
+        # BLOB again.
+        self._cursor.execute(
+            'UPDATE %s SET %s = CAST(substr(%s, 1, ?) || ? || substr(%s, ?) '
+            'AS BLOB) WHERE oid = ?' % (
+                self._table, self._column, self._column, self._column),
+            [self._position, dbapi2.Binary(data), end + 1, self._row])
+        self._position = end
+
+
+    def seek(self, offset, origin=io.SEEK_SET):
+        if origin == io.SEEK_CUR:
+            offset += self._position
+        elif origin == io.SEEK_END:
+            offset += self._length
+        if not 0 <= offset <= self._length:
+            raise ValueError("offset out of blob range")
+        self._position = offset
+
+
+    def tell(self):
+        return self._position
+
+
+    def close(self):
+        self._cursor.close()
+
+
+
+class Blob(io.RawIOBase):
+    """
+    Wrapper for an SQLite3 C{Blob} object, as a raw binary file.
+
+    The size of a BLOB cannot be changed through this interface: writing past
+    the end raises L{ValueError}.  If the row is changed by any other means
+    while the BLOB is open, further reads and writes fail with
+    L{errors.SQLError}.
+    """
+    def __init__(self, connection, blob, description, writable):
+        io.RawIOBase.__init__(self)
+        self._connection = connection
+        self._blob = blob
+        self._description = description
+        self._writable = writable
+
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except (dbapi2.ProgrammingError,
+                dbapi2.InterfaceError,
+                dbapi2.OperationalError) as e:
+            raise self._connection.identifySQLError(
+                self._description, (), e)
+
+
+    def __len__(self):
+        return self._call(len, self._blob)
+
+
+    def readable(self):
+        return True
+
+
+    def writable(self):
+        return self._writable
+
+
+    def seekable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        self._checkClosed()
+        view = _byteView(buffer)
+        data = self._call(self._blob.read, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+    def read(self, size=-1):
+        self._checkClosed()
+        return self._call(self._blob.read, size)
+
+
+    def write(self, data):
+        self._checkClosed()
+        if not self._writable:
+            raise io.UnsupportedOperation("BLOB was not opened for writing")
+        view = _byteView(data)
+        self._call(self._blob.write, view)
+        return len(view)
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        self._call(self._blob.seek, offset, whence)
+        return self._call(self._blob.tell)
+
+
+    def tell(self):
+        self._checkClosed()
+        return self._call(self._blob.tell)
+
+
+    def close(self):
+        if not self.closed:
+            self._call(self._blob.close)
+        io.RawIOBase.close(self)
+
+
+
 class Cursor(object):
     """
     Wrapper for an SQLite3 C{Cursor} object.
@@ -159,6 +376,11 @@ class Cursor(object):
                 if e.args[0] == 'database schema has changed':
                     return self._cursor.execute(sql, args)
                 raise
+        except dbapi2.IntegrityError as e:
+            error = self._connection.identifySQLError(sql, args, e)
+            if isinstance(error, errors.UniqueConstraintViolation):
+                raise error
+            raise
         except (dbapi2.ProgrammingError,
                 dbapi2.InterfaceError,
                 dbapi2.OperationalError) as e:
@@ -177,12 +399,30 @@ class Cursor(object):
         self.closed = True
 
 
+def _hasJSON():
+    """
+    Determine whether the SQLite library has the JSON functions, which are
+    built in from SQLite 3.38.0 and optional before.
+    """
+    connection = dbapi2.connect(':memory:')
+    try:
+        connection.execute("SELECT value FROM json_each('[]')")
+    except dbapi2.OperationalError:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
 # Export some names from the underlying module.
 sqlite_version_info = dbapi2.sqlite_version_info
 OperationalError = dbapi2.OperationalError
+HAS_JSON = _hasJSON()
 
 __all__ = [
     'OperationalError',
     'Connection',
+    'Blob',
     'sqlite_version_info',
+    'HAS_JSON',
     ]
@@ -89,3 +89,73 @@ CHANGE_TYPE = 'UPDATE "*DATABASE*"."axiom_objects" SET "type_id" = ? WHERE "oid"
 
 APP_VACUUM = 'DELETE FROM "*DATABASE*"."axiom_objects" WHERE ("type_id" == -1) AND ("oid" != (SELECT MAX("oid") from "*DATABASE*"."axiom_objects"))'
 
+
+# Tombstone collection.  The row with the greatest oid is never removed, so
+# that even stores whose axiom_objects table predates AUTOINCREMENT cannot
+# hand out a previously used storeID.
+COLLECT_DEAD_OBJECTS = """
+DELETE FROM "*DATABASE*"."axiom_objects" WHERE "oid" IN (
+    SELECT "oid" FROM "*DATABASE*"."axiom_objects"
+        WHERE ("type_id" == -1)
+            AND ("oid" < (SELECT MAX("oid") FROM "*DATABASE*"."axiom_objects"))
+        LIMIT ?)
+"""
+
+COLLECT_ORPHANED_OBJECTS = """
+DELETE FROM "*DATABASE*"."axiom_objects" WHERE "oid" IN (
+    SELECT "oid" FROM "*DATABASE*"."axiom_objects"
+        WHERE ("type_id" == ?)
+            AND ("oid" < (SELECT MAX("oid") FROM "*DATABASE*"."axiom_objects"))
+            AND NOT EXISTS (SELECT 1 FROM {table}
+                            WHERE {table}."oid" = "*DATABASE*"."axiom_objects"."oid")
+        LIMIT ?)
+"""
+
+CHANGED_ROWS = 'SELECT changes()'
+
+# Each execution of incremental_vacuum returns one page to the filesystem,
+# since the statement produces no result columns for the cursor to step
+# through.
+AUTO_VACUUM_MODE = 'PRAGMA *DATABASE*.auto_vacuum'
+AUTO_VACUUM_INCREMENTAL = 2
+FREE_PAGE_COUNT = 'PRAGMA *DATABASE*.freelist_count'
+INCREMENTAL_VACUUM = 'PRAGMA *DATABASE*.incremental_vacuum(1)'
+
+# Planner statistics maintenance.
+ITEM_TABLES = ("SELECT \"name\" FROM \"*DATABASE*\".\"sqlite_master\" "
+               "WHERE \"type\" = 'table' AND \"name\" LIKE 'item\\_%' ESCAPE '\\' "
+               "ORDER BY \"name\"")
+
+# Neither of these pragmas accepts a bound parameter.
+ANALYSIS_LIMIT = 'PRAGMA analysis_limit = {:d}'
+ANALYZE_TABLE = 'ANALYZE "*DATABASE*"."{}"'
+
+# The row counts recorded by ANALYZE, for approximate counts.  The first
+# number of each statistic is the number of rows in the table.
+HAS_PLANNER_STATISTICS = ("SELECT COUNT(*) FROM \"*DATABASE*\".\"sqlite_master\" "
+                          "WHERE \"name\" = 'sqlite_stat1'")
+TABLE_ROW_ESTIMATE = ('SELECT "stat" FROM "*DATABASE*"."sqlite_stat1" '
+                      'WHERE "tbl" = ?')
+
+# A generation number for each item type, incremented by every transaction
+# which changes items of that type, so that Stores can find out which types
+# another connection has changed when PRAGMA data_version tells them that it
+# has committed something.
+CREATE_CHANGE_LOG = """
+CREATE TABLE IF NOT EXISTS "*DATABASE*"."axiom_change_log" (
+    "type_id" INTEGER PRIMARY KEY,
+    "generation" INTEGER NOT NULL
+)
+"""
+LOG_CHANGE = ('INSERT OR REPLACE INTO "*DATABASE*"."axiom_change_log" '
+              '("type_id", "generation") VALUES (?, COALESCE('
+              '(SELECT "generation" FROM "*DATABASE*"."axiom_change_log" '
+              'WHERE "type_id" = ?), 0) + 1)')
+CHANGE_LOG = 'SELECT "type_id", "generation" FROM "*DATABASE*"."axiom_change_log"'
+# The change log entry incremented instead by transactions which change the
+# database but no item tables, such as those which ANALYZE tables or collect
+# tombstones, so that they are not mistaken for unlogged changes to items.
+# Type IDs start at 1.
+MAINTENANCE_TYPE_ID = 0
+TYPE_CHANGE_LOG = CHANGE_LOG + ' WHERE "type_id" = ?'
+DATA_VERSION = 'PRAGMA *DATABASE*.data_version'
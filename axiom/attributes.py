@@ -1,6 +1,10 @@
 # -*- test-case-name: axiom.test.test_attributes,axiom.test.test_reference -*-
 
 import os
+import zlib
+import binascii
+import json
+import math
 
 import six
 from six.moves import map
@@ -21,9 +25,11 @@ from epsilon.extime import Time
 
 from axiom.slotmachine import Attribute as inmemory
 
-from axiom.errors import NoCrossStoreReferences, BrokenReference
+from axiom.errors import (
+    NoCrossStoreReferences, BrokenReference, ItemNotFound)
 
 from axiom.iaxiom import IComparison, IOrdering, IColumn, IQuery
+from axiom._pysqlite2 import HAS_JSON
 
 _NEEDS_FETCH = object()         # token indicating that a value was not found
 
@@ -148,6 +154,19 @@ class _OrderingMixin:
 
 
 
+class _AggregateMixin:
+    """
+    Provide the aggregates of a column, for the results, C{HAVING} comparisons
+    and sort orders of grouped queries.
+    """
+    count = property(lambda self: Aggregate('COUNT', self))
+    sum = property(lambda self: Aggregate('SUM', self))
+    average = property(lambda self: Aggregate('AVG', self))
+    max = property(lambda self: Aggregate('MAX', self))
+    min = property(lambda self: Aggregate('MIN', self))
+
+
+
 class _ContainableMixin:
     def oneOf(self, seq, negate=False):
         """
@@ -166,7 +185,7 @@ class _ContainableMixin:
 
 
 class Comparable(_ContainableMixin, _ComparisonOperatorMuxer,
-                 _MatchingOperationMuxer, _OrderingMixin):
+                 _MatchingOperationMuxer, _OrderingMixin, _AggregateMixin):
     """
     Helper for a thing that can be compared like an SQLAttribute (or is in fact
     an SQLAttribute).  Requires that 'self' have 'type' (Item-subclass) and
@@ -305,9 +324,542 @@ registerAdapter(CompoundOrdering, tuple, IOrdering)
 registerAdapter(UnspecifiedOrdering, type(None), IOrdering)
 registerAdapter(SimpleOrdering, Comparable, IOrdering)
 
-def compoundIndex(*columns):
+class _IndexDeclaration(tuple):
+    """
+    The columns of an index which only covers the rows matching a predicate,
+    or which is unique.
+
+    @ivar where: An L{IComparison} selecting the rows to index.
+    @ivar unique: Whether no two indexed rows may have the same values.
+    """
+    where = None
+    unique = False
+
+
+
+def _predicateTerms(comparison):
+    """
+    Yield the L{AttributeValueComparison}s making up a comparison.
+    """
+    if isinstance(comparison, AttributeValueComparison):
+        yield comparison
+    elif isinstance(comparison, AggregateComparison):
+        for condition in comparison.conditions:
+            for term in _predicateTerms(condition):
+                yield term
+
+
+
+def compoundIndex(*columns, **kw):
+    """
+    Declare an index on several columns of an item type, in the given order.
+
+    Columns may be attributes or L{ColumnExpression}s, such as
+    C{lower(Person.name)}.
+
+    @param where: If given, an L{IComparison} involving only this item type;
+        only the items which match it are indexed.  Each value it compares an
+        attribute to is written into queries which make the same comparison,
+        so that SQLite can tell that the index applies to them.  Values must
+        be of a kind which can be written as an SQL literal.
+
+    @param unique: If true, no two items (of those matching C{where}, if it is
+        given) may have the same values of the columns; creating or changing
+        an item so that they would raises
+        L{axiom.errors.UniqueConstraintViolation}.
+    """
+    where = kw.pop('where', None)
+    unique = kw.pop('unique', False)
+    if kw:
+        raise TypeError(
+            'compoundIndex() got unexpected keyword arguments %r' % (
+                sorted(kw),))
+    if where is not None or unique:
+        declaration = _IndexDeclaration(columns)
+        declaration.unique = unique
+        if where is not None:
+            declaration.where = where
+            for term in _predicateTerms(where):
+                term.attribute._predicateValues.append(
+                    (term.operationString, term.value))
+    else:
+        declaration = columns
     for column in columns:
-        column.compoundIndexes.append(columns)
+        getattr(column, 'attribute', column).compoundIndexes.append(
+            declaration)
+
+
+
+def _sqlLiteral(value):
+    """
+    Write a value from the database as an SQL literal.
+
+    @raise TypeError: If the value cannot be written as a literal.
+    """
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, bool):
+        return str(int(value))
+    elif isinstance(value, six.integer_types):
+        return str(value)
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, six.text_type):
+        return u"'%s'" % (value.replace(u"'", u"''"),)
+    elif isinstance(value, six.binary_type):
+        return "X'%s'" % (binascii.hexlify(value).decode('ascii'),)
+    raise TypeError("%r cannot be written as an SQL literal" % (value,))
+
+
+
+@implementer(IColumn)
+class ColumnExpression(Comparable):
+    """
+    The result of an SQL function applied to an attribute, which can be
+    compared, sorted on and indexed like the attribute itself.
+
+    @ivar function: The name of the SQL function.
+    @ivar attribute: The L{SQLAttribute} the function is applied to.
+    """
+    def __init__(self, function, attribute):
+        self.function = function
+        self.attribute = attribute
+        self._predicateValues = []
+
+
+    type = property(lambda self: self.attribute.type)
+    classname = property(lambda self: self.attribute.classname)
+    attrname = property(
+        lambda self: '%s_%s' % (self.function, self.attribute.attrname))
+
+
+    def getShortColumnName(self, store):
+        return '%s(%s)' % (self.function,
+                           self.attribute.getShortColumnName(store))
+
+
+    def getColumnName(self, store):
+        return '%s(%s)' % (self.function, self.attribute.getColumnName(store))
+
+
+    def fullyQualifiedName(self):
+        return '%s(%s)' % (self.function, self.attribute.fullyQualifiedName())
+
+
+    def infilter(self, pyval, oself, store):
+        return self.attribute.infilter(pyval, oself, store)
+
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__,
+                            self.fullyQualifiedName())
+
+
+
+def lower(attribute):
+    """
+    Refer to the lower-cased value of a textual attribute.
+
+    @rtype: L{ColumnExpression}
+    """
+    return ColumnExpression('lower', attribute)
+
+
+
+def upper(attribute):
+    """
+    Refer to the upper-cased value of a textual attribute.
+
+    @rtype: L{ColumnExpression}
+    """
+    return ColumnExpression('upper', attribute)
+
+
+
+@implementer(IColumn)
+class Aggregate(_ContainableMixin, _ComparisonOperatorMuxer, _OrderingMixin):
+    """
+    An SQL aggregate function of a column, such as C{Foo.size.sum}, which
+    can be a result of a grouped query and be compared or sorted on like an
+    attribute.
+
+    The C{SUM}, C{MAX} and C{MIN} of a column are of the column's type, but
+    its C{COUNT} (of non-C{None} values) is an integer, and its C{AVG} a
+    float.
+
+    @ivar function: The name of the SQL aggregate function.
+    @ivar column: The L{IColumn} provider the function is applied to.
+    """
+    def __init__(self, function, column):
+        self.function = function
+        self.column = column
+        if function in ('SUM', 'MAX', 'MIN'):
+            self.sqltype = getattr(column, 'sqltype', None)
+            if getattr(column, 'outfilter', None) is not None:
+                self.outfilter = column.outfilter
+        elif function == 'COUNT':
+            self.sqltype = 'INTEGER'
+        else:
+            self.sqltype = 'REAL'
+
+
+    type = property(lambda self: self.column.type)
+    classname = property(lambda self: self.column.classname)
+    attrname = property(
+        lambda self: '%s_%s' % (self.function.lower(), self.column.attrname))
+
+
+    def getShortColumnName(self, store):
+        return '%s(%s)' % (self.function,
+                           self.column.getShortColumnName(store))
+
+
+    def getColumnName(self, store):
+        return '%s(%s)' % (self.function, self.column.getColumnName(store))
+
+
+    def fullyQualifiedName(self):
+        return '%s(%s)' % (self.function, self.column.fullyQualifiedName())
+
+
+    def compare(self, other, sqlop):
+        return compare(self, other, sqlop)
+
+
+    def infilter(self, pyval, oself, store):
+        if self.function in ('SUM', 'MAX', 'MIN'):
+            return self.column.infilter(pyval, oself, store)
+        return pyval
+
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__,
+                            self.fullyQualifiedName())
+
+
+
+@implementer(IComparison)
+class FullTextMatch:
+    """
+    A comparison which selects the items whose full-text indexed attributes
+    match a query.
+
+    @ivar index: The L{FullTextIndex} to search.
+    @ivar query: The FTS5 query, as C{unicode}.
+    """
+    def __init__(self, index, query):
+        self.index = index
+        self.query = query
+
+
+    def getQuery(self, store):
+        tableName = self.index.getTableName(store)
+        return '(%s.%s MATCH ? AND %s.rowid = %s)' % (
+            tableName, tableName.split('.')[-1], tableName,
+            self.index.type.storeID.getColumnName(store))
+
+
+    def getArgs(self, store):
+        return [self.query]
+
+
+    def getInvolvedTables(self):
+        return [self.index.type, self.index]
+
+
+    def __repr__(self):
+        return '%r.matches(%r)' % (self.index, self.query)
+
+
+
+@implementer(IColumn)
+class FullTextRank(_OrderingMixin):
+    """
+    The relevance of each item to the query of a L{FullTextMatch}, for
+    sorting the results of a query which includes one; the best matches sort
+    first in ascending order.
+    """
+    def __init__(self, index):
+        self.index = index
+
+
+    type = property(lambda self: self.index)
+    classname = property(lambda self: self.index.type.__name__)
+    attrname = 'rank'
+
+
+    def getShortColumnName(self, store):
+        return 'rank'
+
+
+    def getColumnName(self, store):
+        return '%s.rank' % (self.index.getTableName(store),)
+
+
+    def fullyQualifiedName(self):
+        return '%r.rank' % (self.index,)
+
+
+
+class FullTextIndex(object):
+    """
+    An SQLite FTS5 index of some of the textual attributes of an item type.
+
+    The index is kept up to date by triggers on the item type's table, so
+    items are indexed as they are inserted, updated and deleted, however
+    that happens.
+
+    @ivar columns: The indexed L{text} attributes.
+    @ivar tokenize: The FTS5 C{tokenize} option, or C{None} for the default.
+    @ivar rank: A L{FullTextRank} to sort matches by relevance.
+    """
+    def __init__(self, columns, tokenize=None):
+        self.columns = columns
+        self.tokenize = tokenize
+        self.rank = FullTextRank(self)
+
+
+    type = property(lambda self: self.columns[0].type)
+
+
+    def matches(self, query):
+        """
+        Select the items whose indexed attributes match an FTS5 query, such as
+        C{u'lunch NOT dinner'}.
+
+        @rtype: L{FullTextMatch}
+        """
+        return FullTextMatch(self, query)
+
+
+    def getTableName(self, store):
+        return store.getFullTextTableName(self)
+
+
+    def getTableAlias(self, store, currentAliases):
+        return None
+
+
+    def __repr__(self):
+        return 'fullTextIndex(%s)' % (', '.join(
+            column.fullyQualifiedName() for column in self.columns),)
+
+
+
+def fullTextIndex(*columns, **kw):
+    """
+    Declare a full-text index on some of the L{text} attributes of an item
+    type::
+
+        class Message(Item):
+            subject = text()
+            body = text()
+            search = fullTextIndex(subject, body)
+
+        store.query(Message, Message.search.matches(u'lunch'),
+                    sort=Message.search.rank.ascending)
+
+    @param tokenize: The FTS5 C{tokenize} option, such as
+        C{'porter unicode61'}.
+
+    @rtype: L{FullTextIndex}
+    """
+    tokenize = kw.pop('tokenize', None)
+    if kw:
+        raise TypeError(
+            'fullTextIndex() got unexpected keyword arguments %r' % (
+                sorted(kw),))
+    for column in columns:
+        if not isinstance(column, text):
+            raise TypeError(
+                'fullTextIndex() can only index text attributes, not %r' % (
+                    column,))
+    index = FullTextIndex(columns, tokenize)
+    for column in columns:
+        column.fullTextIndexes.append(index)
+    return index
+
+
+
+@implementer(IComparison)
+class IntervalOverlap:
+    """
+    A comparison which selects, from an L{IntervalIndex}, the items whose
+    intervals might overlap a range of values.
+
+    The R*Tree stores the ends of each interval as 32-bit floating point
+    numbers, rounded outwards, so this selects every item whose interval
+    overlaps the range, and perhaps some near it; it must be combined with an
+    exact comparison of the attributes.
+
+    While the R*Tree is waiting to be built in the background (see
+    L{axiom.store.Store.pendingIndexes}), the attributes are compared
+    directly instead.
+
+    @ivar index: The L{IntervalIndex} to search.
+    @ivar low: The lowest value of the range.
+    @ivar high: The highest value of the range.
+    """
+    def __init__(self, index, low, high):
+        self.index = index
+        self.low = low
+        self.high = high
+
+
+    def getQuery(self, store):
+        tableName = self.index.getTableName(store)
+        if tableName.split('.')[-1] in store.pendingIndexes():
+            return '(%s <= ? AND %s >= ?)' % (
+                self.index.start.getColumnName(store),
+                self.index.end.getColumnName(store))
+        return '(%s IN (SELECT id FROM %s WHERE low <= ? AND high >= ?))' % (
+            self.index.type.storeID.getColumnName(store), tableName)
+
+
+    def getArgs(self, store):
+        return [self.index.start.infilter(self.high, None, store),
+                self.index.end.infilter(self.low, None, store)]
+
+
+    def getInvolvedTables(self):
+        # The R*Tree is searched in a subquery, so that it is not needed while
+        # it is pending; it only changes along with the item type's table.
+        return [self.index.type]
+
+
+    def __repr__(self):
+        return '%r.overlapping(%r, %r)' % (self.index, self.low, self.high)
+
+
+
+class IntervalIndex(object):
+    """
+    An SQLite R*Tree index of the intervals between two numeric attributes of
+    an item type, such as the start and end of an appointment, used by
+    L{axiom.queryutil.overlapping} and L{axiom.queryutil.contains}.
+
+    Like a L{FullTextIndex}, the index is kept up to date by triggers on the
+    item type's table.  Items with C{None} for either attribute are left out
+    of it.
+
+    @ivar start: The attribute for the start of each interval.
+    @ivar end: The attribute for the end of each interval.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+    type = property(lambda self: self.start.type)
+
+
+    def overlapping(self, low, high):
+        """
+        Select the items whose intervals might overlap the range from C{low}
+        to C{high}, inclusive.
+
+        @rtype: L{IntervalOverlap}
+        """
+        return IntervalOverlap(self, low, high)
+
+
+    def getTableName(self, store):
+        return store.getIntervalTableName(self)
+
+
+    def getTableAlias(self, store, currentAliases):
+        return None
+
+
+    def __repr__(self):
+        return 'intervalIndex(%s, %s)' % (self.start.fullyQualifiedName(),
+                                          self.end.fullyQualifiedName())
+
+
+
+def intervalIndex(start, end):
+    """
+    Declare an index of the intervals between two numeric attributes of an
+    item type::
+
+        class Appointment(Item):
+            start = timestamp()
+            end = timestamp()
+            period = intervalIndex(start, end)
+
+        store.query(Appointment,
+                    overlapping(Appointment.start, Appointment.end,
+                                lunchtime, teatime))
+
+    L{axiom.queryutil.overlapping} and L{axiom.queryutil.contains} use the
+    index for the same attributes automatically.
+
+    @rtype: L{IntervalIndex}
+    """
+    for column in start, end:
+        if not isinstance(column, SQLAttribute) or column.sqltype not in (
+                'INTEGER', 'REAL'):
+            raise TypeError(
+                'intervalIndex() can only index numeric attributes, not %r' % (
+                    column,))
+    index = IntervalIndex(start, end)
+    start.intervalIndexes.append(index)
+    end.intervalIndexes.append(index)
+    return index
+
+
+
+class _DeferredBatch(object):
+    """
+    Some items, such as a page of the results of a query, whose values for
+    deferred attributes have not been loaded.  This stands in for those
+    values, and the first time one of them is accessed, it is loaded for all
+    of the items at once.
+
+    @ivar store: The L{axiom.store.Store} containing the items.
+    @ivar storeIDs: A C{list} of the storeIDs of the items.
+    """
+    # The number of items to load values for in one statement.
+    size = 100
+
+    def __init__(self, store):
+        self.store = store
+        self.storeIDs = []
+
+
+    def load(self, attribute, oself):
+        """
+        Load the values of an attribute for each of the items which are still
+        in memory and waiting for them, including C{oself}.
+
+        @return: The database value for C{oself}.
+
+        @raise ItemNotFound: If C{oself} is no longer in the database.
+        """
+        waiting = {oself.storeID: oself}
+        for storeID in self.storeIDs:
+            try:
+                other = self.store.objectCache.get(storeID)
+            except KeyError:
+                continue
+            if getattr(other, attribute.dbunderlying, None) is self:
+                waiting[storeID] = other
+        storeIDs = list(waiting)
+        for start in range(0, len(storeIDs), self.size):
+            chunk = storeIDs[start:start + self.size]
+            for storeID, dbval in self.store.querySQL(
+                    'SELECT oid, %s FROM %s WHERE oid IN (%s)' % (
+                        attribute.getShortColumnName(self.store),
+                        oself.getTableName(self.store),
+                        ', '.join(['?'] * len(chunk))),
+                    chunk):
+                setattr(waiting[storeID], attribute.dbunderlying, dbval)
+        dbval = getattr(oself, attribute.dbunderlying)
+        if dbval is self:
+            raise ItemNotFound(
+                "Cannot load %s: %r is no longer in the database" % (
+                    attribute.attrname, oself.storeID))
+        return dbval
 
 
 
@@ -321,14 +873,30 @@ class SQLAttribute(inmemory, Comparable):
     @ivar indexed: A C{bool} indicating whether this attribute will be indexed
     in the database.
 
+    @ivar unique: A C{bool} indicating whether this attribute will have a
+    unique index in the database, so that no two items may have the same
+    value of it, other than C{None}.  Creating or changing an item so that
+    two would raises L{axiom.errors.UniqueConstraintViolation}.
+
     @ivar default: The value used for this attribute, if no value is specified.
+
+    @ivar deferred: A C{bool} indicating whether this attribute is left out
+    when items are loaded by a query, and only loaded when it is first
+    accessed.  This is worthwhile for large values which are not often used,
+    such as message bodies.  See L{axiom.store.Store.query}.
     """
     sqltype = None
 
-    def __init__(self, doc='', indexed=False, default=None, allowNone=True, defaultFactory=None):
+    def __init__(self, doc='', indexed=False, default=None, allowNone=True,
+                 defaultFactory=None, deferred=False, unique=False):
         inmemory.__init__(self, doc)
         self.indexed = indexed
+        self.unique = unique
+        self.deferred = deferred
         self.compoundIndexes = []
+        self.fullTextIndexes = []
+        self.intervalIndexes = []
+        self._predicateValues = []
         self.allowNone = allowNone
         self.default = default
         self.defaultFactory = defaultFactory
@@ -456,6 +1024,8 @@ class SQLAttribute(inmemory, Comparable):
                 # would be worthwhile.
 
                 return self.default
+            if isinstance(dbval, _DeferredBatch):
+                dbval = dbval.load(self, oself)
             pyval = self.outfilter(dbval, oself)
             # An upgrader may have changed the value of this attribute.  If so,
             # return the new value, not the old one.
@@ -465,6 +1035,17 @@ class SQLAttribute(inmemory, Comparable):
             setattr(oself, self.underlying, pyval)
         return pyval
 
+    def _unload(self, oself):
+        """
+        Forget the value of this attribute for C{oself}, because the value in
+        the database has been changed behind its back.  It will be loaded
+        again when it is next accessed.
+        """
+        batch = _DeferredBatch(oself.store)
+        batch.storeIDs.append(oself.storeID)
+        self.loaded(oself, batch)
+
+
     def loaded(self, oself, dbval):
         """
         This method is invoked when the item is loaded from the database, and
@@ -548,11 +1129,29 @@ class AttributeValueComparison:
         self.operationString = operationString
         self.value = value
 
+    def _indexedLiteral(self, store):
+        """
+        If this comparison is also part of the predicate of a partial index,
+        return the SQL literal for its value, so that SQLite can match it
+        against the index; otherwise, return C{None}.
+        """
+        for operationString, value in getattr(
+                self.attribute, '_predicateValues', ()):
+            if operationString == self.operationString and value == self.value:
+                return _sqlLiteral(
+                    self.attribute.infilter(self.value, None, store))
+        return None
+
     def getQuery(self, store):
-        return ('(%s %s ?)' % (self.attribute.getColumnName(store),
-                               self.operationString))
+        literal = self._indexedLiteral(store)
+        if literal is None:
+            literal = '?'
+        return ('(%s %s %s)' % (self.attribute.getColumnName(store),
+                                self.operationString, literal))
 
     def getArgs(self, store):
+        if self._indexedLiteral(store) is not None:
+            return []
         return [self.attribute.infilter(self.value, None, store)]
 
     def getInvolvedTables(self):
@@ -656,6 +1255,62 @@ class LikeComparison:
         return l
 
 
+def _dependentTables(comparison):
+    """
+    Find the tables whose contents the result of a comparison depends on:
+    those it involves, and those of any subqueries it makes.
+
+    Comparisons which make subqueries provide a C{getDependentTables} method,
+    which is not part of L{IComparison}.
+
+    @param comparison: an L{IComparison} provider.
+
+    @return: a C{list} of tables.
+    """
+    getDependentTables = getattr(comparison, 'getDependentTables', None)
+    if getDependentTables is None:
+        return comparison.getInvolvedTables()
+    return getDependentTables()
+
+
+
+def _withPathJoins(comparison, tables=()):
+    """
+    Add to a comparison the comparisons which join the items at the ends of
+    the reference paths it involves to the items they are referred to by, as
+    made by L{reference.via}.  These are added once, at the top level of the
+    comparison, so that they still constrain the query when the path is
+    compared inside an L{OR} or a L{NOT}.
+
+    Tables at the ends of reference paths have a C{_pathJoin} attribute,
+    their join comparison, which is not part of any interface.
+
+    @param comparison: an L{IComparison} provider, or C{None}.
+    @param tables: Tables which the query involves other than through
+        C{comparison}, such as those of the columns it is sorted by.
+
+    @return: an L{IComparison} provider, or C{None}.
+    """
+    pending = list(tables)
+    if comparison is not None:
+        pending.extend(comparison.getInvolvedTables())
+    joins = []
+    while pending:
+        join = getattr(pending.pop(), '_pathJoin', None)
+        if join is None or [j for j in joins if j is join]:
+            continue
+        joins.append(join)
+        pending.extend(join.getInvolvedTables())
+    if not joins:
+        return comparison
+    if comparison is not None:
+        joins.insert(0, comparison)
+    if len(joins) == 1:
+        return joins[0]
+    return AND(*joins)
+
+
+
 @implementer(IComparison)
 class AggregateComparison:
     """
@@ -691,13 +1346,43 @@ class AggregateComparison:
                     t for t in cond.getInvolvedTables() if t not in tables])
         return tables
 
+    def getDependentTables(self):
+        tables = []
+        for cond in self.conditions:
+            tables.extend([
+                    t for t in _dependentTables(cond) if t not in tables])
+        return tables
+
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__,
                            ', '.join(map(repr, self.conditions)))
 
 
+def _jsonArray(values):
+    """
+    Encode some database values as a JSON array, if they can all be.
+
+    @return: the array as text, or C{None} if some value, such as a byte
+        string or an infinite float, has no JSON form.
+    """
+    for value in values:
+        if isinstance(value, float):
+            if math.isinf(value) or math.isnan(value):
+                return None
+        elif not (value is None or
+                  isinstance(value, (six.text_type,) + six.integer_types)):
+            return None
+    return six.text_type(json.dumps(values, ensure_ascii=False))
+
+
+
 @implementer(IComparison)
 class SequenceComparison:
+    # Sequences with more elements than this are passed to SQLite as one JSON
+    # array rather than as one parameter each, which could exceed SQLite's
+    # limit on the number of parameters.
+    largeSequenceThreshold = 500
+
     def __init__(self, attribute, container, negate):
         self.attribute = attribute
         self.container = container
@@ -759,20 +1444,36 @@ class SequenceComparison:
         Smash whatever we got into a list and save the result in case we are
         executed multiple times.  This keeps us from tripping up over
         generators and the like.
+
+        Each element of the data is filtered using the attribute type being
+        tested for containment.  More than C{largeSequenceThreshold} of them
+        are passed as a single JSON array, read with C{json_each}, rather
+        than as a parameter each.
         """
         if self._sequence is None:
             self._sequence = list(self.container)
-            self._clause = ', '.join(['?'] * len(self._sequence))
+            self._sequenceValues = [
+                self.attribute.infilter(pyval, None, store)
+                for pyval in self._sequence]
+            encoded = None
+            if (len(self._sequenceValues) > self.largeSequenceThreshold and
+                    HAS_JSON):
+                encoded = _jsonArray(self._sequenceValues)
+            if encoded is None:
+                self._clause = ', '.join(['?'] * len(self._sequenceValues))
+            else:
+                self._clause = 'SELECT value FROM json_each(?)'
+                self._sequenceValues = [encoded]
         return self._clause
 
 
     def _sequenceArgs(self, store):
         """
-        Filter each element of the data using the attribute type being
-        tested for containment and hand back the resulting list.
+        Hand back the arguments for the data, as L{_sequenceContainer}
+        arranged them.
         """
         self._sequenceContainer(store) # Force _sequence to be valid
-        return [self.attribute.infilter(pyval, None, store) for pyval in self._sequence]
+        return self._sequenceValues
 
 
     # IComparison - getArgs is assigned as an instance attribute
@@ -787,6 +1488,14 @@ class SequenceComparison:
         return [self.attribute.type]
 
 
+    def getDependentTables(self):
+        tables = self.getInvolvedTables()
+        if IQuery.providedBy(self.container):
+            tables.extend([t for t in getattr(self.container, '_tables', ())
+                           if t not in tables])
+        return tables
+
+
 
 class AND(AggregateComparison):
     """
@@ -801,6 +1510,139 @@ class OR(AggregateComparison):
     operator = 'OR'
 
 
+_subqueryCount = 0
+
+@implementer(IComparison)
+class Exists(object):
+    """
+    A comparison which is true when a correlated subquery has results: when
+    some items of other types meet a comparison, which may refer to the items
+    of the enclosing query.  See L{exists} and L{notExists}.
+
+    @ivar tableClass: The L{Item} subclass or L{axiom.item.Placeholder}
+        selected by the subquery, or a tuple of them to join.
+    @ivar comparison: An L{IComparison} provider, or C{None}.
+    @ivar negate: If true, the comparison is true when the subquery has no
+        results instead.
+    """
+    def __init__(self, tableClass, comparison=None, negate=False):
+        global _subqueryCount
+        self.tableClass = tableClass
+        self.comparison = _withPathJoins(comparison)
+        self.negate = negate
+        self._aliasPrefix = 'subquery_%d_' % (_subqueryCount,)
+        _subqueryCount += 1
+
+
+    def _innerTables(self):
+        """
+        Return a list of the tables selected by the subquery, and those at the
+        ends of the reference paths its comparison follows.
+        """
+        if isinstance(self.tableClass, tuple):
+            tables = list(self.tableClass)
+        else:
+            tables = [self.tableClass]
+        if self.comparison is not None:
+            tables.extend([
+                table for table in self.comparison.getInvolvedTables()
+                if getattr(table, '_pathJoin', None) is not None
+                and table not in tables])
+        return tables
+
+
+    def getQuery(self, store):
+        fromClauseParts = []
+        tableAliases = []
+        for table in self._innerTables():
+            tableName = table.getTableName(store)
+            if getattr(table, '_placeholderTableAlias', False) is None:
+                # A Placeholder which has not been given an alias yet.  Its
+                # alias must not be one the enclosing query may be using, so
+                # it comes from this subquery's own namespace.
+                table._placeholderTableAlias = (
+                    self._aliasPrefix + str(len(tableAliases)))
+            tableAlias = table.getTableAlias(store, tuple(tableAliases))
+            if tableAlias is None:
+                fromClauseParts.append(tableName)
+            else:
+                tableAliases.append(tableAlias)
+                fromClauseParts.append('%s AS %s' % (tableName, tableAlias))
+        sql = 'SELECT 1 FROM ' + ', '.join(fromClauseParts)
+        if self.comparison is not None:
+            sql += ' WHERE ' + self.comparison.getQuery(store)
+        return '(%sEXISTS (%s))' % (self.negate and 'NOT ' or '', sql)
+
+
+    def getArgs(self, store):
+        if self.comparison is None:
+            return []
+        return self.comparison.getArgs(store)
+
+
+    def getInvolvedTables(self):
+        """
+        Return the tables of the enclosing query which the subquery refers
+        to: those its comparison involves, other than its own.
+        """
+        if self.comparison is None:
+            return []
+        inner = self._innerTables()
+        return [t for t in self.comparison.getInvolvedTables()
+                if t not in inner]
+
+
+    def getDependentTables(self):
+        tables = self._innerTables()
+        if self.comparison is not None:
+            tables.extend([t for t in _dependentTables(self.comparison)
+                           if t not in tables])
+        return tables
+
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.negate and 'notExists' or 'exists',
+                               self.tableClass, self.comparison)
+
+
+
+def exists(tableClass, comparison=None):
+    """
+    Select the items for which some items of another type meet a comparison,
+    which refers to the items being selected.  For example, the folders
+    containing an unread message::
+
+        store.query(Folder, exists(Message, AND(
+            Message.folder == Folder.storeID, Message.read == False)))
+
+    Unlike joining the other type into the query and making it distinct,
+    SQLite stops looking at the first such item.
+
+    @param tableClass: The L{Item} subclass to look for items of, an
+        L{axiom.item.Placeholder} for the type being selected, or a tuple of
+        them to join.  Every type the comparison involves which is not one of
+        these is part of the enclosing query.
+
+    @param comparison: An L{IComparison} provider, or C{None} to look for
+        any items.
+
+    @rtype: L{Exists}
+    """
+    return Exists(tableClass, comparison)
+
+
+
+def notExists(tableClass, comparison=None):
+    """
+    Select the items for which no items of another type meet a comparison;
+    the opposite of L{exists}.
+
+    @rtype: L{Exists}
+    """
+    return Exists(tableClass, comparison, negate=True)
+
+
+
 @implementer(IComparison)
 class TableOrderComparisonWrapper(object):
     """
@@ -829,6 +1671,11 @@ class TableOrderComparisonWrapper(object):
         return self.comparison.getArgs(store)
 
 
+    def getDependentTables(self):
+        return self.tables + [t for t in _dependentTables(self.comparison)
+                              if t not in self.tables]
+
+
 
 class boolean(SQLAttribute):
     sqltype = 'BOOLEAN'
@@ -929,6 +1776,58 @@ class bytes(SQLAttribute):
         return six.binary_type(dbval)
 
 
+    def openBlob(self, oself, length=None, writable=False):
+        """
+        Open the value of this attribute on an item for reading or writing
+        incrementally, without loading all of it into memory::
+
+            with Message.body.openBlob(message) as blob:
+                transport.write(blob.read(65536))
+
+        The item's pending changes are written to the database first.  The
+        size of the value cannot be changed through the returned file, but a
+        new value of a given size can be allocated and then written in
+        chunks::
+
+            with Message.body.openBlob(message, length=size) as blob:
+                for chunk in chunks:
+                    blob.write(chunk)
+
+        @param oself: An item in a store, whose value for this attribute is
+            not C{None} unless C{length} is given.
+
+        @param length: If not C{None}, first replace the value with this many
+            zero bytes, and open it for writing.
+
+        @param writable: Whether to open the existing value for writing.
+
+        @return: A readable, seekable raw binary file, supporting C{readinto}
+            for reading into a preallocated buffer.
+        @rtype: L{axiom._pysqlite2.Blob}
+        """
+        store = oself.store
+        if store is None:
+            raise TypeError("%r is not in a store" % (oself,))
+        if not store.autocommit:
+            store.checkpoint()
+        tableName = oself.getTableName(store)
+        if length is not None:
+            writable = True
+        if writable:
+            # The change is noted before it is made, as the writes to the blob
+            # are made after this returns anyway.
+            store._tableChanged(oself.__class__)
+            self._unload(oself)
+        if length is not None:
+            store.executeSQL(
+                'UPDATE %s SET %s = zeroblob(?) WHERE oid = ?' % (
+                    tableName, self.getShortColumnName(store)),
+                [length, oself.storeID])
+        databaseName, tableName = tableName.split('.', 1)
+        return store.connection.openBlob(
+            databaseName, tableName, self.attrname, oself.storeID, writable)
+
+
     @deprecated(Version("Axiom", 0, 7, 5))
     def like(self, *others):
         return super(SQLAttribute, self).like(*others)
@@ -1009,6 +1908,127 @@ class textlist(text):
         result = self.delimiter.join([self.guard] + list(pyval))
         return super(textlist, self).infilter(result, oself, store)
 
+class compressedbytes(bytes):
+    """
+    Attribute representing a sequence of bytes, like L{bytes}, which is
+    compressed with zlib when it is stored if it is long enough for that to be
+    worthwhile.  Values are decompressed when they are first accessed.
+
+    Stored values are not meaningful to SQL, so attributes of this type can be
+    compared for equality but not ordered or matched against patterns.
+
+    @ivar threshold: The length in bytes below which values are stored
+        uncompressed.
+    @ivar level: The zlib compression level, from 1 (fastest) to 9 (smallest).
+    @ivar dictionary: If not C{None}, a preset zlib dictionary: a byte string
+        of sequences which are expected to be common in values of this
+        attribute, such as boilerplate headers.  Changing it makes existing
+        values unreadable.  Only supported on Python 3.
+    """
+
+    # Every stored value starts with one of these, saying how the rest of it
+    # is stored.
+    _RAW = b'\x00'
+    _ZLIB = b'\x01'
+
+    def __init__(self, doc='', **kw):
+        threshold = kw.pop('threshold', 512)
+        level = kw.pop('level', 6)
+        dictionary = kw.pop('dictionary', None)
+        bytes.__init__(self, doc, **kw)
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+        if dictionary is None:
+            self._dictionaryArgs = {}
+        else:
+            self._dictionaryArgs = {'zdict': dictionary}
+
+
+    def compress(self, data):
+        """
+        Convert a byte string to the form in which it is stored.
+        """
+        if len(data) >= self.threshold:
+            compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                zlib.Z_DEFAULT_STRATEGY, **self._dictionaryArgs)
+            compressed = compressor.compress(data) + compressor.flush()
+            if len(compressed) < len(data):
+                return self._ZLIB + compressed
+        return self._RAW + data
+
+
+    def decompress(self, stored):
+        """
+        Convert a stored value back to the byte string it was made from.
+        """
+        stored = six.binary_type(stored)
+        if stored[:1] == self._ZLIB:
+            decompressor = zlib.decompressobj(
+                zlib.MAX_WBITS, **self._dictionaryArgs)
+            return decompressor.decompress(stored[1:]) + decompressor.flush()
+        return stored[1:]
+
+
+    def compare(self, other, sqlop):
+        if sqlop not in ('=', '!='):
+            raise TypeError(
+                "%r can only be compared for equality, not with %s" % (
+                    self, sqlop))
+        return bytes.compare(self, other, sqlop)
+
+
+    def _like(self, *a):
+        raise TypeError("%r cannot be matched against patterns" % (self,))
+
+
+    def infilter(self, pyval, oself, store):
+        data = bytes.infilter(self, pyval, oself, store)
+        if data is None:
+            return None
+        return self.compress(data)
+
+
+    def outfilter(self, dbval, oself):
+        if dbval is None:
+            return None
+        return self.decompress(dbval)
+
+
+    def openBlob(self, oself, length=None, writable=False):
+        """
+        Compressed values cannot be read or written incrementally.
+
+        @raise TypeError: Always.
+        """
+        raise TypeError("%r cannot be opened as a BLOB" % (self,))
+
+
+
+class compressedtext(compressedbytes):
+    """
+    Attribute representing a sequence of characters, like L{text}, which is
+    stored as UTF-8 and compressed like L{compressedbytes}.  Unlike L{text},
+    comparisons are always case-sensitive.
+    """
+
+    def infilter(self, pyval, oself, store):
+        if pyval is None:
+            return None
+        if not isinstance(pyval, six.text_type) or u'\0' in pyval:
+            raise ConstraintError(
+                self, "unicode string without NULL bytes", pyval)
+        return self.compress(pyval.encode('utf-8'))
+
+
+    def outfilter(self, dbval, oself):
+        if dbval is None:
+            return None
+        return self.decompress(dbval).decode('utf-8')
+
+
+
 class path(text):
     """
     Attribute representing a pathname in the filesystem.  If 'relative=True',
@@ -1096,6 +2116,7 @@ class timestamp(integer):
 
 _cascadingDeletes = {}
 _disallows = {}
+_nullifies = {}
 
 class reference(integer):
     NULLIFY = object()
@@ -1112,12 +2133,49 @@ class reference(integer):
             "reference.NULLIFY, reference.CASCADE, reference.DISALLOW")
         self.reftype = reftype
         self.whenDeleted = whenDeleted
-        if whenDeleted is reference.CASCADE:
-            # Note; this list is technically in a slightly inconsistent state
-            # as things are being built.
-            _cascadingDeletes.setdefault(reftype, []).append(self)
-        if whenDeleted is reference.DISALLOW:
-            _disallows.setdefault(reftype, []).append(self)
+        self._paths = {}
+
+
+    def _register(self):
+        """
+        Record this reference as one to be examined when items of its
+        C{reftype} are deleted.  This is done by L{axiom.item.MetaItem} once
+        the item type this reference belongs to has been created, so that the
+        references of types whose definitions failed are never examined.
+        """
+        if self.whenDeleted is reference.CASCADE:
+            registry = _cascadingDeletes
+        elif self.whenDeleted is reference.DISALLOW:
+            registry = _disallows
+        else:
+            registry = _nullifies
+        registry.setdefault(self.reftype, []).append(self)
+
+
+    def via(self, reftype=None):
+        """
+        Follow this reference to the items it refers to, to compare or sort
+        on their attributes.  For example, the messages in folders owned by
+        someone, sorted by the names of their folders::
+
+            store.query(Message, Message.folder.via(Folder).owner == alice,
+                        sort=Message.folder.via(Folder).name.ascending)
+
+        The items referred to are joined to the query under an alias of
+        their own, so this works even if their type is also in the query
+        for another reason, and a query only includes those items which
+        refer to one.  The attributes of the items at the end of the path
+        which are references can themselves be followed with C{via}.
+
+        @param reftype: The type of the items referred to, which is needed
+            if this reference does not declare it.
+
+        @rtype: L{axiom.item.ReferencePath}
+        """
+        # axiom.item imports this module.
+        from axiom.item import _followReference
+        return _followReference(self, self, reftype)
+
 
     def reprFor(self, oself):
         obj = getattr(oself, self.underlying, None)
@@ -1127,6 +2185,8 @@ class reference(integer):
             else:
                 return 'reference(unstored@%d)' % (id(obj),)
         sid = getattr(oself, self.dbunderlying, None)
+        if isinstance(sid, _DeferredBatch):
+            sid = sid.load(self, oself)
         if sid is None:
             return 'None'
         return 'reference(%d)' % (sid,)
@@ -76,6 +76,14 @@ class SQLError(RuntimeError):
             self.underlying.__class__, self.underlying)
 
 
+class UniqueConstraintViolation(SQLError):
+    """
+    An item was created or changed so that two items would have the same
+    values of the attributes of a unique index, declared with
+    C{unique=True}.
+    """
+
+
 class TableAlreadyExists(SQLError):
     """
     Axiom internally created a table at the same time as another database.
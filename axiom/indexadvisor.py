@@ -0,0 +1,282 @@
+# -*- test-case-name: axiom.test.test_indexadvisor -*-
+
+"""
+Suggest indexes for the queries an application actually performs.
+
+A L{QueryShapeRecorder} watches the queries made against a store, records the
+SQL of each distinct query (its I{shape}, with the values it was made with
+left out) together with how often it ran and how long it took, and
+periodically saves them in the store as L{QueryShape} items::
+
+    QueryShapeRecorder(store).setServiceParent(IServiceCollection(store))
+
+L{adviseIndexes} later runs each recorded shape through C{EXPLAIN QUERY PLAN}.
+Shapes which make SQLite scan a whole item table, or sort their results in a
+temporary B-tree, lead to suggestions of C{indexed=True} attributes or
+L{compoundIndex <axiom.attributes.compoundIndex>} declarations, ranked by the
+time spent running the queries that would benefit.  The I{axiomatic indexes}
+command prints these suggestions for a store.
+"""
+
+import re
+
+from twisted.python import log
+from twisted.internet.task import LoopingCall
+from twisted.application.service import Service
+
+from axiom import iaxiom, errors
+from axiom.item import Item, _typeNameToMostRecentClass
+from axiom.attributes import text, integer, ieee754_double
+
+
+
+_PARAMETER_LIST = re.compile(r'\?(?:, \?)+')
+_COLUMN = re.compile(r'\b\w+\.(item_\w+_v\d+)\.(?:\[(\w+)\]|oid\b)')
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?:\w+\.)?(item_\w+_v\d+)(?: AS \w+)?$')
+_TEMP_SORT = re.compile(r'^USE TEMP B-TREE FOR .*ORDER BY$')
+
+
+
+def normalizeShape(sql):
+    """
+    Reduce the SQL for a query to its shape, so that queries which differ only
+    in the number of values they compare a column to are considered alike.
+
+    @param sql: The SQL for a query, with a placeholder for each value.
+    @type sql: C{str}
+
+    @rtype: C{str}
+    """
+    return _PARAMETER_LIST.sub('?', sql)
+
+
+
+class QueryShape(Item):
+    """
+    A kind of query which has been made against this store.
+
+    @ivar sql: The normalized SQL of the query.
+    @ivar count: The number of times a query of this shape has been made.
+    @ivar totalTime: The total number of seconds spent making these queries.
+    """
+    typeName = 'axiom_query_shape'
+    schemaVersion = 1
+
+    sql = text(allowNone=False, indexed=True)
+    count = integer(allowNone=False, default=0)
+    totalTime = ieee754_double(allowNone=False, default=0.0)
+
+
+
+class QueryShapeRecorder(Service, object):
+    """
+    Record the shapes of the queries made against a store.
+
+    While running, the shapes are accumulated in memory and saved to the store
+    every C{flushInterval} seconds, and when the service stops.
+
+    @ivar store: The L{axiom.store.Store} whose queries are recorded.
+    @ivar flushInterval: The number of seconds between saves.
+    @ivar shapes: A C{dict} mapping normalized SQL to a two-element C{list} of
+        the number of queries and the total time taken, for the queries which
+        have not yet been saved.
+    """
+    def __init__(self, store, flushInterval=60):
+        self.store = store
+        self.flushInterval = flushInterval
+        self.shapes = {}
+        self._flushCall = LoopingCall(self.flush)
+
+
+    def startService(self):
+        Service.startService(self)
+        log.addObserver(self.observe)
+        self._flushCall.start(self.flushInterval, now=False)
+
+
+    def stopService(self):
+        Service.stopService(self)
+        log.removeObserver(self.observe)
+        self._flushCall.stop()
+        self.flush()
+
+
+    def observe(self, event):
+        """
+        Log observer which accumulates the query events for C{store}.
+        """
+        if (event.get('interface') is not iaxiom.IStatEvent
+                or event.get('queryStore') is not self.store
+                or 'querySQL' not in event):
+            return
+        shape = normalizeShape(event['querySQL'])
+        if QueryShape.typeName in shape:
+            # Don't advise on our own bookkeeping.
+            return
+        counts = self.shapes.setdefault(shape, [0, 0.0])
+        counts[0] += 1
+        counts[1] += event['queryTime']
+
+
+    def flush(self):
+        """
+        Save the accumulated shapes to the store.
+        """
+        shapes, self.shapes = self.shapes, {}
+        def save():
+            for sql, (count, totalTime) in shapes.items():
+                shape = self.store.findOrCreate(QueryShape, sql=sql)
+                shape.count += count
+                shape.totalTime += totalTime
+        if shapes:
+            self.store.transact(save)
+
+
+
+class IndexSuggestion(object):
+    """
+    An index which would help some of the queries made against a store.
+
+    @ivar typeName: The C{typeName} of the item type to index.
+    @ivar itemType: The L{Item} subclass to index, if it is loaded, or
+        C{None}.
+    @ivar attributeNames: A C{tuple} of the names of the attributes to index,
+        in index order.
+    @ivar count: The number of queries which would have benefited.
+    @ivar totalTime: The number of seconds spent on those queries.
+    @ivar reasons: A C{set} of descriptions of the problems the index would
+        solve.
+    """
+    def __init__(self, typeName, itemType, attributeNames):
+        self.typeName = typeName
+        self.itemType = itemType
+        self.attributeNames = attributeNames
+        self.count = 0
+        self.totalTime = 0.0
+        self.reasons = set()
+
+
+    def declaration(self):
+        """
+        Describe the declaration which would create this index.
+
+        @rtype: C{str}
+        """
+        if self.itemType is None:
+            name = self.typeName
+        else:
+            name = self.itemType.__name__
+        if len(self.attributeNames) == 1:
+            return '%s.%s: indexed=True' % (name, self.attributeNames[0])
+        return 'compoundIndex(%s)' % (', '.join(
+            '%s.%s' % (name, attributeName)
+            for attributeName in self.attributeNames),)
+
+
+    def __repr__(self):
+        return '<IndexSuggestion %s: %d queries, %.3fs>' % (
+            self.declaration(), self.count, self.totalTime)
+
+
+
+def _typeForTable(tableName):
+    """
+    Find the type name and loaded item class for an item table.
+    """
+    typeName, version = tableName[len('item_'):].rsplit('_v', 1)
+    itemType = _typeNameToMostRecentClass.get(typeName)
+    if itemType is not None and itemType.schemaVersion != int(version):
+        itemType = None
+    return typeName, itemType
+
+
+
+def _columnsByTable(sql):
+    """
+    Find the attribute columns mentioned in a fragment of SQL.
+
+    @return: A C{dict} mapping table names to C{list}s of attribute names, in
+        the order they first appear.
+    """
+    columns = {}
+    for tableName, attributeName in _COLUMN.findall(sql):
+        names = columns.setdefault(tableName, [])
+        # The storeID is part of every index already.
+        if attributeName and attributeName not in names:
+            names.append(attributeName)
+    return columns
+
+
+
+def explainShape(store, sql):
+    """
+    Find the problems in SQLite's plan for a query.
+
+    @return: A two-tuple of a C{set} of the names of tables which are scanned
+        in full, and a C{bool} indicating whether the results are sorted in a
+        temporary B-tree.
+    """
+    try:
+        plan = store.querySQL('EXPLAIN QUERY PLAN ' + sql,
+                              [None] * sql.count('?'))
+    except errors.SQLError:
+        log.msg("Could not explain query shape %r." % (sql,))
+        return set(), False
+    scanned = set()
+    tempSort = False
+    for row in plan:
+        detail = row[-1]
+        match = _FULL_SCAN.match(detail)
+        if match is not None:
+            scanned.add(match.group(1))
+        elif _TEMP_SORT.match(detail) is not None:
+            tempSort = True
+    return scanned, tempSort
+
+
+
+def adviseIndexes(store):
+    """
+    Suggest indexes which would improve the queries recorded in C{store}.
+
+    @return: A C{list} of L{IndexSuggestion}s, ranked by the time spent on the
+        queries they would improve.
+    """
+    suggestions = {}
+    def suggest(tableName, attributeNames, shape, reason):
+        key = (tableName, tuple(attributeNames))
+        if key not in suggestions:
+            typeName, itemType = _typeForTable(tableName)
+            suggestions[key] = IndexSuggestion(
+                typeName, itemType, tuple(attributeNames))
+        suggestion = suggestions[key]
+        suggestion.count += shape.count
+        suggestion.totalTime += shape.totalTime
+        suggestion.reasons.add(reason)
+
+    for shape in store.query(QueryShape):
+        scanned, tempSort = explainShape(store, shape.sql)
+        if not scanned and not tempSort:
+            continue
+        sql, _, sortClause = shape.sql.partition(' ORDER BY ')
+        _, _, whereClause = sql.partition(' WHERE ')
+        filtered = _columnsByTable(whereClause)
+        ordering = _columnsByTable(sortClause)
+        for tableName in scanned:
+            if filtered.get(tableName):
+                suggest(tableName, filtered[tableName], shape, 'full scan')
+        if tempSort:
+            for tableName, sortNames in ordering.items():
+                attributeNames = list(filtered.get(tableName, []))
+                attributeNames.extend(
+                    name for name in sortNames if name not in attributeNames)
+                if attributeNames:
+                    suggest(tableName, attributeNames, shape, 'temporary sort')
+
+    return sorted(suggestions.values(),
+                  key=lambda suggestion: suggestion.totalTime, reverse=True)
+
+
+
+__all__ = ['normalizeShape', 'QueryShape', 'QueryShapeRecorder',
+           'IndexSuggestion', 'explainShape', 'adviseIndexes']
@@ -7,7 +7,7 @@ import six
 from zope.interface import implementer, Interface
 
 from inspect import getabsfile
-from weakref import WeakValueDictionary
+from weakref import WeakValueDictionary, WeakKeyDictionary
 
 from twisted.python import log
 from twisted.python.reflect import qual, namedAny
@@ -16,13 +16,15 @@ from twisted.application.service import (
     IService, IServiceCollection, MultiService)
 
 from axiom import slotmachine, _schema, iaxiom
-from axiom.errors import ChangeRejected, DeletionDisallowed
+from axiom.errors import (
+    ChangeRejected, DeletionDisallowed, UniqueConstraintViolation)
 from axiom.iaxiom import IColumn, IPowerupIndirector
 
 from axiom.attributes import (
     SQLAttribute, _ComparisonOperatorMuxer, _MatchingOperationMuxer,
     _OrderingMixin, _ContainableMixin, Comparable, compare, inmemory,
-    reference, text, integer, AND, _cascadingDeletes, _disallows)
+    reference, text, integer, AND, compoundIndex, _cascadingDeletes,
+    _disallows, _nullifies)
 import six
 from six.moves import zip
 from functools import total_ordering
@@ -71,6 +73,7 @@ class MetaItem(slotmachine.SchemaMetaMachine):
             gc.collect()
         if T.typeName in _typeNameToMostRecentClass:
             if T.__legacy__:
+                meta._registerReferences(T)
                 return T
             otherT = _typeNameToMostRecentClass[T.typeName]
 
@@ -91,9 +94,23 @@ class MetaItem(slotmachine.SchemaMetaMachine):
             raise RuntimeError("2 definitions of axiom typename {!r}: {!r} {!r}".format(
                     T.typeName, T, _typeNameToMostRecentClass[T.typeName]))
         _typeNameToMostRecentClass[T.typeName] = T
+        meta._registerReferences(T)
         return T
 
 
+    @staticmethod
+    def _registerReferences(T):
+        """
+        Register the references of a newly created item type for deletion
+        handling.
+
+        @param T: An L{Item} subclass.
+        """
+        for name, atr in T.__attributes__:
+            if isinstance(atr, reference):
+                atr._register()
+
+
     def __cmp__(self, other):
         """
         Ensure stable sorting between Item classes.  This provides determinism
@@ -371,22 +388,64 @@ class Empowered(object):
             yield inMemoryPowerup
         if self.store is None:
             return
-        name = qual(interface)
-        for cable in self.store.query(
-            _PowerupConnector,
-            AND(_PowerupConnector.interface == name,
-                _PowerupConnector.item == self),
-            sort=_PowerupConnector.priority.descending):
+        for pup in self._loadPowerups(qual(interface)):
+            if not pup._currentlyValidAsReferentFor(self.store):
+                # Deleted since it was found, possibly by an earlier iteration
+                # of this loop.
+                continue
+            indirector = IPowerupIndirector(pup, None)
+            if indirector is not None:
+                yield indirector.indirect(interface)
+            else:
+                yield pup
+
+
+    def _loadPowerups(self, name):
+        """
+        Find the powerups installed on this object for an interface, in order
+        of descending priority.
+
+        The storeIDs of the powerups are kept in the store's C{_powerupCache},
+        so that only the first lookup for each interface has to query
+        L{_PowerupConnector}.  Each entry records the table generation of
+        L{_PowerupConnector} it was made at, and is only used while that is
+        unchanged, however the connectors were written; the cache is also
+        emptied whenever a L{_PowerupConnector} is touched, and when a
+        transaction is reverted.
+
+        @param name: The fully qualified name of the interface.
+
+        @return: A C{list} of powerups.
+        """
+        store = self.store
+        key = (self.storeID, name)
+        generation, storeIDs = store._powerupCache.get(key, (None, None))
+        if generation == store.tableGeneration(_PowerupConnector):
+            powerups = [store.getItemByID(storeID, None)
+                        for storeID in storeIDs]
+            if None not in powerups:
+                return powerups
+            # A powerup was deleted behind the cache's back; find out whether
+            # its connector should go too.
+            del store._powerupCache[key]
+
+        powerups = []
+        for cable in list(store.query(
+                _PowerupConnector,
+                AND(_PowerupConnector.interface == name,
+                    _PowerupConnector.item == self),
+                sort=(_PowerupConnector.priority.descending +
+                      _PowerupConnector.storeID.ascending))):
             pup = cable.powerup
             if pup is None:
                 # this powerup was probably deleted during an upgrader.
                 cable.deleteFromStore()
             else:
-                indirector = IPowerupIndirector(pup, None)
-                if indirector is not None:
-                    yield indirector.indirect(interface)
-                else:
-                    yield pup
+                powerups.append(pup)
+        store._powerupCache[key] = (store.tableGeneration(_PowerupConnector),
+                                    [pup.storeID for pup in powerups])
+        return powerups
+
 
     def interfacesFor(self, powerup):
         """
@@ -446,6 +505,101 @@ def transacted(func):
 
 
 
+class _DeletionPlan(object):
+    """
+    A description of the work needed to delete items of one type, derived from
+    the C{whenDeleted} settings of every L{reference} which may refer to that
+    type.
+
+    Plans are computed once per type by L{_deletionPlanFor} and reused until
+    the set of registered references changes.
+
+    @ivar perItem: C{True} if the type overrides L{Item.deleted} or
+        L{Item.deleteFromStore}, in which case its items must be loaded and
+        deleted one at a time so that the overridden code runs.
+
+    @ivar disallows: A C{tuple} of the references which prevent deletion of
+        items they refer to.
+
+    @ivar cascades: A C{tuple} of the references whose referrers are deleted
+        along with the items they refer to.
+
+    @ivar nullifies: A C{tuple} of the references which become C{None} when
+        the items they refer to are deleted.
+    """
+    def __init__(self, signature, perItem, disallows, cascades, nullifies):
+        self.signature = signature
+        self.perItem = perItem
+        self.disallows = disallows
+        self.cascades = cascades
+        self.nullifies = nullifies
+
+
+
+_deletionPlans = WeakKeyDictionary()
+
+def _deletionPlanFor(tableClass):
+    """
+    Get the L{_DeletionPlan} for an L{Item} subclass, computing it if it has
+    not been computed yet or if references have been declared (or forgotten)
+    since it was.
+
+    @param tableClass: An L{Item} subclass.
+
+    @rtype: L{_DeletionPlan}
+    """
+    registries = (_disallows, _cascadingDeletes, _nullifies)
+    signature = tuple(len(registry.get(key, ()))
+                      for registry in registries
+                      for key in (tableClass, None))
+    plan = _deletionPlans.get(tableClass)
+    if plan is not None and plan.signature == signature:
+        return plan
+    perItem = (
+        six.get_unbound_function(tableClass.deleted) is not
+        six.get_unbound_function(Item.deleted) or
+        six.get_unbound_function(tableClass.deleteFromStore) is not
+        six.get_unbound_function(Item.deleteFromStore))
+    disallows, cascades, nullifies = [
+        tuple(ref for ref in registry.get(tableClass, []) +
+              registry.get(None, [])
+              if not _unresolved(ref))
+        for registry in registries]
+    plan = _deletionPlans[tableClass] = _DeletionPlan(
+        signature, perItem, disallows, cascades, nullifies)
+    return plan
+
+
+
+def _unresolved(ref):
+    """
+    Determine whether a reference has not been attached to an item type, and
+    so cannot refer to anything.
+
+    @param ref: A L{reference} attribute.
+
+    @rtype: C{bool}
+    """
+    return getattr(ref, 'modname', None) is None
+
+
+
+def _referencesIn(store, references):
+    """
+    Filter some references down to those whose items may actually be present
+    in a store.  A reference whose item type has no table in the store cannot
+    refer to anything there, and querying it would create the table.
+
+    @param references: An iterable of L{reference} attributes.
+
+    @return: An iterable of those of C{references} which need to be examined.
+    """
+    for ref in references:
+        if store._hasTableFor(ref.type):
+            yield ref
+
+
+
 def dependentItems(store, tableClass, comparisonFactory):
     """
     Collect all the items that should be deleted when an item or items
@@ -459,8 +613,8 @@ def dependentItems(store, tableClass, comparisonFactory):
 
     @return: An iterable of items to delete.
     """
-    for cascadingAttr in (_cascadingDeletes.get(tableClass, []) +
-                          _cascadingDeletes.get(None, [])):
+    plan = _deletionPlanFor(tableClass)
+    for cascadingAttr in _referencesIn(store, plan.cascades):
         for cascadedItem in store.query(cascadingAttr.type,
                                         comparisonFactory(cascadingAttr)):
             yield cascadedItem
@@ -480,17 +634,82 @@ def allowDeletion(store, tableClass, comparisonFactory):
 
     @return: A C{bool} indicating whether deletion should be allowed.
     """
-    for cascadingAttr in (_disallows.get(tableClass, []) +
-                          _disallows.get(None, [])):
-        for cascadedItem in store.query(cascadingAttr.type,
-                                        comparisonFactory(cascadingAttr),
-                                        limit=1):
+    plan = _deletionPlanFor(tableClass)
+    for disallowingAttr in _referencesIn(store, plan.disallows):
+        if store.query(disallowingAttr.type,
+                       comparisonFactory(disallowingAttr))._exists():
             return False
-
     return True
 
 
 
+def _function(method):
+    """
+    Get the function of a method, or of an unbound method on Python 2.
+    """
+    return getattr(method, '__func__', method)
+
+
+
+def _hydratorFor(itemClass):
+    """
+    Make a function which creates an instance of an item type from a row of
+    its table, as L{Item.existingInStore} does before activating it, but by
+    filling in the instance's slots in one step rather than setting each of
+    them through its descriptor.
+
+    @param itemClass: an L{Item} subclass.
+
+    @return: a function taking a store, a storeID, and a sequence of the
+        stored values of the schema of C{itemClass} (which may include
+        L{attributes._DeferredBatch} instances, for deferred attributes), or
+        C{None} if C{itemClass} changes how its instances are loaded, and so
+        must be loaded the slow way.
+    """
+    schema = itemClass.getSchema()
+    slots = [attr.dbunderlying for (name, attr) in schema]
+    # The values __subinit__ gives the private slots of a loaded item.
+    fixed = {'_Item__justCreated': False,
+             '_Item__everInserted': True,
+             '_Item__deleting': False,
+             '_Item__deletingObject': False,
+             '_axiom_service': None}
+    names = (list(fixed) + slots +
+             ['__dirty__', '_inMemoryPowerups', '_Item__store', '_storeID'])
+    if (_function(itemClass.__subinit__) is not _function(Item.__subinit__) or
+            _function(itemClass.__setattr__) is not
+            _function(slotmachine._Strict.__setattr__)):
+        return None
+    for name, attr in schema:
+        if _function(type(attr).loaded) is not _function(SQLAttribute.loaded):
+            return None
+    for name in names:
+        for klass in itemClass.__mro__:
+            if name in klass.__dict__:
+                if type(klass.__dict__[name]) is not slotmachine.Allowed:
+                    return None
+                break
+        else:
+            return None
+
+    new = itemClass.__new__
+    length = len(slots)
+
+    def hydrate(store, storeID, attrs):
+        assert len(attrs) == length, "invalid number of attributes"
+        self = new(itemClass)
+        state = dict(fixed)
+        state.update(zip(slots, attrs))
+        state['__dirty__'] = {}
+        state['_inMemoryPowerups'] = {}
+        state['_Item__store'] = store
+        state['_storeID'] = storeID
+        self.__dict__.update(state)
+        return self
+    return hydrate
+
+
+
 class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
     # Python-Special Attributes
     __dirty__ = inmemory()
@@ -573,7 +792,15 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
                 log.msg(interface=iaxiom.IStatEvent,
                         name='database', stat_autocommits=1)
 
-                self.checkpoint()
+                try:
+                    self.checkpoint()
+                except UniqueConstraintViolation:
+                    # The item was not inserted, so neither is its object.
+                    store.executeSchemaSQL(_schema.CHANGE_TYPE, [-1, oid])
+                    if not self.__legacy__:
+                        store.objectCache.uncache(oid, self)
+                    self.__store = None
+                    raise
             else:
                 self.touch()
             self.activate()
@@ -673,6 +900,15 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
 
     def existingInStore(cls, store, storeID, attrs):
         """Create and return a new instance from a row from the store."""
+        try:
+            hydrate = cls.__dict__['_hydrator']
+        except KeyError:
+            # Each item type has its own, so look only in its own dictionary.
+            hydrate = cls._hydrator = _hydratorFor(cls)
+        if hydrate is not None:
+            self = hydrate(store, storeID, attrs)
+            self.activate()
+            return self
         self = cls.__new__(cls)
 
         self.__justCreated = False
@@ -782,13 +1018,31 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
         if self.store is None:
             raise NotInStore("You can't checkpoint {!r}: not in a store".format(self))
 
+        if self.__deleting:
+            pending = self.__everInserted
+        else:
+            pending = bool(self.__dirty__) or not self.__everInserted
+        # Only open a savepoint for the change log if there is something to
+        # write.
+        if pending and self.store._autocommitLogged(self._writeChanges):
+            if self.store.autocommit:
+                self.committed()
+
+
+    def _writeChanges(self):
+        """
+        Write this item's in-memory changes to the database, for
+        L{checkpoint}.
 
+        @return: C{True} if anything was written.
+        """
         if self.__deleting:
             if not self.__everInserted:
                 # don't issue duplicate SQL and crap; we were created, then
                 # destroyed immediately.
-                return
+                return False
             self.store.executeSQL(self._baseDeleteSQL(self.store), [self.storeID])
+            self.store._tableChanged(self.__class__)
             # re-using OIDs plays havoc with the cache, and with other things
             # as well.  We need to make sure that we leave a placeholder row at
             # the end of the table.
@@ -808,9 +1062,7 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
                 assert self.__legacy__
 
             # we're done...
-            if self.store.autocommit:
-                self.committed()
-            return
+            return True
 
         if self.__everInserted:
             # case 1: we've been inserted before, either previously in this
@@ -818,8 +1070,9 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
             if not self.__dirty__:
                 # we might have been checkpointed twice within the same
                 # transaction; just don't do anything.
-                return
+                return False
             self.store.executeSQL(*self._updateSQL())
+            self.store._tableChanged(self.__class__)
         else:
             # case 2: we are in the middle of creating the object, we've never
             # been inserted into the db before
@@ -833,6 +1086,7 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
 
             # XXX this isn't atomic, gross.
             self.store.executeSQL(self._baseInsertSQL(self.store), insertArgs)
+            self.store._tableChanged(self.__class__)
             self.__everInserted = True
         # In case 1, we're dirty but we did an update, synchronizing the
         # database, in case 2, we haven't been created but we issue an insert.
@@ -840,8 +1094,7 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
         # as* populating __dirty__, so we clear out dirty and we keep the same
         # value, knowing it's the same as what's in the db.
         self.__dirty__.clear()
-        if self.store.autocommit:
-            self.committed()
+        return True
 
     def upgradeVersion(self, typename, oldversion, newversion, **kw):
         # right now there is only ever one acceptable series of arguments here
@@ -876,6 +1129,22 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
         self.deleteFromStore(False)
         return new
 
+    def _deletedInBulk(self):
+        """
+        Note that the row for this item has already been removed from the
+        database by a set-based deletion (see
+        L{axiom.store.ItemQuery.deleteFromStore}).  The item stops being valid
+        as a referent immediately, and leaves the object cache when the
+        deletion is committed, exactly as if it had been deleted individually.
+        """
+        self.__deleting = True
+        self.__deletingObject = True
+        if self.store.transaction is not None:
+            self.store.transaction.add(self)
+        else:
+            self.committed()
+
+
     def deleteFromStore(self, deleteObject=True):
         # go grab dependent stuff
         if deleteObject:
@@ -885,9 +1154,10 @@ class Item(six.with_metaclass(MetaItem, Empowered, slotmachine._Strict)):
                     'Cannot delete item; '
                     'has referents with whenDeleted == reference.DISALLOW')
 
-            for dependent in dependentItems(self.store, self.__class__,
-                                            lambda attr: attr == self):
-                dependent.deleteFromStore()
+            plan = _deletionPlanFor(self.__class__)
+            for cascadingAttr in _referencesIn(self.store, plan.cascades):
+                self.store.query(cascadingAttr.type,
+                                 cascadingAttr == self).deleteFromStore()
 
         self.touch()
 
@@ -1133,6 +1403,114 @@ class Placeholder(object):
 
 
 
+class _PathPlaceholder(Placeholder):
+    """
+    The L{Placeholder} for the items at the end of a L{ReferencePath}.  It is
+    shared by every query which follows the path, so it has an alias of its
+    own rather than one depending on the other aliases of the first query.
+
+    @ivar _pathJoin: The L{IComparison} which joins these items to the query,
+        added to the queries which involve them.
+    """
+    def __init__(self, itemClass):
+        Placeholder.__init__(self, itemClass)
+        self._placeholderTableAlias = 'via_' + str(self._placeholderCount)
+        self._pathJoin = None
+
+
+
+@implementer(IColumn)
+class _PathColumn(_PlaceholderColumn):
+    """
+    An attribute of the items at the end of a L{ReferencePath}.  Queries
+    which compare or sort by it are joined to those items by the path.
+
+    @ivar path: The L{ReferencePath}.
+    """
+    def __init__(self, path, column):
+        _PlaceholderColumn.__init__(self, path.placeholder, column)
+        self.path = path
+        self._paths = {}
+
+
+    def via(self, reftype=None):
+        """
+        Follow this attribute, which must be a reference, on to the items it
+        refers to.  See L{axiom.attributes.reference.via}.
+
+        @rtype: L{ReferencePath}
+        """
+        if not isinstance(self.column, reference):
+            raise TypeError("Only references can be followed, not %r" % (
+                self.column,))
+        return _followReference(self, self.column, reftype)
+
+
+
+class ReferencePath(object):
+    """
+    The items referred to by a reference attribute, whose attributes can be
+    compared and sorted on as though they were joined into the query.  These
+    are made by L{axiom.attributes.reference.via}.
+
+    @ivar source: The L{reference}, or the L{_PathColumn} of one at the end
+        of another path.
+    @ivar placeholder: A L{Placeholder} for the items referred to, joined to
+        the query by C{join}.
+    @ivar join: An L{IComparison} of C{source} with the storeIDs of the
+        items referred to.
+    """
+    def __init__(self, source, reftype):
+        self.source = source
+        self.placeholder = _PathPlaceholder(reftype)
+        self.join = self.placeholder._pathJoin = (
+            source == self.placeholder.storeID)
+        self._columns = {}
+
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._columns[name]
+        except KeyError:
+            column = _PathColumn(self, getattr(self.placeholder, name).column)
+            self._columns[name] = column
+            return column
+
+
+    def __repr__(self):
+        return '%r.via(%s)' % (
+            self.source, self.placeholder._placeholderItemClass.__name__)
+
+
+
+def _followReference(source, attribute, reftype):
+    """
+    Find the path along a reference, which is shared by every use of the
+    reference with the same type.
+
+    @param source: The L{reference}, or the L{_PathColumn} of one.
+    @param attribute: The L{reference} itself.
+    @param reftype: The type of the items referred to, or C{None} for the
+        reference's own C{reftype}.
+
+    @rtype: L{ReferencePath}
+    """
+    if reftype is None:
+        reftype = attribute.reftype
+    if reftype is None:
+        raise TypeError(
+            "%s does not declare the type it refers to; pass it to via()" % (
+                attribute.fullyQualifiedName(),))
+    try:
+        return source._paths[reftype]
+    except KeyError:
+        path = source._paths[reftype] = ReferencePath(source, reftype)
+        return path
+
+
+
 _legacyTypes = {}               # map (typeName, schemaVersion) to dummy class
 
 def declareLegacyItem(typeName, schemaVersion, attributes, dummyBases=()):
@@ -1166,6 +1544,9 @@ def declareLegacyItem(typeName, schemaVersion, attributes, dummyBases=()):
                   realBases,
                   attributes)
     assert result is not None, 'wtf, {!r}'.format(type)
+    # Dummy classes cannot be found by name, so tell their attributes which
+    # class they belong to now.
+    result.getSchema()
     _legacyTypes[(typeName, schemaVersion)] = result
     return result
 
@@ -1182,6 +1563,22 @@ class _PowerupConnector(Item):
     interface = text()
     priority = integer()
 
+    # Covers the lookup made by Empowered.powerupsFor, so that finding the
+    # powerups for an interface never reads the table.
+    compoundIndex(item, interface, priority, powerup)
+    # A powerup is installed on an item for an interface only once.
+    compoundIndex(item, interface, powerup, unique=True)
+
+
+    def touch(self):
+        """
+        Invalidate the store's cache of powerup lookups as well as noting this
+        connector's change; see L{Empowered._loadPowerups}.
+        """
+        if self.store is not None:
+            self.store._powerupCache.clear()
+        super(_PowerupConnector, self).touch()
+
 
 POWERUP_BEFORE = 1              # Priority for 'high' priority powerups.
 POWERUP_AFTER = -1              # Priority for 'low' priority powerups.
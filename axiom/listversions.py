@@ -75,6 +75,8 @@ class SoftwareVersion(item.Item):
     micro = attributes.integer(doc='Micro version number.',
                                allowNone=False)
 
+    attributes.compoundIndex(systemVersion, package, unique=True)
+
 
     def asVersion(self):
         """
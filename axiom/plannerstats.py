@@ -0,0 +1,314 @@
+# -*- test-case-name: axiom.test.test_plannerstats -*-
+
+"""
+Maintenance of SQLite's query planner statistics.
+
+Without the statistics gathered by C{ANALYZE}, SQLite's query planner has to
+guess how selective each index is, and on large stores it sometimes guesses
+wrongly for queries which join several item tables.  L{PlannerStatistics} is a
+powerup which periodically re-analyzes those item tables whose size has changed
+significantly since they were last analyzed, in the store it is installed on
+and in that store's substores::
+
+    installOn(PlannerStatistics(store=siteStore), siteStore)
+
+Each run is limited to a time budget; work which does not fit is picked up by
+the next run, which is scheduled immediately.  Only the tables which have been
+changed since they were last counted, according to the store's change log,
+are counted again.
+"""
+
+import time
+from datetime import timedelta
+
+from twisted.python import log
+
+from epsilon.extime import Time
+
+from axiom import _schema
+from axiom.iaxiom import IScheduler
+from axiom.item import Item
+from axiom.attributes import text, integer, timestamp, inmemory
+from axiom.substore import SubStore
+
+
+
+class TableStatistics(Item):
+    """
+    The size of an item table when it was last analyzed.
+
+    @ivar tableName: The unqualified name of the table.
+    @ivar rowCount: The number of rows in the table when it was analyzed.
+    @ivar analyzed: The time at which the table was analyzed.
+    @ivar generation: The generation of the table in the store's change log
+        when its rows were last counted, as from L{tableGenerations}, or
+        C{None} if the store keeps no change log.
+    """
+    typeName = 'axiom_table_statistics'
+    schemaVersion = 1
+
+    tableName = text(allowNone=False, indexed=True)
+    rowCount = integer(allowNone=False, default=0)
+    analyzed = timestamp()
+    generation = integer()
+
+
+
+def tableGenerations(store):
+    """
+    Find the generation of each item table of C{store} in its change log,
+    which changes whenever a transaction changes the rows of the table.
+
+    @return: A C{dict} mapping unqualified table names to generations, or
+        C{None} if C{store} keeps no change log (as in-memory stores do not),
+        in which case any table may have changed.
+    """
+    if store._changeLog is None:
+        return None
+    generations = dict(store.querySchemaSQL(_schema.CHANGE_LOG))
+    return dict(
+        (store._tableNameOnlyFor(typename, version),
+         generations.get(typeID, 0))
+        for (typename, version), typeID
+        in store.typenameAndVersionToID.items())
+
+
+
+def countRows(store, rowCounts, deadline=None, clock=time.time,
+              generations=None):
+    """
+    Count the rows of the item tables in C{store} which have not been counted
+    yet, stopping once a deadline has passed.  Counting a large table takes a
+    while, so the counts are kept to be used by later calls.
+
+    @param rowCounts: A C{dict} mapping the names of the tables which have
+        been counted to their row counts, to which the new counts are added.
+    @param deadline: The time after which no more tables are counted, or
+        C{None} to count them all.  At least one table is counted regardless.
+    @param clock: A callable returning the current time.
+    @param generations: The generations of the tables, as returned by
+        L{tableGenerations}, or C{None} to count every table.  Tables whose
+        generation is the one recorded by L{recordGenerations} when they were
+        last counted have not changed since, and are not counted again.
+
+    @return: C{True} if every table has been counted, C{False} if time ran out
+        first.
+    """
+    unchanged = set()
+    if generations is not None:
+        for stats in store.query(TableStatistics):
+            if (stats.generation is not None and
+                    stats.generation == generations.get(stats.tableName)):
+                unchanged.add(stats.tableName)
+    counted = False
+    for (tableName,) in store.querySchemaSQL(_schema.ITEM_TABLES):
+        if tableName in rowCounts or tableName in unchanged:
+            continue
+        if counted and deadline is not None and clock() >= deadline:
+            return False
+        [(rowCounts[tableName],)] = store.querySQL(
+            'SELECT COUNT(*) FROM {}.{}'.format(store.databaseName, tableName))
+        counted = True
+    return True
+
+
+
+def changedTables(store, minimumRows, growthPercent, rowCounts=None):
+    """
+    Find the item tables in C{store} whose size has changed significantly since
+    they were last analyzed.
+
+    @param minimumRows: Tables with fewer rows than this, both now and when
+        they were last analyzed, are never considered to have changed
+        significantly.
+    @param growthPercent: The change in the number of rows, as a percentage of
+        the number when the table was last analyzed, which is significant.
+    @param rowCounts: A C{dict} mapping the names of item tables to their
+        current row counts, as filled in by L{countRows}, or C{None} to count
+        all of them now.  Tables which are not in it are not considered.
+
+    @return: A C{list} of three-tuples of table name, row count when last
+        analyzed and current row count, largest change first.
+    """
+    if rowCounts is None:
+        rowCounts = {}
+        countRows(store, rowCounts)
+    previous = dict((stats.tableName, stats.rowCount)
+                    for stats in store.query(TableStatistics))
+    changed = []
+    for tableName, rowCount in rowCounts.items():
+        lastCount = previous.get(tableName, 0)
+        if max(rowCount, lastCount) < minimumRows:
+            continue
+        if abs(rowCount - lastCount) * 100 >= growthPercent * lastCount:
+            changed.append((tableName, lastCount, rowCount))
+    changed.sort(key=lambda change: abs(change[2] - change[1]), reverse=True)
+    return changed
+
+
+
+def recordGenerations(store, rowCounts, generations):
+    """
+    Record the generations of the tables which were counted, so that they are
+    not counted again by L{countRows} until they change.
+
+    @param rowCounts: A C{dict} whose keys are the names of the counted
+        tables.
+    @param generations: The generations of the tables when they were counted,
+        as returned by L{tableGenerations}.
+    """
+    if generations is None:
+        return
+    for tableName in rowCounts:
+        stats = store.findOrCreate(TableStatistics, tableName=tableName)
+        stats.generation = generations.get(tableName)
+
+
+
+def analyzeTable(store, tableName, rowCount):
+    """
+    Gather planner statistics for one item table in C{store}, and record its
+    size.
+
+    @param tableName: The unqualified name of the table.
+    @param rowCount: The number of rows in the table.
+    """
+    store._logMaintenance(
+        store.executeSchemaSQL, _schema.ANALYZE_TABLE.format(tableName))
+    stats = store.findOrCreate(TableStatistics, tableName=tableName)
+    stats.rowCount = rowCount
+    stats.analyzed = Time()
+
+
+
+class PlannerStatistics(Item):
+    """
+    Keep the query planner statistics of a store and its substores up to date.
+
+    @ivar interval: The number of seconds between complete passes over the
+        store and its substores.
+    @ivar timeBudget: The number of seconds after which a run stops analyzing
+        tables.  At least one table is analyzed by every run which finds one
+        in need of it.
+    @ivar analysisLimit: The approximate number of rows of each index which
+        C{ANALYZE} examines, or C{0} to examine them all.
+    @ivar minimumRows: Tables smaller than this are not analyzed.
+    @ivar growthPercent: The percentage change in the size of a table which
+        causes it to be analyzed again.
+    @ivar substoreCursor: The storeID of the last substore completed in the
+        current pass, C{0} if the store itself has been completed but no
+        substore has, or C{None} if the store itself has not been completed.
+    @ivar analyzedTables: The number of tables analyzed by this powerup.
+    @ivar lastPass: The time at which the last complete pass finished.
+
+    @ivar _rowCounts: The row counts of the tables of the store currently
+        being maintained, as counted by L{countRows} so far.  Counting is
+        charged to the time budget, and resumed by the next run if it runs
+        out.
+    @ivar _generations: The generations of the tables of the store currently
+        being maintained when counting began, as from L{tableGenerations}.
+    """
+    typeName = 'axiom_planner_statistics'
+    schemaVersion = 1
+
+    interval = integer(default=60 * 60 * 24, allowNone=False)
+    timeBudget = integer(default=30, allowNone=False)
+    analysisLimit = integer(default=1000, allowNone=False)
+    minimumRows = integer(default=1000, allowNone=False)
+    growthPercent = integer(default=25, allowNone=False)
+    substoreCursor = integer()
+    analyzedTables = integer(default=0, allowNone=False)
+    lastPass = timestamp()
+
+    _clock = inmemory()
+    _analyzedThisRun = inmemory()
+    _rowCounts = inmemory()
+    _generations = inmemory()
+
+    def activate(self):
+        self._clock = time.time
+        self._rowCounts = {}
+        self._generations = None
+
+
+    def installed(self):
+        """
+        Schedule the first pass as soon as this powerup is installed.
+        """
+        IScheduler(self.store).schedule(self, Time())
+
+
+    def uninstalled(self):
+        IScheduler(self.store).unscheduleAll(self)
+
+
+    def _maintain(self, store, deadline):
+        """
+        Analyze the changed tables in C{store} until C{deadline}.
+
+        @return: C{True} if every changed table was analyzed, C{False} if time
+            ran out first.
+        """
+        if not self._rowCounts:
+            self._generations = tableGenerations(store)
+        if not countRows(store, self._rowCounts, deadline, self._clock,
+                         self._generations):
+            return False
+        store.querySQL(_schema.ANALYSIS_LIMIT.format(self.analysisLimit))
+        for tableName, lastCount, rowCount in changedTables(
+                store, self.minimumRows, self.growthPercent, self._rowCounts):
+            if self._clock() >= deadline and self._analyzedThisRun:
+                return False
+            log.msg("Analyzing %s in %r (%d rows, was %d)." % (
+                tableName, store, rowCount, lastCount))
+            analyzeTable(store, tableName, rowCount)
+            self.analyzedTables += 1
+            self._analyzedThisRun = True
+        recordGenerations(store, self._rowCounts, self._generations)
+        self._rowCounts = {}
+        self._generations = None
+        return True
+
+
+    def _maintainSubStore(self, substore, deadline):
+        """
+        Analyze the changed tables of a substore, closing it afterwards unless
+        it was already open.
+        """
+        wasOpen = hasattr(substore, 'substore')
+        store = substore.open()
+        try:
+            return store.transact(self._maintain, store, deadline)
+        finally:
+            if not wasOpen and substore.storepath is not None:
+                substore.close()
+
+
+    def run(self):
+        """
+        Continue the current pass over the store and its substores for up to
+        C{timeBudget} seconds.
+        """
+        deadline = self._clock() + self.timeBudget
+        self._analyzedThisRun = False
+        if self.substoreCursor is None:
+            if not self._maintain(self.store, deadline):
+                return Time()
+            self.substoreCursor = 0
+        for substore in self.store.query(
+                SubStore, SubStore.storeID > self.substoreCursor,
+                sort=SubStore.storeID.ascending):
+            if not self._maintainSubStore(substore, deadline):
+                return Time()
+            self.substoreCursor = substore.storeID
+            if self._clock() >= deadline:
+                return Time()
+        self.substoreCursor = None
+        self.lastPass = Time()
+        return self.lastPass + timedelta(seconds=self.interval)
+
+
+
+__all__ = ['TableStatistics', 'tableGenerations', 'countRows',
+           'changedTables', 'recordGenerations', 'analyzeTable',
+           'PlannerStatistics']
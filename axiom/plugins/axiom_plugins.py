@@ -26,6 +26,8 @@ from axiom.listversions import ListVersions
 from axiom import version
 from axiom.iaxiom import IVersion
 from axiom.upgrade import upgradeExplicitOid
+from axiom.tombstone import collectTombstones
+from axiom.indexadvisor import adviseIndexes
 
 directlyProvides(version, IPlugin, IVersion)
 
@@ -92,6 +94,114 @@ class Upgrade(axiomatic.AxiomaticCommand):
 
 
 
+class Compact(axiomatic.AxiomaticCommand):
+    name = 'compact'
+    description = 'Remove dead object rows from an Axiom store and substores'
+
+    optParameters = [
+        ('count', 'n', '1000', 'Number of rows to remove per transaction')]
+
+    optFlags = [
+        ('incremental-vacuum', 'v',
+         'Return free pages to the filesystem after each transaction '
+         '(requires auto_vacuum=INCREMENTAL).')]
+
+    def compactStore(self, store):
+        """
+        Recursively remove dead object rows from C{store} and its substores.
+
+        @return: The total number of rows removed.
+        """
+        reclaimed = 0
+        while True:
+            count = collectTombstones(
+                store, self.count, self['incremental-vacuum'])
+            reclaimed += count
+            if count < self.count:
+                break
+        print(u'Reclaimed {} rows: {!r}'.format(reclaimed, store))
+
+        for substore in store.query(SubStore):
+            reclaimed += self.compactStore(substore.open())
+        return reclaimed
+
+
+    def perform(self, store, count):
+        """
+        Compact C{store}, removing at most C{count} rows per transaction.
+        """
+        self.count = count
+        reclaimed = self.compactStore(store)
+        print(u'Compaction complete: {} rows reclaimed'.format(reclaimed))
+
+
+    def postOptions(self):
+        try:
+            count = int(self['count'])
+        except ValueError:
+            raise usage.UsageError('count must be an integer')
+        if count < 1:
+            raise usage.UsageError('count must be positive')
+
+        siteStore = self.parent.getStore()
+        self.perform(siteStore, count)
+
+
+
+class Indexes(axiomatic.AxiomaticCommand):
+    name = 'indexes'
+    description = 'Suggest indexes for the queries recorded in an Axiom store'
+
+    optParameters = [
+        ('limit', 'n', '20', 'Maximum number of suggestions to print')]
+
+    def report(self, store, limit):
+        """
+        Print the C{limit} most valuable index suggestions for C{store}.
+        """
+        suggestions = adviseIndexes(store)[:limit]
+        if not suggestions:
+            print(u'No index suggestions')
+        for rank, suggestion in enumerate(suggestions, 1):
+            print(u'{}. {} ({} queries, {:.3f}s: {})'.format(
+                rank, suggestion.declaration(), suggestion.count,
+                suggestion.totalTime, u', '.join(sorted(suggestion.reasons))))
+
+
+    def postOptions(self):
+        try:
+            limit = int(self['limit'])
+        except ValueError:
+            raise usage.UsageError('limit must be an integer')
+
+        self.report(self.parent.getStore(), limit)
+
+
+
+class PrebuildIndexes(axiomatic.AxiomaticCommand):
+    name = 'prebuild-indexes'
+    description = ('Build the indexes an Axiom store and its substores would '
+                   'otherwise build in the background')
+
+    def buildStore(self, store):
+        """
+        Recursively build the pending indexes of C{store}.
+        """
+        pending = store.pendingIndexes()
+        for name in pending:
+            print(u'Building {}: {!r}'.format(name, store))
+        store.buildPendingIndexes()
+
+        for substore in store.query(SubStore):
+            self.buildStore(substore.open())
+
+
+    def postOptions(self):
+        self.buildStore(self.parent.getStore())
+        print(u'Indexes built')
+
+
+
 class AxiomConsole(code.InteractiveConsole):
     def runcode(self, code):
         """
@@ -2,9 +2,29 @@
 
 import operator
 
+from zope.interface import implementer
+
+from axiom.iaxiom import IColumn, IComparison
 from axiom.attributes import AND, OR
+from axiom._pysqlite2 import sqlite_version_info
 from six.moves import zip
 
+# Row values, such as (a, b) > (?, ?), were added in SQLite 3.15.0.
+_rowValuesSupported = sqlite_version_info >= (3, 15, 0)
+
+def _intervalIndexFor(startAttribute, endAttribute):
+    """
+    Find the L{axiom.attributes.IntervalIndex} declared for a pair of
+    attributes, if there is one.
+
+    @return: an L{axiom.attributes.IntervalIndex}, or C{None}.
+    """
+    for index in getattr(startAttribute, 'intervalIndexes', ()):
+        if index.start is startAttribute and index.end is endAttribute:
+            return index
+    return None
+
+
 def contains(startAttribute,
              endAttribute,
              value):
@@ -13,10 +33,17 @@ def contains(startAttribute,
     passed as the 'comparison' argument to Store.query/.sum/.count)
     which will constrain a query against 2 attributes for ranges which
     contain the given argument.  The range is half-open.
+
+    If an L{axiom.attributes.intervalIndex} is declared for the attributes,
+    the items are found with it.
     """
-    return AND(
+    comparison = AND(
         startAttribute <= value,
         value < endAttribute)
+    index = _intervalIndexFor(startAttribute, endAttribute)
+    if index is not None:
+        comparison = AND(index.overlapping(value, value), comparison)
+    return comparison
 
 
 def overlapping(startAttribute, # X
@@ -76,10 +103,13 @@ def overlapping(startAttribute, # X
     N.startAttribute must be less than N.endAttribute.
 
     startValue must be less than endValue.
+
+    If an L{axiom.attributes.intervalIndex} is declared for the attributes,
+    the items are found with it.
     """
     assert startValue <= endValue
 
-    return OR(
+    comparison = OR(
         AND(startAttribute >= startValue,
             startAttribute <= endValue),
         AND(endAttribute >= startValue,
@@ -87,6 +117,10 @@ def overlapping(startAttribute, # X
         AND(startAttribute <= startValue,
             endAttribute >= endValue)
         )
+    index = _intervalIndexFor(startAttribute, endAttribute)
+    if index is not None:
+        comparison = AND(index.overlapping(startValue, endValue), comparison)
+    return comparison
 
 def _tupleCompare(tuple1, ineq, tuple2,
                  eq=lambda a,b: (a==b),
@@ -111,6 +145,94 @@ def _tupleLessThan(tuple1, tuple2):
 def _tupleGreaterThan(tuple1, tuple2):
     return _tupleCompare(tuple1, operator.gt, tuple2)
 
+@implementer(IComparison)
+class _RowValueComparison(object):
+    """
+    A comparison of several attributes at once with as many values or other
+    attributes, as SQL compares row values: in order, so that, for example,
+    C{(a, b) > (1, 2)} when C{a > 1}, or when C{a == 1} and C{b > 2}.
+
+    SQLite can use an index on the attributes, in the same order, to find the
+    rows which match an inequality, which it cannot for the equivalent
+    comparisons of each attribute.  Where SQLite does not support row values,
+    those equivalent comparisons are made instead.
+
+    @ivar attributes: a tuple of L{IColumn} providers.
+    @ivar operationString: the SQL comparison operator.
+    @ivar values: a tuple of values or L{IColumn} providers, none of which
+        are C{None}, as long as C{attributes}.
+    """
+    def __init__(self, attributes, operationString, values):
+        self.attributes = attributes
+        self.operationString = operationString
+        self.values = values
+
+
+    def _expanded(self):
+        """
+        Make the equivalent comparisons of each attribute.
+        """
+        op = self.operationString
+        if op == '=':
+            return AND(*[attr == value for (attr, value)
+                         in zip(self.attributes, self.values)])
+        elif op == '!=':
+            return OR(*[attr != value for (attr, value)
+                        in zip(self.attributes, self.values)])
+        elif op == '>':
+            return _tupleGreaterThan(self.attributes, self.values)
+        elif op == '<':
+            return _tupleLessThan(self.attributes, self.values)
+        elif op == '>=':
+            return OR(_tupleGreaterThan(self.attributes, self.values),
+                      AND(*[attr == value for (attr, value)
+                            in zip(self.attributes, self.values)]))
+        else:
+            return OR(_tupleLessThan(self.attributes, self.values),
+                      AND(*[attr == value for (attr, value)
+                            in zip(self.attributes, self.values)]))
+
+
+    def getQuery(self, store):
+        if not _rowValuesSupported:
+            return self._expanded().getQuery(store)
+        right = []
+        for value in self.values:
+            if IColumn.providedBy(value):
+                right.append(value.getColumnName(store))
+            else:
+                right.append('?')
+        return '((%s) %s (%s))' % (
+            ', '.join([attr.getColumnName(store) for attr in self.attributes]),
+            self.operationString,
+            ', '.join(right))
+
+
+    def getArgs(self, store):
+        if not _rowValuesSupported:
+            return self._expanded().getArgs(store)
+        return [attr.infilter(value, None, store)
+                for (attr, value) in zip(self.attributes, self.values)
+                if not IColumn.providedBy(value)]
+
+
+    def getInvolvedTables(self):
+        tables = []
+        for column in self.attributes + self.values:
+            if IColumn.providedBy(column) and column.type not in tables:
+                tables.append(column.type)
+        return tables
+
+
+    def __repr__(self):
+        return '(%s) %s %r' % (
+            ', '.join([attr.fullyQualifiedName()
+                       for attr in self.attributes]),
+            self.operationString,
+            self.values)
+
+
+
 class AttributeTuple(object):
     def __init__(self, *attributes):
         self.attributes = attributes
@@ -118,38 +240,41 @@ class AttributeTuple(object):
     def __iter__(self):
         return iter(self.attributes)
 
-    def __eq__(self, other):
+    def _compare(self, other, operationString):
+        """
+        Compare these attributes with a sequence of as many values or other
+        attributes.
+
+        Comparisons with C{None} are made of each attribute, since a row value
+        is never equal to one containing C{NULL}.
+        """
         if not isinstance(other, (AttributeTuple, tuple, list)):
             return NotImplemented
-        return AND(*[
-                myAttr == otherAttr
-                for (myAttr, otherAttr)
-                in zip(self, other)])
+        other = tuple(other)
+        if len(other) != len(self.attributes):
+            raise ValueError(
+                "Cannot compare %d attributes with %d values" % (
+                    len(self.attributes), len(other)))
+        # Attributes must be compared by identity, since == makes a comparison.
+        if any(value is None for value in other):
+            return _RowValueComparison(
+                self.attributes, operationString, other)._expanded()
+        return _RowValueComparison(self.attributes, operationString, other)
+
+    def __eq__(self, other):
+        return self._compare(other, '=')
 
     def __ne__(self, other):
-        if not isinstance(other, (AttributeTuple, tuple, list)):
-            return NotImplemented
-        return OR(*[
-                myAttr != otherAttr
-                for (myAttr, otherAttr)
-                in zip(self, other)])
+        return self._compare(other, '!=')
 
     def __gt__(self, other):
-        if not isinstance(other, (AttributeTuple, tuple, list)):
-            return NotImplemented
-        return _tupleGreaterThan(tuple(iter(self)), other)
+        return self._compare(other, '>')
 
     def __lt__(self, other):
-        if not isinstance(other, (AttributeTuple, tuple, list)):
-            return NotImplemented
-        return _tupleLessThan(tuple(iter(self)), other)
+        return self._compare(other, '<')
 
     def __ge__(self, other):
-        if not isinstance(other, (AttributeTuple, tuple, list)):
-            return NotImplemented
-        return OR(self > other, self == other)
+        return self._compare(other, '>=')
 
     def __le__(self, other):
-        if not isinstance(other, (AttributeTuple, tuple, list)):
-            return NotImplemented
-        return OR(self < other, self == other)
+        return self._compare(other, '<=')
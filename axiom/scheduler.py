@@ -36,7 +36,8 @@ from epsilon.extime import Time
 
 from axiom.iaxiom import IScheduler
 from axiom.item import Item, declareLegacyItem
-from axiom.attributes import AND, timestamp, reference, integer, inmemory, bytes
+from axiom.attributes import (
+    AND, timestamp, reference, integer, inmemory, bytes, compoundIndex)
 from axiom.dependency import uninstallFrom
 from axiom.upgrade import registerUpgrader
 from axiom.substore import SubStore
@@ -456,6 +457,8 @@ class _SubSchedulerParentHook(Item):
         The L{SubStore} for which this scheduling hook exists.
         """, reftype=SubStore)
 
+    compoundIndex(subStore, unique=True)
+
     def run(self):
         """
         Tick our C{subStore}'s L{SubScheduler}.
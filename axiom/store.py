@@ -9,6 +9,10 @@ from __future__ import print_function
 import six
 
 import time, os, itertools, warnings, sys, operator, weakref, six, io
+import hashlib
+import json, base64, binascii
+import collections
+import array
 
 from zope.interface import implementer
 
@@ -20,9 +24,15 @@ from twisted.python.reflect import namedAny
 from twisted.application.service import IService, IServiceCollection, Service
 from twisted.internet.task import Cooperator
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from axiom import _schema, attributes, upgrade, _fincache, iaxiom, errors
 from axiom import item
-from axiom._pysqlite2 import Connection
+from axiom.queryutil import AttributeTuple
+from axiom._pysqlite2 import Connection, dbapi2
 
 from axiom.item import \
     _typeNameToMostRecentClass, declareLegacyItem, \
@@ -208,16 +218,30 @@ class BaseQuery:
 
         self.store = store
         self.tableClass = tableClass
-        self.comparison = comparison
         self.limit = limit
         self.offset = offset
         self.sort = iaxiom.IOrdering(sort)
+        # Comparing or sorting by an attribute at the end of a reference path
+        # joins the path into the query.
+        comparison = attributes._withPathJoins(
+            comparison,
+            [attr.type for attr, direction in self.sort.orderColumns()])
+        self.comparison = comparison
         tables = self._involvedTables()
         self._computeFromClause(tables)
+        # Subqueries can depend on more tables than the query itself involves.
+        self._tables = tables
+        if comparison is not None:
+            self._tables = tables + [
+                table for table in attributes._dependentTables(comparison)
+                if table not in tables]
 
 
     _cloneAttributes = 'store tableClass comparison limit offset sort'.split()
 
+    # The GROUP BY and HAVING clauses of a grouped query.
+    _groupClauseParts = ()
+
     # IQuery
     def cloneQuery(self, limit=_noItem, sort=_noItem):
         clonekw = {}
@@ -334,6 +358,7 @@ class BaseQuery:
             sqlParts.extend(['FROM', ', '.join(self.fromClauseParts)])
         if self.comparison is not None:
             sqlParts.extend(['WHERE', self.comparison.getQuery(self.store)])
+        sqlParts.extend(self._groupClauseParts)
         if self.sortClauseParts:
             sqlParts.extend(['ORDER BY', ', '.join(self.sortClauseParts)])
         if limitClause:
@@ -352,10 +377,15 @@ class BaseQuery:
         if not self.store.autocommit:
             self.store.checkpoint()
         sqlstr, sqlargs = self._sqlAndArgs(verb, subject)
-        sqlResults = self.store.querySQL(sqlstr, sqlargs)
+        if verb in ('SELECT', 'SELECT DISTINCT'):
+            sqlResults = self.store._cachedQuerySQL(
+                self._tables, sqlstr, sqlargs)
+        else:
+            sqlResults = self.store.querySQL(sqlstr, sqlargs)
         cs = self.locateCallSite()
         log.msg(interface=iaxiom.IStatEvent,
-                querySite=cs, queryTime=time.time() - t, querySQL=sqlstr)
+                querySite=cs, queryTime=time.time() - t, querySQL=sqlstr,
+                queryStore=self.store)
         return sqlResults
 
     def locateCallSite(self):
@@ -398,6 +428,79 @@ class BaseQuery:
         raise NotImplementedError()
 
 
+    def _exists(self):
+        """
+        Determine whether this query has any results, without loading any of
+        them.  SQLite stops looking as soon as it finds one.
+
+        @rtype: L{bool}
+        """
+        if not self.store.autocommit:
+            self.store.checkpoint()
+        sql, args = self._sqlAndArgs('SELECT', '1')
+        result = self.store._cachedQuerySQL(
+            self._tables, 'SELECT EXISTS (' + sql + ')', args)
+        return bool(result[0][0])
+
+
+    def _toArrays(self, columns, default, useNumPy, chunkSize):
+        """
+        Load the stored values of some numeric columns into arrays, reading
+        C{chunkSize} rows from SQLite at a time.
+
+        @see: L{AttributeQuery.toArray}
+
+        @return: a C{list} with an array for each column.
+        """
+        typecodes = [_arrayTypeCode(column) for column in columns]
+        targets = [column.getColumnName(self.store) for column in columns]
+        args = self.args
+        if default is not None:
+            targets = ['COALESCE(%s, ?)' % (target,) for target in targets]
+            # The placeholders in the target precede those in the comparison.
+            args = [default] * len(targets) + list(args)
+        if useNumPy is None:
+            useNumPy = numpy is not None
+
+        if not self.store.autocommit:
+            self.store.checkpoint()
+        t = time.time()
+        sqlstr = self._sqlAndArgs('SELECT', ', '.join(targets))[0]
+        cursor = self.store._queryCursor(sqlstr, args)
+        chunks = [[] for column in columns]
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if not rows:
+                break
+            for chunk, typecode, values in zip(
+                    chunks, typecodes, zip(*rows)):
+                if None in values:
+                    raise ValueError(
+                        "Cannot load NULL into an array; pass a default to "
+                        "use instead")
+                if useNumPy:
+                    chunk.append(numpy.array(values, dtype=typecode))
+                else:
+                    chunk.append(array.array(typecode, values))
+        log.msg(interface=iaxiom.IStatEvent,
+                querySite=self.locateCallSite(), queryTime=time.time() - t,
+                querySQL=sqlstr, queryStore=self.store)
+
+        arrays = []
+        for chunk, typecode in zip(chunks, typecodes):
+            if useNumPy:
+                if chunk:
+                    arrays.append(numpy.concatenate(chunk))
+                else:
+                    arrays.append(numpy.array([], dtype=typecode))
+            else:
+                result = array.array(typecode)
+                for piece in chunk:
+                    result.extend(piece)
+                arrays.append(result)
+        return arrays
+
+
     def distinct(self):
         """
         Call this method if you want to avoid repeated results from a query.
@@ -434,6 +537,98 @@ class BaseQuery:
         return _DistinctQuery(self)
 
 
+    def values(self, *columns, **kw):
+        """
+        Get an L{iaxiom.IQuery} whose results are tuples of the values of some
+        columns, rather than Items.  No Items are loaded, so this is much
+        faster than loading the results of this query just to look at a few
+        of their attributes::
+
+            for subject, sender in s.query(
+                    Message, AND(Message.sender == Person.storeID,
+                                 Message.read == False)).values(
+                    Message.subject, Person.name):
+                ...
+
+        @param columns: L{iaxiom.IColumn} providers, such as attributes of the
+            types this query involves.
+
+        @param raw: If true, give the values as they are stored in the
+            database, without converting them with the attributes'
+            C{outfilter}s.  For example, an L{attributes.timestamp} is then an
+            integer number of microseconds rather than an L{extime.Time}.
+
+        @param named: If true, give each row as a named tuple, with fields
+            named for the attributes.
+
+        @return: a L{ProjectionQuery}.
+        """
+        raw = kw.pop('raw', False)
+        named = kw.pop('named', False)
+        if kw:
+            raise TypeError("Unexpected keyword arguments: %r" % (kw,))
+        return ProjectionQuery(self.store,
+                               self.tableClass,
+                               self.comparison,
+                               self.limit,
+                               self.offset,
+                               self.sort,
+                               columns,
+                               raw,
+                               named)
+
+
+    def groupBy(self, *columns):
+        """
+        Get an L{iaxiom.IQuery} whose results are the distinct combinations
+        of the values of some columns among the results of this query, to
+        which aggregates of each group can be added with
+        L{GroupQuery.aggregate}.  Everything is computed by SQLite, in a
+        single statement::
+
+            for row in s.query(Message, Message.read == False).groupBy(
+                    Message.folder).aggregate(
+                        count=Message.storeID.count,
+                        total=Message.size.sum,
+                        newest=Message.received.max):
+                print(row.folder, row.count, row.total, row.newest)
+
+        @param columns: L{iaxiom.IColumn} providers, such as attributes of the
+            types this query involves.
+
+        @return: a L{GroupQuery}.
+        """
+        return GroupQuery(self.store,
+                          self.tableClass,
+                          self.comparison,
+                          self.limit,
+                          self.offset,
+                          self.sort,
+                          columns)
+
+
+    def aggregate(self, *pairs, **aggregates):
+        """
+        Compute several aggregates of the results of this query at once.
+
+        @param pairs: C{(name, aggregate)} pairs, for aggregates to compute
+            in the order given.
+        @param aggregates: L{attributes.Aggregate}s, such as
+            C{Foo.size.sum}, by keyword, which are computed after those in
+            C{pairs}, in order of their names.
+
+        @return: a L{GroupQuery} with a single result.
+        """
+        return GroupQuery(self.store,
+                          self.tableClass,
+                          self.comparison,
+                          self.limit,
+                          self.offset,
+                          self.sort,
+                          (),
+                          _orderedAggregates(pairs, aggregates))
+
+
     def __iter__(self):
         """
         Iterate the results of this query.
@@ -442,6 +637,20 @@ class BaseQuery:
 
 
 
+def _orderedAggregates(pairs, aggregates):
+    """
+    Put the aggregates given to L{BaseQuery.aggregate} or
+    L{GroupQuery.aggregate} in the order of the columns of its results: those
+    given as pairs in their order, then those given by keyword in order of
+    their names, as the order of keyword arguments is arbitrary on some
+    versions of Python.
+
+    @return: a C{list} of C{(name, aggregate)} pairs.
+    """
+    return list(pairs) + sorted(aggregates.items(), key=lambda item: item[0])
+
+
+
 class _FakeItemForFilter:
     __legacy__ = False
     def __init__(self, store):
@@ -457,26 +666,354 @@ def _isColumnUnique(col):
     """
     return isinstance(col, _StoreIDComparer)
 
+
+
+@implementer(iaxiom.IColumn)
+class _StoredValueColumn(attributes.Comparable):
+    """
+    A column compared with values as they are stored in the database, rather
+    than with the Python values of its attribute, so that the keys of the
+    last result of a page can be compared with those of the next.
+
+    @ivar column: the L{IColumn} provider being compared.
+    """
+    def __init__(self, column):
+        self.column = column
+
+
+    type = property(lambda self: self.column.type)
+
+
+    def getColumnName(self, store):
+        return self.column.getColumnName(store)
+
+
+    def fullyQualifiedName(self):
+        return self.column.fullyQualifiedName()
+
+
+    def infilter(self, dbval, oself, store):
+        return dbval
+
+
+
+def _isColumnNullable(column):
+    """
+    Determine if an IColumn provider may be C{NULL}.
+
+    @param column: an L{IColumn} provider
+    @return: False if the column is never C{NULL}, True otherwise.
+    """
+    if _isColumnUnique(column):
+        return False
+    return getattr(getattr(column, 'attribute', column), 'allowNone', True)
+
+
+
+def _columnAfter(column, direction, value):
+    """
+    Compare a single column for the rows which sort after a value of it.
+
+    SQLite sorts C{NULL} before every other value, so it is after any other
+    value in a descending sort, and nothing is after it in one.
+
+    @param column: a L{_StoredValueColumn}.
+    @param direction: C{'ASC'} or C{'DESC'}.
+    @param value: the stored value to sort after.
+
+    @return: an L{IComparison} provider, or C{None} if no row can sort after
+        C{value}.
+    """
+    if direction == attributes._ASC:
+        if value is None:
+            return column != None
+        return column > value
+    if value is None:
+        return None
+    if _isColumnNullable(column.column):
+        return attributes.OR(column < value, column == None)
+    return column < value
+
+
+
+def _keysetAfter(keyColumns, key):
+    """
+    Compare the key columns of a pagination for the rows which sort after the
+    given key.
+
+    Rather than one comparison, which SQLite could only answer by testing
+    every row with the same value of the first key column, there is one for
+    each key column, of the rows with the same values of the columns before it
+    and a later value of it, each of which SQLite can seek to in an index.
+
+    @param keyColumns: a list of (L{IColumn} provider, direction) pairs.
+    @param key: a sequence of the stored values of C{keyColumns}.
+
+    @return: a list of L{IComparison} providers, of rows which sort after
+        C{key} together.
+    """
+    columns = [_StoredValueColumn(column) for (column, direction) in keyColumns]
+    comparisons = []
+    for i, (column, direction) in enumerate(keyColumns):
+        after = _columnAfter(columns[i], direction, key[i])
+        if after is None:
+            continue
+        if i:
+            after = attributes.AND(
+                AttributeTuple(*columns[:i]) == tuple(key[:i]), after)
+        comparisons.append(after)
+    return comparisons
+
+
+
+def _paginationKey(query):
+    """
+    Find the columns which the results of an item query are sorted by, up to
+    and including the first which is unique, so that they sort in a single
+    order.
+
+    @param query: an L{ItemQuery}.
+
+    @return: a list of (L{IColumn} provider, direction) pairs, ending with
+        the query's C{storeID} if its sort does not end with a unique column.
+    """
+    keyColumns = []
+    for column, direction in query.sort.orderColumns():
+        keyColumns.append((column, direction))
+        if _isColumnUnique(column):
+            # Columns after a unique column never break a tie.
+            return keyColumns
+    # You can't have an unsorted pagination, or one with ties.
+    keyColumns.append((query.tableClass.storeID, attributes._ASC))
+    return keyColumns
+
+
+
+try:
+    _bufferType = buffer
+except NameError:
+    # BLOBs are read as bytes on Python 3.
+    _bufferType = six.binary_type
+
+
+
+def _encodeResumeToken(key):
+    """
+    Encode the stored values of the key columns of a pagination as text.
+
+    @param key: a sequence of stored values; BLOBs may be C{bytes}, or
+        C{buffer} or C{memoryview} objects, and text is C{unicode}.
+    @rtype: L{str}
+    """
+    values = []
+    for value in key:
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        if isinstance(value, (six.binary_type, _bufferType)):
+            value = {'bytes': base64.b64encode(
+                six.binary_type(value)).decode('ascii')}
+        values.append(value)
+    token = base64.urlsafe_b64encode(json.dumps(values).encode('ascii'))
+    return token.decode('ascii')
+
+
+
+def _decodeResumeToken(token, length):
+    """
+    Decode the stored values of the key columns of a pagination from a token
+    made by L{_encodeResumeToken}.
+
+    @param token: the token.
+    @param length: the number of key columns.
+
+    @raise ValueError: if C{token} is not a token for C{length} columns.
+
+    @rtype: L{tuple}
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            token.encode('ascii')).decode('ascii'))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid resume token: %r" % (token,))
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Resume token is not for this query: %r" % (token,))
+    key = []
+    for value in values:
+        if isinstance(value, dict):
+            # Bound as a BLOB, like the stored value, rather than as text.
+            value = dbapi2.Binary(
+                base64.b64decode(value['bytes'].encode('ascii')))
+        key.append(value)
+    return tuple(key)
+
+
+
+class _Pagination(object):
+    """
+    The results of L{ItemQuery.paginate}, found a page at a time.
+
+    @ivar query: the L{ItemQuery} being paginated.
+
+    @ivar keyColumns: a list of (L{IColumn} provider, direction) pairs which
+        the results are sorted by, the last of which is unique.
+
+    @ivar pagesize: the number of results to find at a time.
+
+    @ivar _key: a tuple of the stored values of C{keyColumns} for the last
+        result yielded, or to start after, or C{None} to start from the
+        beginning.
+    """
+    def __init__(self, query, keyColumns, pagesize, resumeToken):
+        self.query = query
+        self.keyColumns = keyColumns
+        self.pagesize = pagesize
+        if resumeToken is None:
+            self._key = None
+        else:
+            self._key = _decodeResumeToken(resumeToken, len(keyColumns))
+        self._results = self._paginate()
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        return next(self._results)
+
+    next = __next__
+
+
+    def resumeToken(self):
+        """
+        Get a token to pass to L{ItemQuery.paginate} to continue after the
+        last result yielded so far, perhaps in another process.
+
+        @return: a L{str}, or C{None} if there is nothing to continue after.
+        """
+        if self._key is None:
+            return None
+        return _encodeResumeToken(self._key)
+
+
+    def _paginate(self):
+        """
+        Yield the results of the query, one page at a time.
+        """
+        query = self.query
+        store = query.store
+        sort = attributes.CompoundOrdering([
+            attributes.SimpleOrdering(column, direction)
+            for (column, direction) in self.keyColumns])
+        keyTarget = ', '.join([
+            column.getColumnName(store)
+            for (column, direction) in self.keyColumns])
+        keyLength = len(self.keyColumns)
+        while True:
+            if self._key is None:
+                comparisons = [query.comparison]
+            else:
+                comparisons = [
+                    after if query.comparison is None
+                    else attributes.AND(query.comparison, after)
+                    for after in _keysetAfter(self.keyColumns, self._key)]
+            pages = []
+            for comparison in comparisons:
+                pagekw = {}
+                for attr in query._cloneAttributes:
+                    pagekw[attr] = getattr(query, attr)
+                pagekw.update(comparison=comparison, limit=self.pagesize,
+                              offset=None, sort=sort)
+                pages.append(query.__class__(**pagekw))
+            rows = self._runPages(pages, keyTarget, keyLength)
+            for row in rows:
+                result = pages[0]._massageData(row[:-keyLength])
+                self._key = tuple(row[-keyLength:])
+                yield result
+            if len(rows) < self.pagesize:
+                return
+
+
+    def _runPages(self, pages, keyTarget, keyLength):
+        """
+        Run the queries for the parts of a page together, selecting the key
+        columns of each result after its own columns, and sorting the results
+        of all of them by those.
+
+        @param pages: a list of L{ItemQuery} instances, limited to a page.
+        @param keyTarget: the SQL for the key columns.
+        @param keyLength: the number of key columns.
+
+        @return: a list of rows.
+        """
+        if len(pages) == 1:
+            return pages[0]._runQuery(
+                'SELECT', pages[0]._queryTarget + ', ' + keyTarget)
+        t = time.time()
+        store = self.query.store
+        if not store.autocommit:
+            store.checkpoint()
+        statements = []
+        args = []
+        for page in pages:
+            sqlstr, sqlargs = page._sqlAndArgs(
+                'SELECT', page._queryTarget + ', ' + keyTarget)
+            statements.append('SELECT * FROM (%s)' % (sqlstr,))
+            args.extend(sqlargs)
+        # Results are sorted by the positions of their key columns.
+        keyStart = 1 + pages[0]._deferredMask.count(False)
+        sqlstr = 'SELECT * FROM (%s) ORDER BY %s LIMIT %d' % (
+            ' UNION ALL '.join(statements),
+            ', '.join(['%d %s' % (keyStart + i + 1, direction)
+                       for (i, (column, direction))
+                       in enumerate(self.keyColumns)]),
+            self.pagesize)
+        rows = store._cachedQuerySQL(pages[0]._tables, sqlstr, args)
+        log.msg(interface=iaxiom.IStatEvent,
+                querySite=self.query.locateCallSite(),
+                queryTime=time.time() - t, querySQL=sqlstr,
+                queryStore=store)
+        return rows
+
+
+
 class ItemQuery(BaseQuery):
     """
     This class is a query whose results will be Item instances.  This is the
     type always returned from L{Store.query}.
     """
 
+    _cloneAttributes = BaseQuery._cloneAttributes + ['defer']
+
     def __init__(self, *a, **k):
         """
         Create an ItemQuery.  This is typically done via L{Store.query}.
+
+        @param defer: A sequence of the attributes to leave out of the
+            results, to be loaded when they are first accessed, or C{None} for
+            the attributes declared with C{deferred=True}.
         """
+        defer = k.pop('defer', None)
         BaseQuery.__init__(self, *a, **k)
-        self._queryTarget = (
-            self.tableClass.storeID.getColumnName(self.store) + ', ' + (
-                ', '.join(
-                    [attrobj.getColumnName(self.store)
-                     for name, attrobj in self.tableClass.getSchema()
-                     ])))
-
-
-    def paginate(self, pagesize=20):
+        schema = self.tableClass.getSchema()
+        if defer is None:
+            # Placeholder columns are never deferred.
+            defer = [attrobj for name, attrobj in schema
+                     if getattr(attrobj, 'deferred', False)]
+        self.defer = defer
+        # Attributes are compared by identity, since == makes a comparison.
+        self._deferredMask = [
+            any(attrobj is deferred for deferred in defer)
+            for name, attrobj in schema]
+        self._deferredBatch = None
+        self._queryTarget = ', '.join(
+            [self.tableClass.storeID.getColumnName(self.store)] +
+            [attrobj.getColumnName(self.store)
+             for (name, attrobj), deferred in zip(schema, self._deferredMask)
+             if not deferred])
+
+
+    def paginate(self, pagesize=20, resumeToken=None):
         """
         Split up the work of gathering a result set into multiple smaller
         'pages', allowing very large queries to be iterated without blocking
@@ -486,83 +1023,30 @@ class ItemQuery(BaseQuery):
         query directly, using this method allows the work to obtain the results
         to be performed on demand, over a series of different transaction.
 
+        Each page is found with a single statement, limited to C{pagesize}
+        results, for the items which sort after the last item of the previous
+        page.  Items which sort the same are ordered by their storeID, so
+        however many items share a sort value, every page takes the same
+        amount of work.
+
         @param pagesize: the number of results gather in each chunk of work.
         (This is mostly for testing paginate's implementation.)
         @type pagesize: L{int}
 
-        @return: an iterable which yields all the results of this query.
-        """
+        @param resumeToken: a token from L{_Pagination.resumeToken} of an
+            earlier pagination of the same query, to continue from where that
+            one left off, or C{None} to start from the beginning.
+        @type resumeToken: L{str}
 
-        sort = self.sort
-        oc = list(sort.orderColumns())
-        if not oc:
-            # You can't have an unsorted pagination.
-            sort = self.tableClass.storeID.ascending
-            oc = list(sort.orderColumns())
-        if len(oc) != 1:
-            raise RuntimeError("%d-column sorts not supported yet with paginate" %(len(oc),))
-        sortColumn = oc[0][0]
-        if oc[0][1] == 'ASC':
-            sortOp = operator.gt
-        else:
-            sortOp = operator.lt
-        if _isColumnUnique(sortColumn):
-            # This is the easy case.  There is never a tie to be broken, so we
-            # can just remember our last value and yield from there.  Right now
-            # this only happens when the column is a storeID, but hopefully in
-            # the future we will have more of this.
-            tiebreaker = None
-        else:
-            tiebreaker = self.tableClass.storeID
-
-        tied = lambda a, b: (sortColumn.__get__(a) ==
-                             sortColumn.__get__(b))
-        def _AND(a, b):
-            if a is None:
-                return b
-            return attributes.AND(a, b)
-
-        results = list(self.store.query(self.tableClass, self.comparison,
-                                        sort=sort, limit=pagesize + 1))
-        while results:
-            if len(results) == 1:
-                # XXX TODO: reject 0 pagesize.  If the length of the result set
-                # is 1, there's no next result to test for a tie with, so we
-                # must be at the end, and we should just yield the result and finish.
-                yield results[0]
-                return
-            for resultidx in range(len(results) - 1):
-                # check for a tie.
-                result = results[resultidx]
-                nextResult = results[resultidx + 1]
-                if tied(result, nextResult):
-                    # Yield any ties first, in the appropriate order.
-                    lastTieBreaker = tiebreaker.__get__(result)
-                    # Note that this query is _NOT_ limited: currently large ties
-                    # will generate arbitrarily large amounts of work.
-                    trq = self.store.query(
-                        self.tableClass,
-                        _AND(self.comparison,
-                             sortColumn == sortColumn.__get__(result)))
-                    tiedResults = list(trq)
-                    tiedResults.sort(key=lambda rslt: (sortColumn.__get__(result),
-                                                       tiebreaker.__get__(result)))
-                    for result in tiedResults:
-                        yield result
-                    # re-start the query here ('result' is set to the
-                    # appropriate value by the inner loop)
-                    break
-                else:
-                    yield result
+        @return: an iterable which yields all the results of this query, and
+            gives a token to resume from the last one yielded with its
+            C{resumeToken} method.
+        @rtype: L{_Pagination}
+        """
+        if pagesize < 1:
+            raise ValueError("Pages must hold at least one result")
+        return _Pagination(self, _paginationKey(self), pagesize, resumeToken)
 
-            lastSortValue = sortColumn.__get__(result) # hooray namespace pollution
-            results = list(self.store.query(
-                    self.tableClass,
-                    _AND(self.comparison,
-                         sortOp(sortColumn,
-                                sortColumn.__get__(result))),
-                    sort=sort,
-                    limit=pagesize + 1))
 
     def _massageData(self, row):
         """
@@ -574,7 +1058,17 @@ class ItemQuery(BaseQuery):
 
         @return: an instance of the type specified by this query.
         """
-        result = self.store._loadedItem(self.tableClass, row[0], row[1:])
+        attrs = row[1:]
+        if self.defer:
+            batch = self._deferredBatch
+            if batch is None or len(batch.storeIDs) >= batch.size:
+                batch = self._deferredBatch = attributes._DeferredBatch(
+                    self.store)
+            batch.storeIDs.append(row[0])
+            values = iter(attrs)
+            attrs = [batch if deferred else next(values)
+                     for deferred in self._deferredMask]
+        result = self.store._loadedItem(self.tableClass, row[0], attrs)
         assert result.store is not None, "result %r has funky store" % (result,)
         return result
 
@@ -609,7 +1103,20 @@ class ItemQuery(BaseQuery):
                               raw)
 
 
-    def count(self):
+    def count(self, approximate=False):
+        """
+        @param approximate: If true, and this query selects every item of its
+            type, give the number of items there were when the table was last
+            analyzed (see L{axiom.plannerstats}) rather than counting them.
+            This is much faster for huge tables.  If the table has never been
+            analyzed, the items are counted anyway.
+
+        @return: the number of results of this query.
+        """
+        if approximate and self.comparison is None and self.limit is None:
+            estimate = self.store._estimatedRowCount(self.tableClass)
+            if estimate is not None:
+                return estimate
         rslt = self._runQuery(
             'SELECT',
             'COUNT(' + self.tableClass.storeID.getColumnName(self.store)
@@ -618,50 +1125,118 @@ class ItemQuery(BaseQuery):
         return rslt[0][0] or 0
 
 
-    def deleteFromStore(self):
+    def deleteFromStore(self, eagerNullify=False):
         """
         Delete all the Items which are found by this query.
+
+        Unless the type being deleted overrides L{item.Item.deleted} or
+        L{item.Item.deleteFromStore}, this does not load the Items: a
+        C{DELETE} is issued whose C{WHERE} clause is this query's.  Items
+        referring to the deleted Items with C{whenDeleted=reference.CASCADE}
+        are deleted the same way, each with a C{DELETE} selecting the
+        referrers through a subselect of this query, and
+        C{whenDeleted=reference.DISALLOW} references are checked with an
+        C{EXISTS} probe.  The whole deletion happens in one transaction.
+
+        @param eagerNullify: If C{True}, also set
+            C{whenDeleted=reference.NULLIFY} references to the deleted Items to
+            C{None} in the database now, rather than leaving dangling values
+            which read as C{None}.
+
+        @raise errors.DeletionDisallowed: if a C{whenDeleted=DISALLOW}
+            reference refers to an Item which would be deleted.
         """
         if (self.limit is None and
             not isinstance(self.sort, attributes.UnspecifiedOrdering)):
             # The ORDER BY is pointless here, and SQLite complains about it.
-            return self.cloneQuery(sort=None).deleteFromStore()
+            return self.cloneQuery(sort=None).deleteFromStore(eagerNullify)
+        return self.store.transact(self._deleteFromStore, eagerNullify, ())
+
+
+    def _deleteFromStore(self, eagerNullify, deleting):
+        """
+        Delete the Items found by this query, along with their dependents.
+        This must be run in a transaction.
+
+        @param eagerNullify: See L{deleteFromStore}.
 
-        #We can do this the fast way or the slow way.
+        @param deleting: A C{tuple} of the Item types which are already being
+            deleted by a set-based deletion further up the call stack.
+            Cascading from one of these types back to another would never
+            terminate when expressed as nested subselects, so such cascades
+            are followed one Item at a time instead.
+        """
+        plan = item._deletionPlanFor(self.tableClass)
 
         # If there's a 'deleted' callback on the Item type or 'deleteFromStore'
         # is overridden, we have to do it the slow way.
-        deletedOverridden = (
-            six.get_unbound_function(self.tableClass.deleted) is not
-            six.get_unbound_function(item.Item.deleted)
-        )
-        deleteFromStoreOverridden = (
-            six.get_unbound_function(self.tableClass.deleteFromStore) is not
-            six.get_unbound_function(item.Item.deleteFromStore)
-        )
-
-        if deletedOverridden or deleteFromStoreOverridden:
+        if plan.perItem:
             for it in self:
                 it.deleteFromStore()
-        else:
+            return
 
-            # Find other item types whose instances need to be deleted
-            # when items of the type in this query are deleted, and
-            # remove them from the store.
-            def itemsToDelete(attr):
-                return attr.oneOf(self.getColumn("storeID"))
+        doomed = self.getColumn('storeID')
+        def itemsToDelete(attr):
+            return attr.oneOf(doomed)
+
+        if not item.allowDeletion(self.store, self.tableClass, itemsToDelete):
+            raise errors.DeletionDisallowed(
+                'Cannot delete item; '
+                'has referents with whenDeleted == reference.DISALLOW')
+
+        deleting = deleting + (self.tableClass,)
+        for attr in item._referencesIn(self.store, plan.cascades):
+            dependents = self.store.query(attr.type, itemsToDelete(attr))
+            if attr.type in deleting:
+                for it in dependents:
+                    it.deleteFromStore()
+            else:
+                dependents._deleteFromStore(eagerNullify, deleting)
 
-            if not item.allowDeletion(self.store, self.tableClass, itemsToDelete):
-                raise errors.DeletionDisallowed(
-                    'Cannot delete item; '
-                    'has referents with whenDeleted == reference.DISALLOW')
+        if eagerNullify:
+            for attr in item._referencesIn(self.store, plan.nullifies):
+                comparison = itemsToDelete(attr)
+                self.store.executeSQL(
+                    'UPDATE %s SET %s = NULL WHERE %s' % (
+                        attr.type.getTableName(self.store),
+                        attr.getShortColumnName(self.store),
+                        comparison.getQuery(self.store)),
+                    comparison.getArgs(self.store))
+                self.store._tableChanged(attr.type)
+
+        cached = self._cachedResults()
+
+        # actually run the DELETE for the items in this query.
+        self._runQuery('DELETE', "")
+        self.store._tableChanged(self.tableClass)
+
+        for it in cached:
+            it._deletedInBulk()
+
+
+    def _cachedResults(self):
+        """
+        Find the results of this query which are currently in the object
+        cache, without loading any which are not.
+
+        @return: A L{list} of Items.
+        """
+        cached = {}
+        for storeID, ref in list(self.store.objectCache.data.items()):
+            it = ref()
+            if type(it) is self.tableClass:
+                cached[storeID] = it
+        if not cached:
+            return []
+        matching = self.store.query(
+            self.tableClass,
+            attributes.AND(
+                self.tableClass.storeID.oneOf(self.getColumn('storeID')),
+                self.tableClass.storeID.oneOf(list(cached)))
+            ).getColumn('storeID')
+        return [cached[storeID] for storeID in matching]
 
-            for it in item.dependentItems(self.store,
-                                          self.tableClass, itemsToDelete):
-                it.deleteFromStore()
 
-            # actually run the DELETE for the items in this query.
-            self._runQuery('DELETE', "")
 
 class MultipleItemQuery(BaseQuery):
     """
@@ -767,7 +1342,7 @@ class MultipleItemQuery(BaseQuery):
             for tableClass in self.tableClass ])
         sql, args = self._sqlAndArgs('SELECT', target)
         sql = 'SELECT COUNT(*) FROM (' + sql + ')'
-        result = self.store.querySQL(sql, args)
+        result = self.store._cachedQuerySQL(self._tables, sql, args)
         assert len(result) == 1, 'more than one result: %r' % (result,)
         return result[0][0] or 0
 
@@ -830,7 +1405,8 @@ class _DistinctQuery(object):
             'SELECT DISTINCT',
             self.query.tableClass.storeID.getColumnName(self.query.store))
         sql = 'SELECT COUNT(*) FROM (' + sql + ')'
-        result = self.query.store.querySQL(sql, args)
+        result = self.query.store._cachedQuerySQL(
+            self.query._tables, sql, args)
         assert len(result) == 1, 'more than one result: %r' % (result,)
         return result[0][0] or 0
 
@@ -855,13 +1431,181 @@ class _MultipleItemDistinctQuery(_DistinctQuery):
             'SELECT DISTINCT',
             target)
         sql = 'SELECT COUNT(*) FROM (' + sql + ')'
-        result = self.query.store.querySQL(sql, args)
+        result = self.query.store._cachedQuerySQL(
+            self.query._tables, sql, args)
         assert len(result) == 1, 'more than one result: %r' % (result,)
         return result[0][0] or 0
 
 
 _noDefault = object()
 
+class _UnionPagination(_Pagination):
+    """
+    The results of L{UnionQuery.paginate}, found a page at a time.
+    """
+    def _paginate(self):
+        """
+        Yield the results of the union, one page at a time.
+        """
+        while True:
+            rows = self.query._runUnion(self._key, self.pagesize)
+            for result, key in rows:
+                self._key = key
+                yield result
+            if len(rows) < self.pagesize:
+                return
+
+
+
+class UnionQuery(object):
+    """
+    The items matched by several item queries, perhaps of different types,
+    merged into one sorted sequence by a single statement.  This is the type
+    returned from L{Store.queryUnion}.
+
+    Each of the queries is sorted by its own columns, which correspond to
+    those of the others: the results are merged by the values of the first
+    columns of each, then of the second, and so on.  Results with the same
+    sort values are ordered by storeID, which is unique across item types.
+
+    @ivar store: the L{Store} queried.
+    @ivar queries: a list of L{ItemQuery} instances, one for each kind of
+        item in the union, each sorted and limited as the union is.
+    @ivar limit: the number of results to give, or C{None} for all of them.
+    """
+    def __init__(self, store, queries, sort, limit=None):
+        """
+        @param queries: a sequence of (item type, L{IComparison} provider or
+            C{None}) pairs.
+        @param sort: a sequence of orderings, one for each of C{queries}.
+        """
+        queries = list(queries)
+        sort = list(sort)
+        if not queries:
+            raise ValueError("A union needs at least one query")
+        if len(sort) != len(queries):
+            raise ValueError("A union needs an ordering for each query")
+        self.store = store
+        self.limit = limit
+        self.queries = [
+            ItemQuery(store, tableClass, comparison, limit=limit,
+                      sort=ordering)
+            for ((tableClass, comparison), ordering) in zip(queries, sort)]
+        self._keyColumns = [_paginationKey(query) for query in self.queries]
+        directions = [[direction for (column, direction) in keyColumns]
+                      for keyColumns in self._keyColumns]
+        for query, queryDirections in zip(self.queries, directions):
+            if queryDirections != directions[0]:
+                raise ValueError(
+                    "The sorts of %r and %r do not correspond" % (
+                        self.queries[0].sort, query.sort))
+        self._width = max([1 + query._deferredMask.count(False)
+                           for query in self.queries])
+
+
+    def __repr__(self):
+        return '%s(%r, %r, %r)' % (
+            self.__class__.__name__, self.store, self.queries, self.limit)
+
+
+    def __iter__(self):
+        for result, key in self._runUnion(None, self.limit):
+            yield result
+
+
+    def paginate(self, pagesize=20, resumeToken=None):
+        """
+        Iterate over the results of the union a page at a time, as
+        L{ItemQuery.paginate} does, each page being found by a single
+        statement.
+
+        @param pagesize: the number of results to find at a time.
+        @param resumeToken: a token from the C{resumeToken} method of an
+            earlier pagination of the same union, or C{None}.
+
+        @rtype: L{_UnionPagination}
+        """
+        if pagesize < 1:
+            raise ValueError("Pages must hold at least one result")
+        return _UnionPagination(
+            self, self._keyColumns[0], pagesize, resumeToken)
+
+
+    def _runUnion(self, key, limit):
+        """
+        Find the results of the union which sort after a key.
+
+        Each query contributes one C{SELECT} for each of the comparisons made
+        by L{_keysetAfter}, limited and sorted so SQLite can stop early, and
+        selecting the index of the query, the key columns, the storeID and
+        the other columns loaded, padded with C{NULL} so that every C{SELECT}
+        of the C{UNION ALL} has as many columns.
+
+        @param key: the stored values of the key columns to find the results
+            after, or C{None} to start from the beginning.
+        @param limit: the number of results to find, or C{None}.
+
+        @return: a list of (item, key) pairs.
+        """
+        t = time.time()
+        store = self.store
+        if not store.autocommit:
+            store.checkpoint()
+        keyLength = len(self._keyColumns[0])
+        statements = []
+        args = []
+        tables = []
+        for index, query in enumerate(self.queries):
+            keyColumns = self._keyColumns[index]
+            if key is None:
+                comparisons = [query.comparison]
+            else:
+                comparisons = [
+                    after if query.comparison is None
+                    else attributes.AND(query.comparison, after)
+                    for after in _keysetAfter(keyColumns, key)]
+            sort = attributes.CompoundOrdering([
+                attributes.SimpleOrdering(column, direction)
+                for (column, direction) in keyColumns])
+            padding = self._width - 1 - query._deferredMask.count(False)
+            target = ', '.join(
+                [str(index)] +
+                [column.getColumnName(store)
+                 for (column, direction) in keyColumns] +
+                [query._queryTarget] + ['NULL'] * padding)
+            for comparison in comparisons:
+                arm = ItemQuery(store, query.tableClass, comparison,
+                                limit=limit, sort=sort, defer=query.defer)
+                sqlstr, sqlargs = arm._sqlAndArgs('SELECT', target)
+                statements.append('SELECT * FROM (%s)' % (sqlstr,))
+                args.extend(sqlargs)
+                tables.extend([table for table in arm._tables
+                               if table not in tables])
+        if not statements:
+            return []
+        sqlstr = 'SELECT * FROM (%s) ORDER BY %s' % (
+            ' UNION ALL '.join(statements),
+            ', '.join(['%d %s' % (i + 2, direction)
+                       for (i, (column, direction))
+                       in enumerate(self._keyColumns[0])]))
+        if limit is not None:
+            sqlstr += ' LIMIT %d' % (limit,)
+        rows = store._cachedQuerySQL(tables, sqlstr, args)
+        log.msg(interface=iaxiom.IStatEvent,
+                querySite=self.queries[0].locateCallSite(),
+                queryTime=time.time() - t, querySQL=sqlstr,
+                queryStore=store)
+        results = []
+        for row in rows:
+            query = self.queries[row[0]]
+            start = 1 + keyLength
+            width = 1 + query._deferredMask.count(False)
+            results.append((query._massageData(row[start:start + width]),
+                            tuple(row[1:start])))
+        return results
+
+
+
 class AttributeQuery(BaseQuery):
     """
     A query for the value of a single attribute from an item class, so as to
@@ -902,66 +1646,490 @@ class AttributeQuery(BaseQuery):
         return self.attribute.outfilter(row[0], _FakeItemForFilter(self.store))
 
 
-    def count(self):
-        """
-        @return: the number of non-None values of this attribute specified by this query.
+    def count(self):
+        """
+        @return: the number of non-None values of this attribute specified by this query.
+        """
+        rslt = self._runQuery('SELECT', 'COUNT(%s)' % (self._queryTarget,)) or [(0,)]
+        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
+        return rslt[0][0]
+
+
+
+    def sum(self):
+        """
+        Return the sum of all the values returned by this query.  If no results
+        are specified, return None.
+
+        Note: for non-numeric column types the result of this method will be
+        nonsensical.
+
+        @return: a number or None.
+        """
+        res = self._runQuery('SELECT', 'SUM(%s)' % (self._queryTarget,)) or [(0,)]
+        assert len(res) == 1, "more than one result: %r" % (res,)
+        dbval = res[0][0] or 0
+        return self.attribute.outfilter(dbval, _FakeItemForFilter(self.store))
+
+
+    def average(self):
+        """
+        Return the average value (as defined by the AVG implementation in the
+        database) of the values specified by this query.
+
+        Note: for non-numeric column types the result of this method will be
+        nonsensical.
+
+        @return: a L{float} representing the 'average' value of this column.
+        """
+        rslt = self._runQuery('SELECT', 'AVG(%s)' % (self._queryTarget,)) or [(0,)]
+        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
+        return rslt[0][0]
+
+
+    def max(self, default=_noDefault):
+        return self._functionOnTarget('MAX', default)
+
+
+    def min(self, default=_noDefault):
+        return self._functionOnTarget('MIN', default)
+
+
+    def _functionOnTarget(self, which, default):
+        rslt = self._runQuery('SELECT', '%s(%s)' %
+                              (which, self._queryTarget,)) or [(None,)]
+        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
+        dbval = rslt[0][0]
+        if dbval is None:
+            if default is _noDefault:
+                raise ValueError('%s() on table with no items'%(which))
+            else:
+                return default
+        return self.attribute.outfilter(dbval, _FakeItemForFilter(self.store))
+
+
+    def toArray(self, default=None, useNumPy=None, chunkSize=10000):
+        """
+        Load the values of this query into an array in one go, without
+        creating a Python object for each of them along the way.
+
+        Only attributes stored as numbers can be loaded this way, and the
+        values are the ones stored in the database: for example, the values
+        of an L{attributes.timestamp} are integer numbers of microseconds
+        since the epoch, those of an L{attributes.reference} are storeIDs, and
+        those of the fixed-point decimal attributes are scaled integers.
+
+        @param default: a number to give in place of C{None} values, or
+            C{None} if there are none.
+
+        @param useNumPy: C{True} to give a NumPy array, C{False} to give an
+            L{array.array}, or C{None} to give a NumPy array if NumPy is
+            installed.
+
+        @param chunkSize: the number of values to read from SQLite at a time.
+
+        @raise TypeError: if the attribute is not stored as a number.
+
+        @raise ValueError: if the query has C{None} values and no C{default}
+            was given.
+
+        @return: an array of 64-bit integers, or of doubles for an
+            L{attributes.ieee754_double}.
+        """
+        [result] = self._toArrays(
+            [self.attribute], default, useNumPy, chunkSize)
+        return result
+
+
+
+# The array typecode of 64-bit integers.
+if six.PY3:
+    _INT64 = 'q'
+else:
+    _INT64 = 'l'
+
+
+
+def _arrayTypeCode(column):
+    """
+    Determine the type of array to load the values of a column into.
+
+    @param column: an L{iaxiom.IColumn} provider.
+
+    @raise TypeError: if the column's values are not stored as numbers.
+
+    @return: an L{array.array} typecode, which is also a NumPy dtype.
+    """
+    if isinstance(column, item._StoreIDComparer):
+        sqltype = 'INTEGER'
+    else:
+        sqltype = getattr(column, 'sqltype', None)
+    if sqltype in ('INTEGER', 'BOOLEAN'):
+        return _INT64
+    elif sqltype == 'REAL':
+        return 'd'
+    raise TypeError("%r is not stored as a number" % (column,))
+
+
+
+def _columnFieldNames(columns):
+    """
+    Name the fields of named rows of the values of some columns after their
+    attributes, qualified by the names of their item types where several have
+    the same name, such as C{Message_name} and C{Person_name}.
+
+    @param columns: a sequence of L{IColumn} providers.
+
+    @return: a C{list} of C{str}.
+    """
+    names = [column.attrname for column in columns]
+    return [
+        name if names.count(name) == 1 else '%s_%s' % (
+            getattr(column, 'classname', ''), name)
+        for column, name in zip(columns, names)]
+
+
+
+class ProjectionQuery(BaseQuery):
+    """
+    A query for the values of several columns, possibly of several item
+    types, which yields a tuple for each row rather than loading Items.
+
+    @ivar columns: A C{tuple} of the L{iaxiom.IColumn} providers whose values
+        are yielded, in order.
+
+    @ivar raw: If true, the values are yielded as they are stored in the
+        database, without being passed through the columns' C{outfilter}s.
+
+    @ivar named: If true, each row is yielded as a named tuple whose fields
+        are named for the C{attrname}s of the columns, rather than as a plain
+        C{tuple}.
+    """
+    def __init__(self, store, tableClass,
+                 comparison=None, limit=None,
+                 offset=None, sort=None,
+                 columns=(), raw=False, named=False):
+        if not columns:
+            raise ValueError("Projection queries need at least one column")
+        self.columns = tuple(columns)
+        self.raw = raw
+        self.named = named
+        BaseQuery.__init__(self, store, tableClass,
+                           comparison, limit,
+                           offset, sort)
+        self._queryTarget = ', '.join([
+            column.getColumnName(self.store) for column in self.columns])
+
+        # Only bother calling the outfilters which do something.
+        self._outfilters = []
+        if not raw:
+            for index, column in enumerate(self.columns):
+                outfilter = getattr(column, 'outfilter', None)
+                if outfilter is None or getattr(
+                        outfilter, '__func__', None) in _identityOutfilters:
+                    continue
+                self._outfilters.append((index, outfilter))
+
+        if named:
+            # Names which are still not valid or unique are replaced with
+            # positional ones.
+            self._rowType = collections.namedtuple(
+                'Row', self._fieldNames(), rename=True)
+        else:
+            self._rowType = None
+
+
+    _cloneAttributes = BaseQuery._cloneAttributes + 'columns raw named'.split()
+
+
+    def _fieldNames(self):
+        """
+        @return: the names of the fields of my named rows.
+        """
+        return _columnFieldNames(self.columns)
+
+
+    def _involvedTables(self):
+        """
+        Return a list of tables involved in this query, first checking that
+        neither the result types nor the types of the projected columns have
+        been omitted from the comparison.
+        """
+        if isinstance(self.tableClass, tuple):
+            tableClasses = self.tableClass
+        else:
+            tableClasses = (self.tableClass,)
+
+        if self.comparison is not None:
+            tables = self.comparison.getInvolvedTables()
+            self.args = self.comparison.getArgs(self.store)
+        else:
+            tables = list(tableClasses)
+            self.args = []
+
+        for tableClass in tableClasses:
+            if tableClass not in tables:
+                raise ValueError(
+                    "Comparison omits required reference to result type %s"
+                    % (tableClass.typeName,))
+        for column in self.columns:
+            if column.type not in tables:
+                raise ValueError(
+                    "Projection references type excluded from comparison")
+        return tables
+
+
+    def _selectStuff(self, verb='SELECT'):
+        """
+        Return a generator which yields the rows of this query with a
+        particular SQL verb.  Rows which need no conversion are yielded just as
+        they came from SQLite.
+        """
+        sqlResults = self._runQuery(verb, self._queryTarget)
+        if not self._outfilters and self._rowType is None:
+            for row in sqlResults:
+                yield row
+        else:
+            for row in sqlResults:
+                yield self._massageData(row)
+
+
+    def _massageData(self, row):
+        """
+        Convert the database values in a row to the types described by my
+        columns.
+
+        @param row: a tuple with a value for each of my columns.
+
+        @return: a C{tuple} or named tuple of values.
+        """
+        if self._outfilters:
+            fakeItem = _FakeItemForFilter(self.store)
+            row = list(row)
+            for index, outfilter in self._outfilters:
+                row[index] = outfilter(row[index], fakeItem)
+        if self._rowType is not None:
+            return self._rowType._make(row)
+        return tuple(row)
+
+
+    def count(self):
+        """
+        @return: the number of rows this query has.
+        """
+        return self._countOf('SELECT')
+
+
+    def toArrays(self, default=None, useNumPy=None, chunkSize=10000):
+        """
+        Load the values of each of my columns into an array, without creating
+        a Python object for each value along the way.
+
+        @see: L{AttributeQuery.toArray}, which this is like, except that it
+            takes the arguments for every column at once.
+
+        @return: a C{list} of arrays, one for each of my columns.
+        """
+        return self._toArrays(self.columns, default, useNumPy, chunkSize)
+
+
+    def _countOf(self, verb):
+        if not self.store.autocommit:
+            self.store.checkpoint()
+        sql, args = self._sqlAndArgs(verb, self._queryTarget)
+        result = self.store._cachedQuerySQL(
+            self._tables, 'SELECT COUNT(*) FROM (' + sql + ')', args)
+        assert len(result) == 1, 'more than one result: %r' % (result,)
+        return result[0][0] or 0
+
+
+    def distinct(self):
+        """
+        @return: an L{iaxiom.IQuery} provider whose rows are distinct.
+        """
+        return _ProjectionDistinctQuery(self)
+
+
+
+class GroupQuery(ProjectionQuery):
+    """
+    A query for the distinct combinations of the values of some columns, and
+    aggregates of the rows with each combination.  Each result is a named
+    tuple, with fields named for the C{attrname}s of the grouping columns
+    followed by the names given to the aggregates.
+
+    A grouped query can be sorted on its aggregates, by cloning it with
+    C{sort=Foo.size.sum.descending} for example.
+
+    @ivar groupColumns: A C{tuple} of the L{iaxiom.IColumn} providers whose
+        values the rows are grouped by.
+
+    @ivar aggregates: A C{tuple} of two-tuples of the names and the
+        L{attributes.Aggregate}s computed for each group.
+
+    @ivar havingComparison: An L{iaxiom.IComparison} provider which the
+        groups must satisfy, or C{None}.
+    """
+    def __init__(self, store, tableClass,
+                 comparison=None, limit=None,
+                 offset=None, sort=None,
+                 groupColumns=(), aggregates=(), havingComparison=None):
+        self.groupColumns = tuple(groupColumns)
+        self.aggregates = tuple(aggregates)
+        self.havingComparison = havingComparison
+        ProjectionQuery.__init__(
+            self, store, tableClass, comparison, limit, offset, sort,
+            self.groupColumns + tuple(
+                aggregate for name, aggregate in self.aggregates),
+            named=True)
+        groupClauseParts = []
+        if self.groupColumns:
+            groupClauseParts.extend(['GROUP BY', ', '.join([
+                column.getColumnName(self.store)
+                for column in self.groupColumns])])
+        if self.havingComparison is not None:
+            groupClauseParts.extend(
+                ['HAVING', self.havingComparison.getQuery(self.store)])
+        self._groupClauseParts = groupClauseParts
+
+
+    _cloneAttributes = BaseQuery._cloneAttributes + [
+        'groupColumns', 'aggregates', 'havingComparison']
+
+
+    def _fieldNames(self):
+        return (_columnFieldNames(self.groupColumns) +
+                [name for name, aggregate in self.aggregates])
+
+
+    def _involvedTables(self):
+        """
+        Return a list of tables involved in this query, checking that the
+        C{HAVING} comparison involves no others.
+        """
+        tables = ProjectionQuery._involvedTables(self)
+        if self.havingComparison is not None:
+            for table in self.havingComparison.getInvolvedTables():
+                if table not in tables:
+                    raise ValueError(
+                        "Having comparison references type excluded from "
+                        "comparison")
+            # HAVING comes after WHERE.
+            self.args = (self.args +
+                         self.havingComparison.getArgs(self.store))
+        return tables
+
+
+    def aggregate(self, *pairs, **aggregates):
+        """
+        Compute more aggregates of each group.
+
+        @param pairs: C{(name, aggregate)} pairs, for aggregates to compute
+            in the order given.
+        @param aggregates: L{attributes.Aggregate}s, such as
+            C{Foo.size.sum}, by keyword, which are computed after those in
+            C{pairs}, in order of their names.
+
+        @return: a L{GroupQuery} like this one, with the given aggregates
+            added to the end of each result.
+        """
+        return self._clone(
+            aggregates=self.aggregates + tuple(
+                _orderedAggregates(pairs, aggregates)))
+
+
+    def having(self, comparison):
         """
-        rslt = self._runQuery('SELECT', 'COUNT(%s)' % (self._queryTarget,)) or [(0,)]
-        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
-        return rslt[0][0]
+        Filter the groups by their aggregates::
 
+            s.query(Message).groupBy(Message.folder).aggregate(
+                total=Message.size.sum).having(Message.size.sum > 1024)
 
+        @param comparison: an L{iaxiom.IComparison} provider, which may
+            compare aggregates and grouping columns.
 
-    def sum(self):
+        @return: a L{GroupQuery} like this one, whose groups also satisfy
+            C{comparison}.
         """
-        Return the sum of all the values returned by this query.  If no results
-        are specified, return None.
+        if self.havingComparison is not None:
+            comparison = attributes.AND(self.havingComparison, comparison)
+        return self._clone(havingComparison=comparison)
 
-        Note: for non-numeric column types the result of this method will be
-        nonsensical.
 
-        @return: a number or None.
-        """
-        res = self._runQuery('SELECT', 'SUM(%s)' % (self._queryTarget,)) or [(0,)]
-        assert len(res) == 1, "more than one result: %r" % (res,)
-        dbval = res[0][0] or 0
-        return self.attribute.outfilter(dbval, _FakeItemForFilter(self.store))
+    def _clone(self, **changes):
+        clonekw = {}
+        for attr in self._cloneAttributes:
+            clonekw[attr] = getattr(self, attr)
+        clonekw.update(changes)
+        return self.__class__(**clonekw)
 
 
-    def average(self):
-        """
-        Return the average value (as defined by the AVG implementation in the
-        database) of the values specified by this query.
 
-        Note: for non-numeric column types the result of this method will be
-        nonsensical.
+class _ProjectionDistinctQuery(_DistinctQuery):
+    """
+    Distinct query based on a L{ProjectionQuery}.
+    """
+    def count(self):
+        """
+        Count the number of distinct rows of the wrapped query.
 
-        @return: a L{float} representing the 'average' value of this column.
+        @return: an L{int} representing the number of distinct rows.
         """
-        rslt = self._runQuery('SELECT', 'AVG(%s)' % (self._queryTarget,)) or [(0,)]
-        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
-        return rslt[0][0]
+        return self.query._countOf('SELECT DISTINCT')
 
 
-    def max(self, default=_noDefault):
-        return self._functionOnTarget('MAX', default)
 
+# The outfilters which return database values unchanged, and so can be skipped
+# by projection queries.
+_identityOutfilters = tuple(
+    getattr(outfilter, '__func__', outfilter) for outfilter in [
+        attributes.SQLAttribute.outfilter, item._StoreIDComparer.outfilter])
 
-    def min(self, default=_noDefault):
-        return self._functionOnTarget('MIN', default)
 
 
-    def _functionOnTarget(self, which, default):
-        rslt = self._runQuery('SELECT', '%s(%s)' %
-                              (which, self._queryTarget,)) or [(None,)]
-        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
-        dbval = rslt[0][0]
-        if dbval is None:
-            if default is _noDefault:
-                raise ValueError('%s() on table with no items'%(which))
-            else:
-                return default
-        return self.attribute.outfilter(dbval, _FakeItemForFilter(self.store))
+def _changeTrackedType(table):
+    """
+    Find the item type whose changes are tracked for a table involved in a
+    query.
+
+    @param table: the result of L{iaxiom.IComparison.getInvolvedTables}.
+
+    @return: an L{Item} subclass.
+    """
+    if isinstance(table, item.Placeholder):
+        return table._placeholderItemClass
+    elif isinstance(table, (attributes.FullTextIndex,
+                            attributes.IntervalIndex)):
+        return table.type
+    return table
+
+
+
+def _insertableOrIgnored(itemClass, attrs):
+    """
+    Determine whether L{Store.findOrCreate} can create an item of
+    C{itemClass} with L{Store._insertOrIgnore}: whether the values given for
+    it include non-C{None} values of all the columns of a unique index, which
+    is not partial, and whether creating it does nothing more than inserting
+    its row and calling L{item.Item.stored}.
+
+    @param attrs: a C{dict} mapping attribute names to values.
+    """
+    if itemClass.__legacy__ or (
+            item._function(itemClass.__init__) is not
+            item._function(item.Item.__init__)):
+        return False
+    for name, attr in itemClass.getSchema():
+        if attr.unique and attrs.get(name) is not None:
+            return True
+        for compound in attr.compoundIndexes:
+            if (getattr(compound, 'unique', False) and
+                    getattr(compound, 'where', None) is None and
+                    all(attrs.get(column.attrname) is not None
+                        for column in compound)):
+                return True
+    return False
+
 
 
 def _storeBatchServiceSpecialCase(*args, **kwargs):
@@ -1076,6 +2244,14 @@ class Store(Empowered):
     filesdir = None # FilePath to the filesystem-storage subdirectory of the
                     # database directory, or None for in-memory Stores.
 
+    backgroundIndexThreshold = 10000 # Missing indexes on tables with more
+                                     # rows than this are built in the
+                                     # background after the store is opened.
+    indexBuildBudget = 0.5 # Seconds of background index building per
+                           # cooperative step; at least one index is built.
+    queryCacheSize = 0 # The number of query results to keep and reuse until
+                       # the tables they involve change; 0 to keep none.
+
     store = property(lambda self: self) # I have a 'store' attribute because I
                                         # am 'stored' within myself; this is
                                         # also for references to use.
@@ -1148,6 +2324,17 @@ class Store(Empowered):
         self.execTimes = []
 
         self._inMemoryPowerups = {}
+        self._powerupCache = {} # (storeID, interface name) =>
+                                # (connector generation, powerup storeIDs)
+        self._tableGenerations = {} # item type => generation
+        self._generationsAtBegin = None # _tableGenerations when the current
+                                        # transaction began
+        self._queryCache = collections.OrderedDict() # (sql, args) =>
+                                                     # (generations, rows)
+        self._dataVersion = None # PRAGMA data_version when last checked
+        self._changeLog = None # type ID => generation in axiom_change_log,
+                               # or None for in-memory stores
+        self._changedThisTransaction = set() # item types to log at commit
 
         self._attachedChildren = {} # database name => child store object
 
@@ -1173,6 +2360,9 @@ class Store(Empowered):
 
         self._upgradeManager = upgrade._StoreUpgrade(self)
 
+        self._pendingIndexes = [] # (name, SQL statements) of indexes to
+                                  # build later
+
         self._axiom_service = None
 
 
@@ -1233,8 +2423,15 @@ class Store(Empowered):
                             "  Possible cause of error: ")
                     log.err(_initialOpenFailure)
                 raise
+            # Other connections may change this database, so keep track.
+            self.executeSchemaSQL(_schema.CREATE_CHANGE_LOG)
+            self._changeLog = {}
 
-        self.transact(self._startup)
+        self._backgroundIndexing = True
+        try:
+            self.transact(self._startup)
+        finally:
+            self._backgroundIndexing = False
 
         # _startup may have found some things which we must now upgrade.
         if self._upgradeManager.upgradesPending:
@@ -1250,6 +2447,17 @@ class Store(Empowered):
         else:
             self._upgradeComplete = None
 
+        # _startup may also have left some indexes on large tables unbuilt.
+        if self._pendingIndexes:
+            log.msg("%r will build %d indexes in the background." % (
+                self, len(self._pendingIndexes)))
+            self._indexesComplete = self._upgradeService.coop.cooperate(
+                self._buildIndexesInBackground())
+            self._indexesComplete.whenDone().addErrback(
+                log.err, "building indexes for %r failed" % (self,))
+        else:
+            self._indexesComplete = None
+
         log.msg(
             interface=iaxiom.IStatEvent,
             store_opened=self.dbdir is not None and self.dbdir.path or '')
@@ -1332,10 +2540,11 @@ class Store(Empowered):
             self._checkTypeSchemaConsistency(cls, persistedSchema)
 
         # Schema is consistent!  Now, if I forgot to create any indexes last
-        # time I saw this table, do it now...
+        # time I saw this table, do it now, or later if the table is large...
         extantIndexes = self._loadExistingIndexes()
         for cls in typesToCheck:
-            self._createIndexesFor(cls, extantIndexes)
+            self._createIndexesFor(
+                cls, extantIndexes, background=self._backgroundIndexing)
 
         self._upgradeManager.checkUpgradePaths()
 
@@ -1353,11 +2562,37 @@ class Store(Empowered):
         # Totally SQLite-specific: look up what indexes exist already in
         # sqlite_master so we can skip trying to create them (which can be
         # really slow).
+        # The triggers which maintain full-text indexes are loaded too, as
+        # they show whether those indexes exist.
         return set(
             name
             for (name,) in self.querySchemaSQL(
                 "SELECT name FROM *DATABASE*.sqlite_master "
-                "WHERE type = 'index'"))
+                "WHERE type IN ('index', 'trigger')"))
+
+
+    def _hasTableFor(self, tableClass):
+        """
+        Determine whether the table for an Item type exists in this store,
+        without creating it.  If the type was not present when this store was
+        opened, the database is checked in case another process has created
+        the table since then.
+
+        @param tableClass: An L{item.Item} subclass.
+
+        @rtype: L{bool}
+        """
+        key = (tableClass.typeName, tableClass.schemaVersion)
+        if key in self.typenameAndVersionToID:
+            return True
+        [(count,)] = self.querySchemaSQL(
+            _schema.HAS_SCHEMA_FEATURE,
+            ['table', self._tableNameOnlyFor(*key)])
+        if not count:
+            return False
+        # Someone else created it; pick up its schema.
+        self.getTypeID(tableClass)
+        return True
 
 
     def _initdb(self, dbfname):
@@ -1397,6 +2632,12 @@ class Store(Empowered):
         set of keyword arguments, returning the first match if one is found,
         creating one with the given attributes if not.  Takes an optional
         positional argument function to call on the new item if it is new.
+
+        If the attributes include all those of a unique index (declared with
+        C{unique=True}), another process may create a matching item between
+        the search and the creation; that item is returned instead.  Outside
+        a transaction the new item's row is then inserted with C{INSERT ... ON
+        CONFLICT DO NOTHING}, and fetched again if the insert did nothing.
         """
         andargs = []
         for k, v in six.iteritems(attrs):
@@ -1412,11 +2653,64 @@ class Store(Empowered):
 
         for result in self.query(userItemClass, *cond):
             return result
-        newItem = userItemClass(store=self, **attrs)
+        if self.autocommit and _insertableOrIgnored(userItemClass, attrs):
+            # Within a transaction, BEGIN IMMEDIATE already made the search
+            # and the creation atomic.
+            storeID = self._autocommitLogged(
+                self._insertOrIgnore, userItemClass, attrs)
+            if storeID is None:
+                for result in self.query(userItemClass, *cond):
+                    return result
+                raise errors.ItemNotFound(
+                    "%r conflicted with an item which is gone" % (
+                        userItemClass,))
+            newItem = self.getItemByID(storeID)
+            newItem.stored()
+        else:
+            try:
+                newItem = userItemClass(store=self, **attrs)
+            except errors.UniqueConstraintViolation:
+                for result in self.query(userItemClass, *cond):
+                    return result
+                raise
         if __ifnew is not None:
             __ifnew(newItem)
         return newItem
 
+    def _insertOrIgnore(self, itemClass, attrs):
+        """
+        Insert a row for a new item of C{itemClass} with the given attribute
+        values, and defaults for the rest, unless it would conflict with an
+        existing item in a unique index.
+
+        @return: The storeID of the new item, or C{None} if there was a
+            conflict.
+        """
+        class FakeItem:
+            pass
+        fakeOSelf = FakeItem()
+        fakeOSelf.store = self
+        insertArgs = []
+        for name, attr in itemClass.getSchema():
+            if name in attrs:
+                pyval = attrs[name]
+            else:
+                pyval = attr.computeDefault()
+            insertArgs.append(attr._convertPyval(fakeOSelf, pyval))
+        storeID = self.executeSchemaSQL(
+            _schema.CREATE_OBJECT, [self.getTypeID(itemClass)])
+        self.executeSQL(
+            itemClass._baseInsertSQL(self) + ' ON CONFLICT DO NOTHING',
+            [storeID] + insertArgs)
+        [(inserted,)] = self.querySQL(_schema.CHANGED_ROWS)
+        if not inserted:
+            # The item was not inserted, so neither is its object.
+            self.executeSchemaSQL(_schema.CHANGE_TYPE, [-1, storeID])
+            return None
+        self._tableChanged(itemClass)
+        return storeID
+
+
     def newFilePath(self, *path):
         p = self.filesdir
         for subdir in path:
@@ -1661,7 +2955,7 @@ class Store(Empowered):
         return default
 
     def query(self, tableClass, comparison=None,
-              limit=None, offset=None, sort=None):
+              limit=None, offset=None, sort=None, defer=None):
         """
         Return a generator of instances of C{tableClass},
         or tuples of instances if C{tableClass} is a
@@ -1702,15 +2996,53 @@ class Store(Empowered):
         @param sort: an L{ISort}, something that comes from an SQLAttribute's
         'ascending' or 'descending' attribute.
 
+        @param defer: a sequence of attributes of C{tableClass} whose values
+        will not be loaded with the results, but when they are first accessed
+        (together for up to 100 results at once), or None to defer the
+        attributes declared with C{deferred=True}.  Items which are already in
+        memory are unaffected.  Not supported if tableClass is a tuple.
+
         @return: an L{ItemQuery} object, which is an iterable of Items or
         tuples of Items, according to tableClass.
         """
         if isinstance(tableClass, tuple):
-            queryClass = MultipleItemQuery
-        else:
-            queryClass = ItemQuery
+            if defer is not None:
+                raise ValueError(
+                    "Deferred attributes are not supported for queries "
+                    "of multiple item types")
+            return MultipleItemQuery(
+                self, tableClass, comparison, limit, offset, sort)
+
+        return ItemQuery(self, tableClass, comparison, limit, offset, sort,
+                         defer=defer)
+
+    def queryUnion(self, queries, sort, limit=None):
+        """
+        Return the items matched by several queries, perhaps of different
+        types, merged into one sorted sequence by a single statement.
+
+        For example, the latest twenty messages and events together::
+
+            s.queryUnion([(Message, Message.folder == inbox),
+                          (Event, None)],
+                         sort=[Message.received.descending,
+                               Event.start.descending],
+                         limit=20)
+
+        @param queries: a sequence of (item type, L{IComparison} provider or
+        None) pairs, as would be passed to L{query}.
+
+        @param sort: a sequence of orderings, one for each query, whose
+        columns correspond and are sorted in the same directions.
+
+        @param limit: an int to limit the total length of the results, or None
+        for all available results.
+
+        @return: a L{UnionQuery}, which is an iterable of Items, and can be
+        paginated with resume tokens.
+        """
+        return UnionQuery(self, queries, sort, limit)
 
-        return queryClass(self, tableClass, comparison, limit, offset, sort)
 
     def sum(self, summableAttribute, *a, **k):
         args = (self, summableAttribute.type) + a
@@ -1755,19 +3087,22 @@ class Store(Empowered):
         schema = [attr for (name, attr) in itemType.getSchema()]
         for i, attr in enumerate(itemAttributes):
             indices[attr.attrname] = i
-        for row in dataRows:
-            oid = self.store.executeSchemaSQL(
-                _schema.CREATE_OBJECT, [self.store.getTypeID(itemType)])
-            insertArgs = [oid]
-            for attr in schema:
-                i = indices.get(attr.attrname, _NEEDS_DEFAULT)
-                if i is _NEEDS_DEFAULT:
-                    pyval = attr.default
-                else:
-                    pyval = row[i]
-                dbval = attr._convertPyval(fakeOSelf, pyval)
-                insertArgs.append(dbval)
-            self.executeSQL(sql, insertArgs)
+        def insertRows():
+            for row in dataRows:
+                oid = self.store.executeSchemaSQL(
+                    _schema.CREATE_OBJECT, [self.store.getTypeID(itemType)])
+                insertArgs = [oid]
+                for attr in schema:
+                    i = indices.get(attr.attrname, _NEEDS_DEFAULT)
+                    if i is _NEEDS_DEFAULT:
+                        pyval = attr.default
+                    else:
+                        pyval = row[i]
+                    dbval = attr._convertPyval(fakeOSelf, pyval)
+                    insertArgs.append(dbval)
+                self.executeSQL(sql, insertArgs)
+            self._tableChanged(itemType)
+        self._autocommitLogged(insertRows)
 
     def _loadedItem(self, itemClass, storeID, attrs):
         try:
@@ -1859,9 +3194,11 @@ class Store(Empowered):
         if self.debug:
             print('<'*10, 'BEGIN', '>'*10)
         self.cursor.execute("BEGIN IMMEDIATE TRANSACTION")
+        self.checkExternalChanges()
         self._setupTxnState()
 
     def _setupTxnState(self):
+        self._generationsAtBegin = self._tableGenerations.copy()
         self.executedThisTransaction = []
         self.tablesCreatedThisTransaction = []
         if self.attachedToParent:
@@ -1878,6 +3215,7 @@ class Store(Empowered):
         if self.debug:
             print('*'*10, 'COMMIT', '*'*10)
         # self.connection.commit()
+        self._logTransactionChanges()
         self.cursor.execute("COMMIT")
         log.msg(interface=iaxiom.IStatEvent, stat_commits=1)
         self._postCommitHook()
@@ -1906,6 +3244,12 @@ class Store(Empowered):
 
 
     def _inMemoryRollback(self):
+        self._powerupCache.clear()
+        if self._generationsAtBegin is not None:
+            # Results cached during the transaction may include reverted
+            # changes.
+            self._tableGenerations = self._generationsAtBegin
+            self._queryCache.clear()
         self._rejectChanges += 1
         try:
             for item in self.transaction:
@@ -1936,6 +3280,8 @@ class Store(Empowered):
 
 
     def _cleanupTxnState(self):
+        self._generationsAtBegin = None
+        self._changedThisTransaction.clear()
         self.autocommit = True
         self.transaction = None
         self.touched = None
@@ -2170,7 +3516,7 @@ class Store(Empowered):
         return typeID
 
 
-    def _createIndexesFor(self, tableClass, extantIndexes):
+    def _createIndexesFor(self, tableClass, extantIndexes, background=False):
         """
         Create any indexes which don't exist and are required by the schema
         defined by C{tableClass}.
@@ -2182,17 +3528,26 @@ class Store(Empowered):
             argument to the C{in} operator) which contains the unqualified
             names of all indexes which already exist in the underlying database
             and do not need to be created.
+
+        @param background: If true, and C{tableClass}'s table has more than
+            C{backgroundIndexThreshold} rows, queue the indexes to be built by
+            L{_buildIndexesInBackground} instead of creating them now.
+            Full-text index tables are always created now, since queries
+            which use them cannot do without them.
         """
         try:
             indexes = _requiredTableIndexes[tableClass]
         except KeyError:
             indexes = set()
             for nam, atr in tableClass.getSchema():
-                if atr.indexed:
-                    indexes.add(((atr.getShortColumnName(self),), (atr.attrname,)))
+                if atr.unique:
+                    # The unique index serves for lookups too.
+                    indexes.add(((atr.getShortColumnName(self),),
+                                 (atr.attrname, 'unique'), None, True))
+                elif atr.indexed:
+                    indexes.add(((atr.getShortColumnName(self),), (atr.attrname,), None, False))
                 for compound in atr.compoundIndexes:
-                    indexes.add((tuple(inatr.getShortColumnName(self) for inatr in compound),
-                                 tuple(inatr.attrname for inatr in compound)))
+                    indexes.add(self._compoundIndexFor(tableClass, compound))
             _requiredTableIndexes[tableClass] = indexes
 
         # _ZOMFG_ SQL is such a piece of _shit_: you can't fully qualify the
@@ -2201,14 +3556,340 @@ class Store(Empowered):
 
         indexColumnPrefix = '.'.join(self.getTableName(tableClass).split(".")[1:])
 
-        for (indexColumns, indexAttrs) in indexes:
+        largeTable = None
+        for (indexColumns, indexAttrs, predicate, unique) in indexes:
             nameOfIndex = self._indexNameOf(tableClass, indexAttrs)
             if nameOfIndex in extantIndexes:
                 continue
-            csql = 'CREATE INDEX %s.%s ON %s(%s)' % (
+            csql = '%s.%s ON %s(%s)' % (
                 self.databaseName, nameOfIndex, indexColumnPrefix,
                 ', '.join(indexColumns))
-            self.createSQL(csql)
+            if predicate is not None:
+                csql += ' WHERE ' + predicate
+            if unique:
+                # A constraint cannot wait to be built in the background.
+                try:
+                    self.createSQL('CREATE UNIQUE INDEX ' + csql)
+                except errors.UniqueConstraintViolation:
+                    # The table already holds duplicates, from before the
+                    # index was declared; go on without it.
+                    log.msg("Cannot create unique index %s in %r: "
+                            "%r has duplicate rows" % (
+                                nameOfIndex, self, tableClass))
+                continue
+            if background and largeTable is None:
+                largeTable = self._hasManyRows(tableClass)
+            if background and largeTable:
+                if nameOfIndex not in [name for (name, sql)
+                                       in self._pendingIndexes]:
+                    # Another Store object may get there first.
+                    self._pendingIndexes.append(
+                        (nameOfIndex, ['CREATE INDEX IF NOT EXISTS ' + csql]))
+                continue
+            self.createSQL('CREATE INDEX ' + csql)
+
+        fullTextIndexes = []
+        for nam, atr in tableClass.getSchema():
+            for index in atr.fullTextIndexes:
+                if index not in fullTextIndexes:
+                    fullTextIndexes.append(index)
+        for index in fullTextIndexes:
+            nameOfIndex = self._fullTextTableNameOf(
+                tableClass, [column.attrname for column in index.columns])
+            if nameOfIndex + '_insert' in extantIndexes:
+                continue
+            for sql in self._fullTextIndexSQL(tableClass, index, nameOfIndex):
+                self.createSQL(sql)
+
+        intervalIndexes = []
+        for nam, atr in tableClass.getSchema():
+            for index in atr.intervalIndexes:
+                if index not in intervalIndexes:
+                    intervalIndexes.append(index)
+        for index in intervalIndexes:
+            nameOfIndex = self._intervalTableNameOf(
+                tableClass, [index.start.attrname, index.end.attrname])
+            if nameOfIndex + '_insert' in extantIndexes:
+                continue
+            if background and largeTable is None:
+                largeTable = self._hasManyRows(tableClass)
+            statements = self._intervalIndexSQL(
+                tableClass, index, nameOfIndex)
+            if background and largeTable:
+                if nameOfIndex not in [name for (name, sql)
+                                       in self._pendingIndexes]:
+                    self._pendingIndexes.append((nameOfIndex, statements))
+                continue
+            for sql in statements:
+                self.createSQL(sql)
+
+
+    def _fullTextTableNameOf(self, tableClass, attrname):
+        """
+        Return the unqualified name of the FTS5 table indexing the given
+        attributes of the given table.
+
+        @param attrname: A sequence of the names of the indexed attributes.
+        """
+        return "axiomfts_%s_v%d_%s" % (tableClass.typeName,
+                                       tableClass.schemaVersion,
+                                       '_'.join(attrname))
+
+
+    def _fullTextIndexSQL(self, tableClass, index, nameOfIndex):
+        """
+        Generate the statements which create an FTS5 table for a
+        L{attributes.FullTextIndex}, the triggers which keep it up to date with
+        C{tableClass}'s table, and index the items already in that table.
+
+        The FTS5 table is an I{external content} table, so the text is not
+        stored twice.  Every statement can safely be repeated.
+
+        @return: A C{list} of C{str}.
+        """
+        tableName = self.getTableName(tableClass).split('.')[-1]
+        qualifiedName = '%s.%s' % (self.databaseName, nameOfIndex)
+        columns = [column.getShortColumnName(self) for column in index.columns]
+        options = ["content='%s'" % (tableName,), "content_rowid='oid'"]
+        if index.tokenize is not None:
+            options.append("tokenize=%s" % (
+                attributes._sqlLiteral(six.text_type(index.tokenize)),))
+        def values(row):
+            return ', '.join(
+                ['%s.oid' % (row,)] +
+                ['%s.%s' % (row, column) for column in columns])
+        insert = 'INSERT INTO %s(rowid, %s) VALUES (%s);' % (
+            nameOfIndex, ', '.join(columns), values('new'))
+        delete = "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', %s);" % (
+            nameOfIndex, nameOfIndex, ', '.join(columns), values('old'))
+        return [
+            'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s)' % (
+                qualifiedName, ', '.join(columns + options)),
+            'CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON %s '
+            'BEGIN %s END' % (qualifiedName, tableName, insert),
+            'CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON %s '
+            'BEGIN %s END' % (qualifiedName, tableName, delete),
+            'CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE OF %s ON %s '
+            'BEGIN %s %s END' % (qualifiedName, ', '.join(columns), tableName,
+                                 delete, insert),
+            "INSERT INTO %s(%s) VALUES ('rebuild')" % (
+                qualifiedName, nameOfIndex)]
+
+
+    def _intervalTableNameOf(self, tableClass, attrname):
+        """
+        Return the unqualified name of the R*Tree table indexing the intervals
+        between the given attributes of the given table.
+
+        @param attrname: The names of the start and end attributes.
+        """
+        return "axiomrtree_%s_v%d_%s" % (tableClass.typeName,
+                                         tableClass.schemaVersion,
+                                         '_'.join(attrname))
+
+
+    def _intervalIndexSQL(self, tableClass, index, nameOfIndex):
+        """
+        Generate the statements which create an R*Tree table for a
+        L{attributes.IntervalIndex}, the triggers which keep it up to date with
+        C{tableClass}'s table, and index the items already in that table.
+
+        Each item is indexed by the lower and higher of its two values, so
+        that the index covers its interval even if they are the wrong way
+        around.  Every statement can safely be repeated.
+
+        @return: A C{list} of C{str}.
+        """
+        tableName = self.getTableName(tableClass).split('.')[-1]
+        qualifiedName = '%s.%s' % (self.databaseName, nameOfIndex)
+        start = index.start.getShortColumnName(self)
+        end = index.end.getShortColumnName(self)
+        def select(row):
+            return ('SELECT %(row)s.oid, '
+                    'min(%(row)s.%(start)s, %(row)s.%(end)s), '
+                    'max(%(row)s.%(start)s, %(row)s.%(end)s)' % dict(
+                        row=row, start=start, end=end))
+        def indexed(row):
+            return '%s.%s IS NOT NULL AND %s.%s IS NOT NULL' % (
+                row, start, row, end)
+        insert = 'INSERT INTO %s(id, low, high) %s WHERE %s;' % (
+            nameOfIndex, select('new'), indexed('new'))
+        delete = 'DELETE FROM %s WHERE id = old.oid;' % (nameOfIndex,)
+        return [
+            'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING rtree(id, low, high)'
+            % (qualifiedName,),
+            'CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON %s '
+            'BEGIN %s END' % (qualifiedName, tableName, insert),
+            'CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON %s '
+            'BEGIN %s END' % (qualifiedName, tableName, delete),
+            'CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE OF %s, %s ON '
+            '%s BEGIN %s %s END' % (qualifiedName, start, end, tableName,
+                                    delete, insert),
+            'INSERT OR REPLACE INTO %s(id, low, high) %s FROM %s AS item '
+            'WHERE %s' % (qualifiedName, select('item'),
+                          self.getTableName(tableClass), indexed('item'))]
+
+
+    def getIntervalTableName(self, index):
+        """
+        Retrieve the fully qualified name of the R*Tree table for an interval
+        index in this store, creating the item type's table (and so the R*Tree
+        table) if necessary.
+
+        @param index: An L{attributes.IntervalIndex}.
+
+        @return: a string
+        """
+        tableClass = index.type
+        self.getTableName(tableClass)
+        return '%s.%s' % (
+            self.databaseName,
+            self._intervalTableNameOf(
+                tableClass, [index.start.attrname, index.end.attrname]))
+
+
+    def getFullTextTableName(self, index):
+        """
+        Retrieve the fully qualified name of the FTS5 table for a full-text
+        index in this store, creating the item type's table (and so the FTS5
+        table) if necessary.
+
+        @param index: An L{attributes.FullTextIndex}.
+
+        @return: a string
+        """
+        tableClass = index.type
+        self.getTableName(tableClass)
+        return '%s.%s' % (
+            self.databaseName,
+            self._fullTextTableNameOf(
+                tableClass, [column.attrname for column in index.columns]))
+
+
+    def _hasManyRows(self, tableClass):
+        """
+        Determine, without counting all of them, whether C{tableClass}'s table
+        has more than C{backgroundIndexThreshold} rows.
+        """
+        return bool(self.querySQL(
+            'SELECT 1 FROM %s LIMIT 1 OFFSET %d' % (
+                self.getTableName(tableClass),
+                self.backgroundIndexThreshold)))
+
+
+    def pendingIndexes(self):
+        """
+        Return the names of the indexes which are required by the schema but
+        have not yet been built.
+
+        When a store is opened, missing indexes on tables with more than
+        C{backgroundIndexThreshold} rows are not built straight away.  Instead,
+        they are built in the background once the store's service is started,
+        or immediately by L{buildPendingIndexes}.  Queries work without them,
+        but may be slower.
+
+        @rtype: C{list} of C{str}
+        """
+        return [name for (name, sql) in self._pendingIndexes]
+
+
+    def _buildNextIndex(self):
+        """
+        Build the first pending index.
+        """
+        name, statements = self._pendingIndexes[0]
+        before = time.time()
+        for sql in statements:
+            self.createSQL(sql)
+        self._pendingIndexes.pop(0)
+        log.msg("Built index %s in %r in %.1fs; %d remaining." % (
+            name, self, time.time() - before, len(self._pendingIndexes)))
+        log.msg(interface=iaxiom.IStatEvent, stat_indexes_built=1,
+                stat_indexes_pending=len(self._pendingIndexes))
+
+
+    def buildPendingIndexes(self):
+        """
+        Build all of the indexes returned by L{pendingIndexes} now.
+
+        @return: The number of indexes built.
+        """
+        built = 0
+        while self._pendingIndexes:
+            self.transact(self._buildNextIndex)
+            built += 1
+        return built
+
+
+    def _buildIndexesInBackground(self):
+        """
+        Build the pending indexes, one transaction per index, yielding
+        whenever C{indexBuildBudget} seconds have been spent since the last
+        yield.
+        """
+        while self._pendingIndexes:
+            started = time.time()
+            while self._pendingIndexes:
+                if self.connection is None:
+                    # The store was closed before we got around to it.
+                    return
+                self.transact(self._buildNextIndex)
+                if time.time() - started >= self.indexBuildBudget:
+                    break
+            yield None
+
+
+    def whenIndexesBuilt(self):
+        """
+        Return a Deferred which fires when every index pending when this Store
+        was opened has been built in the background.
+        """
+        if self._indexesComplete is not None:
+            return self._indexesComplete.whenDone()
+        else:
+            return defer.succeed(None)
+
+
+    def _compoundIndexFor(self, tableClass, compound):
+        """
+        Describe an index declared with L{attributes.compoundIndex}.
+
+        @return: A four-tuple of the column SQL, the parts of the index name,
+            the SQL of the index predicate or C{None}, and whether the index
+            is unique.
+
+        @raise ValueError: If the predicate of a partial index involves another
+            item type, or compares columns to values which cannot be written
+            as SQL literals.
+        """
+        columns = tuple(column.getShortColumnName(self) for column in compound)
+        names = tuple(column.attrname for column in compound)
+        unique = getattr(compound, 'unique', False)
+        if unique:
+            names += ('unique',)
+        where = getattr(compound, 'where', None)
+        if where is None:
+            return columns, names, None, unique
+        if where.getInvolvedTables() != [tableClass]:
+            raise ValueError(
+                "Partial index predicate %r must involve only %r" % (
+                    where, tableClass))
+        try:
+            args = where.getArgs(self)
+        except TypeError as e:
+            raise ValueError(
+                "Partial index predicate %r has an unusable value: %s" % (
+                    where, e))
+        if args:
+            raise ValueError(
+                "Partial index predicate %r may only compare attributes to "
+                "values or to each other" % (where,))
+        # Index predicates may not refer to other tables, so leave the table
+        # name off the columns.
+        predicate = where.getQuery(self).replace(
+            self.getTableName(tableClass) + '.', '')
+        digest = hashlib.sha1(predicate.encode('utf-8')).hexdigest()[:8]
+        return columns, names + ('where', digest), predicate, unique
 
 
     def getItemByID(self, storeID, default=_noItem, autoUpgrade=True):
@@ -2319,6 +4000,235 @@ class Store(Empowered):
         return default
 
 
+    def tableGeneration(self, tableClass):
+        """
+        Get a number which changes whenever items of a type are inserted,
+        changed or deleted through this L{Store}, and which goes back to its
+        previous value if those changes are reverted.  For example, it can be
+        combined with something identifying the L{Store} object to make an
+        ETag for a page listing such items.
+
+        Changes made with L{executeSQL} are not noticed.
+
+        @param tableClass: an L{Item} subclass.
+
+        @rtype: L{int}
+        """
+        return self._tableGenerations.get(tableClass, 0)
+
+
+    def _estimatedRowCount(self, tableClass):
+        """
+        Find the number of rows in C{tableClass}'s table when it was last
+        analyzed.
+
+        @return: an L{int}, or C{None} if the table has not been analyzed.
+        """
+        [(hasStatistics,)] = self.querySchemaSQL(
+            _schema.HAS_PLANNER_STATISTICS)
+        if not hasStatistics:
+            return None
+        tableName = tableClass.getTableName(self).split('.')[-1]
+        rows = self.querySchemaSQL(_schema.TABLE_ROW_ESTIMATE, [tableName])
+        if not rows:
+            return None
+        return int(rows[0][0].split()[0])
+
+
+    def _tableChanged(self, tableClass):
+        """
+        Note that the rows of C{tableClass}'s table have changed, so that
+        cached query results which involve it are no longer used, and so that
+        other connections to the database find out.
+        """
+        self._tableGenerations[tableClass] = (
+            self._tableGenerations.get(tableClass, 0) + 1)
+        if self._changeLog is not None:
+            if self.autocommit:
+                self._logChange(tableClass)
+            else:
+                self._changedThisTransaction.add(tableClass)
+
+
+    def _logChange(self, tableClass):
+        """
+        Increment the generation of C{tableClass} in the change log.
+
+        @param tableClass: an item type, or C{None} for the entry of
+            transactions which change no item tables.
+
+        @return: the type ID of C{tableClass}.
+        """
+        if tableClass is None:
+            typeID = _schema.MAINTENANCE_TYPE_ID
+        else:
+            typeID = self.getTypeID(tableClass)
+        self.executeSchemaSQL(_schema.LOG_CHANGE, [typeID, typeID])
+        return typeID
+
+
+    def _logTransactionChanges(self):
+        """
+        Record the types changed by the current transaction in the change log
+        of this store and its attached substores.
+        """
+        for tableClass in self._changedThisTransaction:
+            typeID = self._logChange(tableClass)
+            # Nobody else can have changed the log since the transaction
+            # began, so this is the only change since we last read it.
+            [(typeID, generation)] = self.querySchemaSQL(
+                _schema.TYPE_CHANGE_LOG, [typeID])
+            self._changeLog[typeID] = generation
+        for sub in self._attachedChildren.values():
+            sub._logTransactionChanges()
+
+
+    def _autocommitLogged(self, f, *a):
+        """
+        Call C{f}, which changes items and notes which item types it changed
+        with L{_tableChanged}.  If this store keeps a change log and is not in
+        a transaction, the changes are made in a savepoint, so that they are
+        committed together with their entries in the change log.
+
+        @return: the result of C{f}.
+        """
+        if not self.autocommit or self._changeLog is None:
+            return f(*a)
+        self.cursor.execute('SAVEPOINT axiom_autocommit')
+        try:
+            result = f(*a)
+        except:
+            self.cursor.execute('ROLLBACK TO axiom_autocommit')
+            self.cursor.execute('RELEASE axiom_autocommit')
+            raise
+        self.cursor.execute('RELEASE axiom_autocommit')
+        return result
+
+
+    def _logMaintenance(self, f, *a):
+        """
+        Call C{f}, which changes this store's database without changing the
+        rows of any item table, as C{ANALYZE} and tombstone collection do.  The
+        change is recorded in the change log, so that other connections do not
+        take it for an unlogged change which might have affected any item.
+
+        @return: the result of C{f}.
+        """
+        if self._changeLog is None:
+            return f(*a)
+        if not self.autocommit:
+            self._changedThisTransaction.add(None)
+            return f(*a)
+        def maintain():
+            result = f(*a)
+            self._logChange(None)
+            return result
+        return self._autocommitLogged(maintain)
+
+
+    def checkExternalChanges(self):
+        """
+        Find out whether another connection to this store's database, such as
+        one in a batch process or an I{axiomatic} command, has committed
+        changes to it since this was last called.  If it has, forget the
+        values of the attributes of the items in memory of the types which
+        were changed (they are loaded again when they are next accessed,
+        a batch of items at a time), and any cached powerups and query
+        results.  The same is done for attached substores.
+
+        This is called at the beginning of every transaction, and before
+        cached query results are used; it may also be called by applications
+        which read items outside of transactions, for example once for each
+        request they serve.
+
+        @return: a C{set} of the item types which were changed.
+        """
+        changedTypes = set()
+        for sub in self._attachedChildren.values():
+            changedTypes.update(sub.checkExternalChanges())
+        if self._changeLog is None:
+            return changedTypes
+        [(dataVersion,)] = self.querySchemaSQL(_schema.DATA_VERSION)
+        if dataVersion == self._dataVersion:
+            return changedTypes
+        firstCheck = self._dataVersion is None
+        self._dataVersion = dataVersion
+        changeLog = dict(self.querySchemaSQL(_schema.CHANGE_LOG))
+        changedTypeIDs = set(
+            typeID for typeID, generation in changeLog.items()
+            if self._changeLog.get(typeID) != generation)
+        self._changeLog = changeLog
+        if firstCheck:
+            return changedTypes
+        if not changedTypeIDs:
+            # Something was committed without being logged, such as a change
+            # made with executeSQL, or by a version of Axiom which does not
+            # keep the change log; any type might have changed.
+            changedTypeIDs = set(self.typenameAndVersionToID.values())
+        changedTypeIDs.discard(_schema.MAINTENANCE_TYPE_ID)
+        if not changedTypeIDs:
+            return changedTypes
+
+        self._powerupCache.clear()
+        self._queryCache.clear()
+        for (typename, version), typeID in list(
+                self.typenameAndVersionToID.items()):
+            if typeID not in changedTypeIDs:
+                continue
+            tableClass = _typeNameToMostRecentClass.get(typename)
+            if tableClass is None or tableClass.schemaVersion != version:
+                tableClass = _legacyTypes.get((typename, version))
+            if tableClass is not None:
+                changedTypes.add(tableClass)
+                self._tableGenerations[tableClass] = (
+                    self._tableGenerations.get(tableClass, 0) + 1)
+
+        batches = {}
+        for storeID, ref in list(self.objectCache.data.items()):
+            it = ref()
+            if it is None or type(it) not in changedTypes:
+                continue
+            batch = batches.get(type(it))
+            if batch is None or len(batch.storeIDs) >= batch.size:
+                batch = batches[type(it)] = attributes._DeferredBatch(self)
+            batch.storeIDs.append(storeID)
+            for name, attr in it.getSchema():
+                attr.loaded(it, batch)
+        return changedTypes
+
+
+    def _cachedQuerySQL(self, tables, sql, args):
+        """
+        Like L{querySQL}, but if C{queryCacheSize} is non-zero, reuse the
+        results of an earlier identical query if none of the tables it
+        involves has changed since, and keep these results for reuse.
+
+        @param tables: the tables involved in the query, as from
+            L{iaxiom.IComparison.getInvolvedTables}.
+        """
+        if not self.queryCacheSize:
+            return self.querySQL(sql, args)
+        try:
+            key = (sql, tuple(args))
+            hash(key)
+        except TypeError:
+            return self.querySQL(sql, args)
+        if self.autocommit:
+            self.checkExternalChanges()
+        generations = tuple([
+            self._tableGenerations.get(_changeTrackedType(table), 0)
+            for table in tables])
+        entry = self._queryCache.pop(key, None)
+        if entry is not None and entry[0] == generations:
+            result = entry[1]
+        else:
+            result = self.querySQL(sql, args)
+        self._queryCache[key] = (generations, result)
+        while len(self._queryCache) > self.queryCacheSize:
+            self._queryCache.popitem(last=False)
+        return result
+
+
     def querySchemaSQL(self, sql, args=()):
         sql = sql.replace("*DATABASE*", self.databaseName)
         return self.querySQL(sql, args)
@@ -2334,6 +4244,19 @@ class Store(Empowered):
         return result
 
 
+    def _queryCursor(self, sql, args=()):
+        """
+        Like L{querySQL}, but return the cursor the statement was executed
+        with, so that its rows can be fetched a batch at a time rather than
+        all at once.  No other statement may be executed with this store until
+        they have all been fetched.
+        """
+        if self.debug:
+            print('**', sql, '--', ', '.join(map(str, args)))
+            return timeinto(self.queryTimes, self.cursor.execute, sql, args)
+        return self.cursor.execute(sql, args)
+
+
     def _queryandfetch(self, sql, args):
         if self.debug:
             print('**', sql, '--', ', '.join(map(str, args)))
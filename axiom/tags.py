@@ -2,7 +2,8 @@
 from epsilon.extime import Time
 
 from axiom.item import Item
-from axiom.attributes import text, reference, integer, AND, timestamp
+from axiom.attributes import (
+    text, reference, integer, AND, timestamp, compoundIndex)
 
 class Tag(Item):
     typeName = 'tag'
@@ -47,6 +48,8 @@ class _TagName(Item):
     The L{Catalog} item in which this tag exists.
     """)
 
+    compoundIndex(catalog, name, unique=True)
+
 
 
 class Catalog(Item):
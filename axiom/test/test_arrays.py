@@ -0,0 +1,161 @@
+"""
+Tests for loading query results into arrays, with
+L{axiom.store.AttributeQuery.toArray} and
+L{axiom.store.ProjectionQuery.toArrays}.
+"""
+
+import array
+import sys
+
+from twisted.trial.unittest import TestCase
+from twisted.python.compat import NativeStringIO
+
+from epsilon.extime import Time
+
+from axiom import store as storeModule
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import ieee754_double, integer, text, timestamp
+
+
+
+class Sample(Item):
+    """
+    An item with numeric attributes.
+    """
+    typeName = 'test_arrays_sample'
+    schemaVersion = 1
+
+    count = integer()
+    weight = ieee754_double()
+    taken = timestamp()
+    label = text()
+
+
+
+class ArrayTests(TestCase):
+    """
+    Tests for loading the values of numeric columns into arrays.
+    """
+    useNumPy = False
+
+    def setUp(self):
+        self.store = Store()
+        self.store.transact(lambda: [
+            Sample(store=self.store, count=i, weight=i / 2.0,
+                   taken=Time.fromPOSIXTimestamp(i), label=u'x')
+            for i in range(25)])
+
+
+    def query(self, *a, **kw):
+        return self.store.query(Sample, *a, sort=Sample.count.ascending,
+                                **kw)
+
+
+    def assertArray(self, result, typecode, values):
+        """
+        Assert that C{result} is an array of the kind being tested, with the
+        given type and values.
+        """
+        if self.useNumPy:
+            self.assertEqual(result.dtype, storeModule.numpy.dtype(typecode))
+            self.assertEqual(result.tolist(), values)
+        else:
+            self.assertIsInstance(result, array.array)
+            self.assertEqual(result.typecode, typecode)
+            self.assertEqual(result.tolist(), values)
+
+
+    def test_toArray(self):
+        """
+        L{AttributeQuery.toArray} loads the values of an attribute into an
+        array, reading a chunk of rows at a time.
+        """
+        result = self.query(Sample.count < 10).getColumn('count').toArray(
+            useNumPy=self.useNumPy, chunkSize=3)
+        self.assertArray(result, storeModule._INT64, list(range(10)))
+
+
+    def test_stored(self):
+        """
+        The values in the array are the stored values: timestamps are integer
+        numbers of microseconds, and doubles are doubles.
+        """
+        result = self.query(Sample.count < 3).getColumn('taken').toArray(
+            useNumPy=self.useNumPy)
+        self.assertArray(result, storeModule._INT64, [0, 1000000, 2000000])
+        result = self.query(Sample.count < 3).getColumn('weight').toArray(
+            useNumPy=self.useNumPy)
+        self.assertArray(result, 'd', [0.0, 0.5, 1.0])
+
+
+    def test_toArrays(self):
+        """
+        L{ProjectionQuery.toArrays} loads the values of several columns into
+        an array each.
+        """
+        counts, storeIDs = self.query(Sample.count >= 20).values(
+            Sample.count, Sample.storeID).toArrays(
+                useNumPy=self.useNumPy, chunkSize=2)
+        self.assertArray(counts, storeModule._INT64, [20, 21, 22, 23, 24])
+        self.assertEqual(
+            storeIDs.tolist(),
+            list(self.query(Sample.count >= 20).getColumn('storeID')))
+
+
+    def test_debug(self):
+        """
+        The query is made like other queries, so that a store in debug mode
+        shows it and records how long it took.
+        """
+        output = NativeStringIO()
+        self.patch(sys, 'stdout', output)
+        self.store.debug = True
+        self.query(Sample.count < 3).getColumn('count').toArray(
+            useNumPy=self.useNumPy)
+        self.assertIn('SELECT', output.getvalue())
+        self.assertEqual(len(self.store.queryTimes), 1)
+
+
+    def test_empty(self):
+        """
+        A query with no results gives an empty array.
+        """
+        result = self.query(Sample.count < 0).getColumn('weight').toArray(
+            useNumPy=self.useNumPy)
+        self.assertArray(result, 'd', [])
+
+
+    def test_null(self):
+        """
+        C{None} values are rejected unless a default to use instead is given.
+        """
+        Sample(store=self.store, count=100)
+        query = self.query(Sample.count >= 24)
+        self.assertRaises(
+            ValueError, query.getColumn('weight').toArray,
+            useNumPy=self.useNumPy)
+        weights, counts = query.values(Sample.weight, Sample.count).toArrays(
+            default=-1, useNumPy=self.useNumPy)
+        self.assertArray(weights, 'd', [12.0, -1.0])
+        self.assertArray(counts, storeModule._INT64, [24, 100])
+
+
+    def test_notNumeric(self):
+        """
+        Attributes which are not stored as numbers cannot be loaded into
+        arrays.
+        """
+        self.assertRaises(
+            TypeError, self.query().getColumn('label').toArray)
+
+
+
+class NumPyArrayTests(ArrayTests):
+    """
+    Tests for loading the values of numeric columns into NumPy arrays.
+    """
+    useNumPy = True
+
+    if storeModule.numpy is None:
+        skip = "NumPy is not installed"
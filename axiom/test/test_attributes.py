@@ -1,6 +1,7 @@
 # -*- test-case-name: axiom.test.test_attributes -*-
 
 import random
+import operator
 import gc
 from decimal import Decimal
 from datetime import timedelta
@@ -16,7 +17,10 @@ from axiom.store import Store
 from axiom.item import Item, normalize, Placeholder
 from axiom.attributes import (
     Comparable, SQLAttribute, integer, timestamp, textlist, ConstraintError,
-    ieee754_double, point1decimal, money, text)
+    ieee754_double, point1decimal, money, text, compressedbytes,
+    compressedtext)
+from axiom import attributes
+from axiom.errors import SQLError
 from axiom.test.strategies import (
     axiomText, axiomIntegers, fixedDecimals, textlists, timestamps)
 
@@ -483,6 +487,273 @@ class SQLAttributeTestCase(TestCase):
 
 
 
+class CompressedThing(Item):
+    """
+    An item with compressed attributes.
+    """
+    typeName = 'test_compressed_thing'
+    schemaVersion = 1
+
+    data = compressedbytes(threshold=16)
+    description = compressedtext(threshold=16)
+    header = compressedbytes(threshold=16, dictionary=b'Subject: Received: ')
+
+
+
+class CompressedAttributeTests(TestCase):
+    """
+    Tests for L{compressedbytes} and L{compressedtext}.
+    """
+    def setUp(self):
+        self.store = Store()
+
+
+    def storedValue(self, thing, attribute):
+        """
+        Return the value stored in the database for an attribute of an item.
+        """
+        [[value]] = self.store.querySQL(
+            'SELECT %s FROM %s WHERE oid = ?' % (
+                attribute.getShortColumnName(self.store),
+                self.store.getTableName(CompressedThing)),
+            [thing.storeID])
+        return value
+
+
+    def roundtrip(self, **kw):
+        """
+        Store an item with the given values, and load it again.
+        """
+        storeID = CompressedThing(store=self.store, **kw).storeID
+        gc.collect()
+        return self.store.getItemByID(storeID)
+
+
+    def test_compressed(self):
+        """
+        Values longer than the threshold are compressed when stored, and
+        decompressed when loaded.
+        """
+        data = b'spam ' * 100
+        thing = self.roundtrip(data=data)
+        self.assertTrue(len(self.storedValue(thing, CompressedThing.data)) <
+                        len(data) / 10)
+        self.assertEqual(thing.data, data)
+
+
+    def test_short(self):
+        """
+        Values shorter than the threshold, and values which do not get any
+        shorter when compressed, are stored as they are.
+        """
+        incompressible = bytes(bytearray(range(64)))
+        for data in [b'spam', incompressible, b'']:
+            thing = self.roundtrip(data=data)
+            self.assertEqual(
+                bytes(self.storedValue(thing, CompressedThing.data)),
+                b'\x00' + data)
+            self.assertEqual(thing.data, data)
+
+
+    def test_none(self):
+        """
+        C{None} is stored as C{NULL}.
+        """
+        thing = self.roundtrip()
+        self.assertIdentical(self.storedValue(thing, CompressedThing.data),
+                             None)
+        self.assertIdentical(thing.data, None)
+
+
+    def test_text(self):
+        """
+        L{compressedtext} stores unicode strings, and rejects anything else.
+        """
+        description = u'\N{SNOWMAN} melts. ' * 20
+        thing = self.roundtrip(description=description)
+        self.assertEqual(thing.description, description)
+        self.assertRaises(ConstraintError, CompressedThing,
+                          store=self.store, description=b'bytes')
+
+
+    def test_dictionary(self):
+        """
+        A preset dictionary makes short values which use it compress better.
+        """
+        header = b'Subject: hello\nReceived: yesterday\n'
+        thing = self.roundtrip(data=header, header=header)
+        self.assertTrue(len(self.storedValue(thing, CompressedThing.header)) <
+                        len(self.storedValue(thing, CompressedThing.data)))
+        self.assertEqual(thing.header, header)
+
+
+    def test_equality(self):
+        """
+        Values can be compared for equality in queries.
+        """
+        data = b'eggs ' * 100
+        thing = CompressedThing(store=self.store, data=data)
+        CompressedThing(store=self.store, data=b'spam ' * 100)
+        self.assertEqual(
+            list(self.store.query(CompressedThing,
+                                  CompressedThing.data == data)),
+            [thing])
+
+
+    def test_notOrdered(self):
+        """
+        Stored values are not in the order of the values they were made from,
+        so ordering comparisons of them are rejected.
+        """
+        for op in operator.lt, operator.le, operator.gt, operator.ge:
+            self.assertRaises(TypeError, op, CompressedThing.data, b'eggs')
+            self.assertRaises(
+                TypeError, op, CompressedThing.description, u'eggs')
+
+
+    def test_doc(self):
+        """
+        Like other attributes, the first argument is the documentation of the
+        attribute, and the compression options are given by keyword.
+        """
+        attribute = compressedtext("The body of a message.", threshold=16)
+        self.assertEqual(attribute.doc, "The body of a message.")
+        self.assertEqual(attribute.threshold, 16)
+        self.assertRaises(TypeError, compressedbytes, "Doc.", 16)
+
+
+
+class Attachment(Item):
+    """
+    An item with a large value.
+    """
+    typeName = 'test_attachment'
+    schemaVersion = 1
+
+    name = text()
+    content = attributes.bytes()
+    compressed = compressedbytes()
+
+
+
+class BlobTests(TestCase):
+    """
+    Tests for L{axiom.attributes.bytes.openBlob}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.content = b''.join(
+            b'%05d' % (i,) for i in range(10000))
+        self.attachment = Attachment(store=self.store, content=self.content)
+
+
+    def test_read(self):
+        """
+        The value can be read in chunks, or into a buffer.
+        """
+        with Attachment.content.openBlob(self.attachment) as blob:
+            self.assertEqual(len(blob), len(self.content))
+            self.assertEqual(blob.read(5), b'00000')
+            blob.seek(-5, 2)
+            self.assertEqual(blob.read(), b'09999')
+            blob.seek(10)
+            buffer = bytearray(10)
+            self.assertEqual(blob.readinto(memoryview(buffer)), 10)
+            self.assertEqual(bytes(buffer), b'0000200003')
+            self.assertRaises(IOError, blob.write, b'x')
+        self.assertEqual(self.attachment.content, self.content)
+
+
+    def test_write(self):
+        """
+        An existing value can be overwritten in place, after which the item
+        has the new value.
+        """
+        self.attachment.content
+        with Attachment.content.openBlob(
+                self.attachment, writable=True) as blob:
+            blob.seek(5)
+            blob.write(memoryview(b'XXXXX'))
+        self.assertEqual(self.attachment.content[:15], b'00000XXXXX00002')
+
+
+    def test_allocate(self):
+        """
+        A value of a given size can be allocated and then written in chunks,
+        but not extended.
+        """
+        attachment = Attachment(store=self.store)
+        with Attachment.content.openBlob(attachment, length=10) as blob:
+            blob.write(b'01234')
+            blob.write(b'56789')
+            self.assertRaises(ValueError, blob.write, b'x')
+        self.assertEqual(attachment.content, b'0123456789')
+
+
+    def test_closed(self):
+        """
+        A closed blob cannot be used.
+        """
+        with Attachment.content.openBlob(self.attachment) as blob:
+            pass
+        self.assertRaises(ValueError, blob.read)
+        self.assertRaises(ValueError, blob.readinto, bytearray(5))
+        self.assertRaises(ValueError, blob.seek, 0)
+
+
+    def test_transaction(self):
+        """
+        An item created in a transaction can be written to, and the write is
+        undone if the transaction is reverted.
+        """
+        def write():
+            attachment = Attachment(store=self.store, name=u'new')
+            with Attachment.content.openBlob(attachment, length=3) as blob:
+                blob.write(b'abc')
+            self.assertEqual(attachment.content, b'abc')
+            with Attachment.content.openBlob(
+                    self.attachment, writable=True) as blob:
+                blob.write(b'abc')
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, write)
+        self.assertEqual(self.attachment.content, self.content)
+        self.assertEqual(
+            self.store.query(Attachment, Attachment.name == u'new').count(),
+            0)
+
+
+    def test_compressed(self):
+        """
+        Compressed values cannot be opened.
+        """
+        self.assertRaises(TypeError, Attachment.compressed.openBlob,
+                          self.attachment)
+
+
+
+class SQLBlobTests(BlobTests):
+    """
+    Tests for L{axiom.attributes.bytes.openBlob} with SQLite modules which do
+    not support incremental BLOB I/O, so that BLOBs are read and written with
+    SQL instead.
+    """
+    def setUp(self):
+        BlobTests.setUp(self)
+        self.store.connection.incrementalBlobs = False
+
+
+    def test_missing(self):
+        """
+        Opening the value of an item which has been deleted behind its back
+        fails.
+        """
+        self.store.executeSQL(
+            'DELETE FROM %s' % (Attachment.getTableName(self.store),))
+        self.assertRaises(
+            SQLError, Attachment.content.openBlob, self.attachment)
+
+
+
 class KitchenSink(Item):
     """
     An item with one of everything, more or less.
@@ -0,0 +1,213 @@
+"""
+Tests for noticing changes made to a store's database by other connections,
+with L{axiom.store.Store.checkExternalChanges}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, reference
+from axiom.errors import ItemNotFound
+from axiom.tombstone import collectTombstones
+from axiom.plannerstats import analyzeTable
+from axiom.test.util import countStatements
+
+
+
+class Thing(Item):
+    """
+    An item which another connection changes.
+    """
+    typeName = 'test_coherence_thing'
+    schemaVersion = 1
+
+    value = integer()
+
+
+
+class Other(Item):
+    """
+    An item of another type.
+    """
+    typeName = 'test_coherence_other'
+    schemaVersion = 1
+
+    value = integer()
+    thing = reference()
+
+
+
+class ExternalChangeTests(TestCase):
+    """
+    Tests for noticing changes committed by another L{Store} open on the same
+    database, as another process would.
+    """
+    def setUp(self):
+        dbdir = self.mktemp()
+        self.writer = Store(dbdir)
+        self.thing = Thing(store=self.writer, value=1)
+        self.other = Other(store=self.writer, value=1, thing=self.thing)
+        self.reader = Store(dbdir)
+        self.readerThing = self.reader.getItemByID(self.thing.storeID)
+        self.readerOther = self.reader.getItemByID(self.other.storeID)
+        self.assertEqual(self.readerThing.value, 1)
+        self.assertEqual(self.readerOther.value, 1)
+
+
+    def test_noChanges(self):
+        """
+        Nothing is changed if nothing has been committed by another
+        connection, including by this one.
+        """
+        self.assertEqual(self.reader.checkExternalChanges(), set())
+        self.reader.transact(setattr, self.readerThing, 'value', 2)
+        self.readerThing.value = 3
+        self.assertEqual(self.reader.checkExternalChanges(), set())
+
+
+    def test_changed(self):
+        """
+        Items of the types changed by another connection have their new
+        values, and items of other types are left alone.
+        """
+        self.thing.value = 2
+        self.assertEqual(self.reader.checkExternalChanges(), set([Thing]))
+        self.assertEqual(self.readerThing.value, 2)
+        self.assertEqual(
+            countStatements(self.reader, lambda: self.readerOther.value),
+            (1, 0))
+
+
+    def test_unlogged(self):
+        """
+        If another connection commits changes without logging which types
+        they were to, items of every type are loaded again.
+        """
+        self.writer.executeSQL(
+            'UPDATE %s SET [value] = 2' % (Thing.getTableName(self.writer),))
+        self.assertTrue(
+            set([Thing, Other]) <= self.reader.checkExternalChanges())
+        self.assertEqual(self.readerThing.value, 2)
+
+
+    def test_reference(self):
+        """
+        The references of items of a changed type can still be followed and
+        shown after the change.
+        """
+        self.other.value = 2
+        self.reader.checkExternalChanges()
+        self.assertIn(
+            'thing=reference(%d)' % (self.thing.storeID,),
+            repr(self.readerOther))
+        self.assertIdentical(self.readerOther.thing, self.readerThing)
+
+
+    def test_maintenance(self):
+        """
+        Changes made to the database by maintenance which changes no items,
+        such as tombstone collection, are not mistaken for unlogged changes to
+        items.
+        """
+        self.thing.deleteFromStore()
+        self.reader.checkExternalChanges()
+        collectTombstones(self.writer)
+        self.assertEqual(self.reader.checkExternalChanges(), set())
+        self.assertEqual(
+            countStatements(self.reader, lambda: self.readerOther.value),
+            (1, 0))
+
+
+    def test_maintenanceOutsideTransaction(self):
+        """
+        Maintenance done outside a transaction, such as gathering planner
+        statistics, is not mistaken for an unlogged change to items either.
+        """
+        analyzeTable(
+            self.writer, Thing.getTableName(self.writer).split('.')[-1], 1)
+        changed = self.reader.checkExternalChanges()
+        self.assertNotIn(Thing, changed)
+        self.assertNotIn(Other, changed)
+
+
+    def test_unchangedCheckpoint(self):
+        """
+        Checkpointing an item which has not changed outside a transaction
+        executes no statements, not even to log a change.
+        """
+        self.assertEqual(
+            countStatements(self.writer, self.thing.checkpoint), (None, 0))
+
+
+    def test_autocommitLogged(self):
+        """
+        A change made outside a transaction is committed together with its
+        entry in the change log, or not at all.
+        """
+        def fail(tableClass):
+            raise RuntimeError()
+        self.patch(self.writer, '_logChange', fail)
+        self.assertRaises(RuntimeError, setattr, self.thing, 'value', 2)
+        self.reader.checkExternalChanges()
+        self.assertEqual(self.readerThing.value, 1)
+
+
+    def test_transactionStart(self):
+        """
+        Changes are noticed when a transaction begins.
+        """
+        self.writer.transact(setattr, self.thing, 'value', 5)
+        self.assertEqual(
+            self.reader.transact(lambda: self.readerThing.value), 5)
+
+
+    def test_ownTransactions(self):
+        """
+        Changes made by a transaction of this connection are not mistaken for
+        changes made by another.
+        """
+        self.reader.transact(setattr, self.readerThing, 'value', 2)
+        self.other.value = 2
+        self.assertEqual(self.reader.checkExternalChanges(), set([Other]))
+
+
+    def test_deleted(self):
+        """
+        Accessing an attribute of an item which another connection deleted
+        raises L{ItemNotFound}.
+        """
+        self.thing.deleteFromStore()
+        self.reader.checkExternalChanges()
+        self.assertRaises(ItemNotFound, getattr, self.readerThing, 'value')
+
+
+    def test_tableGeneration(self):
+        """
+        The generations of the changed types change.
+        """
+        generation = self.reader.tableGeneration(Thing)
+        self.thing.value = 2
+        self.reader.checkExternalChanges()
+        self.assertNotEqual(self.reader.tableGeneration(Thing), generation)
+
+
+    def test_queryCache(self):
+        """
+        Cached query results are not used once another connection has
+        changed the database.
+        """
+        self.reader.queryCacheSize = 10
+        query = lambda: self.reader.query(Thing).count()
+        self.assertEqual(query(), 1)
+        Thing(store=self.writer, value=2)
+        self.assertEqual(query(), 2)
+
+
+    def test_inMemory(self):
+        """
+        In-memory stores, which no other connection can change, do not check.
+        """
+        store = Store()
+        self.assertEqual(
+            countStatements(store, store.checkExternalChanges), (set(), 0))
@@ -0,0 +1,156 @@
+"""
+Tests for deferred loading of attributes declared with C{deferred=True}, or
+deferred by L{axiom.store.Store.query}.
+"""
+
+import gc
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, text, bytes
+from axiom.errors import ItemNotFound
+from axiom.test.util import countStatements
+
+
+
+class Message(Item):
+    """
+    An item with a large attribute which is deferred.
+    """
+    typeName = 'test_deferred_message'
+    schemaVersion = 1
+
+    subject = text()
+    size = integer()
+    body = bytes(deferred=True)
+
+
+
+class DeferredAttributeTests(TestCase):
+    """
+    Tests for deferred attributes.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.storeIDs = self.store.transact(lambda: [
+            Message(store=self.store, subject=u'message %d' % (i,), size=i,
+                    body=b'body %d' % (i,)).storeID
+            for i in range(250)])
+        # Make sure the messages are loaded again by the queries.
+        gc.collect()
+
+
+    def queryCount(self, f, *a):
+        """
+        Call C{f} and return its result and the number of queries it made.
+        """
+        return countStatements(self.store, f, *a)
+
+
+    def test_notSelected(self):
+        """
+        Deferred attributes are left out of the SQL for a query.
+        """
+        query = self.store.query(Message)
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        self.assertIn('[subject]', sql)
+        self.assertNotIn('[body]', sql)
+
+
+    def test_loadedOnAccess(self):
+        """
+        A deferred attribute has its value when it is accessed.
+        """
+        message = self.store.findFirst(Message, Message.size == 7)
+        self.assertEqual(message.subject, u'message 7')
+        self.assertEqual(message.body, b'body 7')
+        self.assertEqual(self.queryCount(lambda: message.body), (b'body 7', 0))
+
+
+    def test_batched(self):
+        """
+        Accessing a deferred attribute on one result of a query loads it for
+        up to 100 results at once.
+        """
+        messages = list(self.store.query(Message, sort=Message.size.ascending))
+        bodies, queries = self.queryCount(
+            lambda: [message.body for message in messages])
+        self.assertEqual(bodies, [b'body %d' % (i,) for i in range(250)])
+        self.assertEqual(queries, 3)
+
+
+    def test_override(self):
+        """
+        A query can be told to load a deferred attribute, or to defer others.
+        """
+        messages = list(self.store.query(Message, defer=()))
+        self.assertEqual(
+            self.queryCount(lambda: [m.body for m in messages])[1], 0)
+        messages[:] = []
+        gc.collect()
+
+        [message] = list(self.store.query(
+            Message, Message.size == 3, defer=[Message.subject]))
+        self.assertEqual(self.queryCount(lambda: message.body), (b'body 3', 0))
+        self.assertEqual(self.queryCount(lambda: message.subject),
+                         (u'message 3', 1))
+
+
+    def test_cloned(self):
+        """
+        Queries derived from a query defer the same attributes.
+        """
+        query = self.store.query(Message, defer=[Message.subject])
+        clone = query.cloneQuery(limit=1)
+        self.assertIdentical(clone.defer, query.defer)
+
+
+    def test_alreadyLoaded(self):
+        """
+        Items already in memory keep the values they have.
+        """
+        message = self.store.getItemByID(self.storeIDs[0])
+        self.assertEqual(
+            self.queryCount(lambda: message.body), (b'body 0', 0))
+        [same] = list(self.store.query(Message, Message.size == 0))
+        self.assertIdentical(same, message)
+        self.assertEqual(self.queryCount(lambda: same.body), (b'body 0', 0))
+
+
+    def test_changed(self):
+        """
+        A deferred attribute can be changed before it is loaded, and reverting
+        the change restores the value in the database.
+        """
+        message = self.store.findFirst(Message, Message.size == 5)
+        message.body = b'new'
+        self.assertEqual(message.body, b'new')
+        def change():
+            message.body = b'newer'
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, change)
+        self.assertEqual(message.body, b'new')
+
+
+    def test_deleted(self):
+        """
+        Accessing a deferred attribute of an item which has been deleted from
+        the database raises L{ItemNotFound}.
+        """
+        message = self.store.findFirst(Message, Message.size == 5)
+        self.store.executeSQL(
+            'DELETE FROM %s WHERE oid = ?' % (
+                self.store.getTableName(Message),),
+            [message.storeID])
+        self.assertRaises(ItemNotFound, getattr, message, 'body')
+
+
+    def test_multipleItemQuery(self):
+        """
+        Deferring attributes is not supported for queries of several item
+        types.
+        """
+        self.assertRaises(ValueError, self.store.query, (Message, Message),
+                          defer=[Message.body])
@@ -0,0 +1,176 @@
+"""
+Tests for correlated subquery comparisons, made with
+L{axiom.attributes.exists} and L{axiom.attributes.notExists}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item, Placeholder
+from axiom.attributes import (
+    AND, OR, boolean, exists, notExists, reference, text)
+from axiom.test.util import countStatements
+
+
+
+class Folder(Item):
+    """
+    A container of messages.
+    """
+    typeName = 'test_exists_folder'
+    schemaVersion = 1
+
+    name = text()
+    parent = reference()
+
+
+
+class Message(Item):
+    """
+    An item in a folder.
+    """
+    typeName = 'test_exists_message'
+    schemaVersion = 1
+
+    folder = reference(reftype=Folder)
+    read = boolean(default=False)
+
+
+
+class Label(Item):
+    """
+    A label on a message.
+    """
+    typeName = 'test_exists_label'
+    schemaVersion = 1
+
+    message = reference(reftype=Message)
+    name = text()
+
+
+
+class ExistsTests(TestCase):
+    """
+    Tests for L{axiom.attributes.Exists}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.inbox = Folder(store=self.store, name=u'Inbox')
+        self.spam = Folder(store=self.store, name=u'Spam')
+        self.empty = Folder(store=self.store, name=u'Empty',
+                            parent=self.inbox)
+        self.messages = [
+            Message(store=self.store, folder=folder, read=read)
+            for (folder, read) in [(self.inbox, False), (self.inbox, False),
+                                   (self.inbox, True), (self.spam, True)]]
+        Label(store=self.store, message=self.messages[3], name=u'junk')
+
+
+    def folders(self, comparison):
+        """
+        Return the names of the folders which meet a comparison.
+        """
+        return list(self.store.query(
+            Folder, comparison, sort=Folder.storeID.ascending).getColumn(
+                'name'))
+
+
+    def test_exists(self):
+        """
+        L{exists} selects the items for which some items of another type meet
+        a comparison referring to them, each once, in a single statement.
+        """
+        comparison = exists(Message, AND(Message.folder == Folder.storeID,
+                                         Message.read == False))
+        self.assertIn(
+            'EXISTS (SELECT 1 FROM %s WHERE' % (
+                self.store.getTableName(Message),),
+            comparison.getQuery(self.store))
+        names, statements = countStatements(
+            self.store, self.folders, comparison)
+        self.assertEqual(names, [u'Inbox'])
+        self.assertEqual(statements, 1)
+        self.assertEqual(self.folders(exists(
+            Message, Message.folder == Folder.storeID)), [u'Inbox', u'Spam'])
+
+
+    def test_notExists(self):
+        """
+        L{notExists} selects the items for which no items of another type meet
+        a comparison referring to them.
+        """
+        self.assertEqual(
+            self.folders(notExists(Message, Message.folder == Folder.storeID)),
+            [u'Empty'])
+
+
+    def test_combined(self):
+        """
+        Subquery comparisons can be combined with others, and used to count
+        and delete items.
+        """
+        comparison = OR(Folder.name == u'Empty',
+                        exists(Message, AND(Message.folder == Folder.storeID,
+                                            Message.read == True)))
+        self.assertEqual(self.folders(comparison),
+                         [u'Inbox', u'Spam', u'Empty'])
+        self.assertEqual(
+            self.store.query(
+                Message, notExists(Label, Label.message == Message.storeID)
+                ).count(),
+            3)
+        self.store.query(
+            Message, exists(Label, Label.message == Message.storeID)
+            ).deleteFromStore()
+        self.assertEqual(
+            self.store.query(Message, Message.folder == self.spam).count(), 0)
+
+
+    def test_join(self):
+        """
+        The subquery can join several types.
+        """
+        self.assertEqual(
+            self.folders(exists(
+                (Message, Label),
+                AND(Message.folder == Folder.storeID,
+                    Label.message == Message.storeID,
+                    Label.name == u'junk'))),
+            [u'Spam'])
+
+
+    def test_placeholder(self):
+        """
+        A L{Placeholder} lets the subquery select items of the same type as
+        the enclosing query.
+        """
+        child = Placeholder(Folder)
+        self.assertEqual(
+            self.folders(exists(child, child.parent == Folder.storeID)),
+            [u'Inbox'])
+
+
+    def test_placeholders(self):
+        """
+        The L{Placeholder}s of the subquery do not share their aliases with
+        those of the enclosing query.
+        """
+        outer = Placeholder(Folder)
+        inner = Placeholder(Folder)
+        self.assertEqual(
+            list(self.store.query(
+                outer, exists(inner, inner.storeID > outer.storeID),
+                sort=outer.storeID.ascending).getColumn('name')),
+            [u'Inbox', u'Spam'])
+
+
+    def test_queryCache(self):
+        """
+        Cached results of a query with a subquery comparison are not used
+        once a table only the subquery involves changes.
+        """
+        self.store.queryCacheSize = 10
+        comparison = notExists(Message, Message.folder == Folder.storeID)
+        self.assertEqual(self.folders(comparison), [u'Empty'])
+        Message(store=self.store, folder=self.empty)
+        self.assertEqual(self.folders(comparison), [])
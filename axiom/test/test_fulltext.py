@@ -0,0 +1,177 @@
+"""
+Tests for full-text indexes declared with
+L{axiom.attributes.fullTextIndex}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import AND, fullTextIndex, integer, text
+
+
+
+class Document(Item):
+    """
+    An item with a full-text index on two of its attributes.
+    """
+    typeName = 'test_fulltext_document'
+    schemaVersion = 1
+
+    title = text()
+    body = text()
+    pages = integer()
+
+    search = fullTextIndex(title, body, tokenize='porter')
+
+
+
+def fullTextTables(store):
+    """
+    Return the names of the full-text index tables in C{store}.
+    """
+    return [name for (name,) in store.querySQL(
+        "SELECT name FROM sqlite_master "
+        "WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")]
+
+
+
+class FullTextIndexTests(TestCase):
+    """
+    Tests for L{axiom.attributes.FullTextIndex}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.lunch = Document(store=self.store, title=u'Lunch',
+                              body=u'Shall we have lunch today?', pages=1)
+        self.dinner = Document(store=self.store, title=u'Dinner',
+                               body=u'Dinner after lunching?', pages=2)
+        self.other = Document(store=self.store, title=u'Other',
+                              body=u'Nothing to eat here.', pages=3)
+
+
+    def search(self, query, *comparisons, **kw):
+        """
+        Return the documents matching a full-text query and any other
+        comparisons, in order of storeID unless told otherwise.
+        """
+        kw.setdefault('sort', Document.storeID.ascending)
+        return list(self.store.query(
+            Document, AND(Document.search.matches(query), *comparisons), **kw))
+
+
+    def test_matches(self):
+        """
+        L{FullTextIndex.matches} selects the items whose indexed attributes
+        match a query, using the tokenizer the index was declared with.
+        """
+        self.assertEqual(self.search(u'lunch'), [self.lunch, self.dinner])
+        self.assertEqual(self.search(u'lunch NOT dinner'), [self.lunch])
+        self.assertEqual(self.search(u'title:dinner'), [self.dinner])
+
+
+    def test_otherComparisons(self):
+        """
+        A full-text match can be combined with other comparisons.
+        """
+        self.assertEqual(self.search(u'lunch', Document.pages > 1),
+                         [self.dinner])
+        self.assertEqual(
+            self.store.query(Document, Document.search.matches(u'eat'))
+            .count(), 1)
+
+
+    def test_rank(self):
+        """
+        Matches can be sorted by relevance, best first.
+        """
+        Document(store=self.store, title=u'x', body=u'x ' * 20 + u'lunch')
+        best = Document(store=self.store, title=u'lunch',
+                        body=u'lunch lunch lunch')
+        results = self.search(u'lunch', sort=Document.search.rank.ascending)
+        self.assertEqual(results[0], best)
+        self.assertEqual(len(results), 4)
+
+
+    def test_update(self):
+        """
+        Changing an indexed attribute changes what it is found by.
+        """
+        self.other.body = u'A late lunch.'
+        self.assertEqual(self.search(u'late'), [self.other])
+        self.dinner.body = u'Dinner only.'
+        self.assertEqual(self.search(u'lunch'), [self.lunch, self.other])
+
+
+    def test_delete(self):
+        """
+        Deleted items are no longer found, whether they are deleted one by one
+        or with a set-based deletion.
+        """
+        self.lunch.deleteFromStore()
+        self.assertEqual(self.search(u'lunch'), [self.dinner])
+        self.store.query(Document, Document.pages == 2).deleteFromStore()
+        self.assertEqual(self.search(u'lunch'), [])
+
+
+    def test_revert(self):
+        """
+        Changes made in a transaction which is reverted are not indexed.
+        """
+        def change():
+            self.other.body = u'lunch'
+            Document(store=self.store, body=u'lunch')
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, change)
+        self.assertEqual(self.search(u'lunch'), [self.lunch, self.dinner])
+
+
+    def test_indexOnOpen(self):
+        """
+        When a store is opened, a missing full-text index is created and the
+        existing items are indexed.
+        """
+        dbdir = self.mktemp()
+        store = Store(dbdir)
+        document = Document(store=store, body=u'lunch')
+        [tableName] = fullTextTables(store)
+        store.executeSQL('DROP TABLE %s' % (tableName,))
+        for suffix in ['insert', 'update', 'delete']:
+            store.executeSQL('DROP TRIGGER %s_%s' % (tableName, suffix))
+        store.close()
+
+        store = Store(dbdir)
+        self.assertEqual(fullTextTables(store), [tableName])
+        self.assertEqual(
+            list(store.query(Document, Document.search.matches(u'lunch'))),
+            [store.getItemByID(document.storeID)])
+
+
+    def test_largeTable(self):
+        """
+        A missing full-text index on a large table is built when the store is
+        opened rather than in the background, as L{FullTextIndex.matches}
+        cannot be used without it.
+        """
+        self.patch(Store, 'backgroundIndexThreshold', 0)
+        dbdir = self.mktemp()
+        store = Store(dbdir)
+        Document(store=store, body=u'lunch')
+        [tableName] = fullTextTables(store)
+        store.executeSQL('DROP TABLE %s' % (tableName,))
+        store.executeSQL('DROP TRIGGER %s_insert' % (tableName,))
+        store.close()
+
+        store = Store(dbdir)
+        self.assertEqual(store.pendingIndexes(), [])
+        self.assertEqual(fullTextTables(store), [tableName])
+        self.assertEqual(
+            store.query(Document, Document.search.matches(u'lunch')).count(),
+            1)
+
+
+    def test_onlyText(self):
+        """
+        Only L{text} attributes can be indexed.
+        """
+        self.assertRaises(TypeError, fullTextIndex, Document.pages)
@@ -0,0 +1,175 @@
+"""
+Tests for grouped and aggregate queries, made with
+L{axiom.store.BaseQuery.groupBy} and L{axiom.store.BaseQuery.aggregate}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import AND, integer, reference, text, timestamp
+from axiom.test.util import countStatements
+
+
+
+class Folder(Item):
+    """
+    A container of messages.
+    """
+    typeName = 'test_grouping_folder'
+    schemaVersion = 1
+
+    name = text()
+
+
+
+class Message(Item):
+    """
+    An item with attributes to aggregate.
+    """
+    typeName = 'test_grouping_message'
+    schemaVersion = 1
+
+    folder = reference(reftype=Folder)
+    size = integer()
+    received = timestamp()
+
+
+
+class GroupingTests(TestCase):
+    """
+    Tests for L{axiom.store.GroupQuery}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.inbox = Folder(store=self.store, name=u'Inbox')
+        self.spam = Folder(store=self.store, name=u'Spam')
+        self.archive = Folder(store=self.store, name=u'Archive')
+        for folder, size, when in [(self.inbox, 10, 1), (self.inbox, 20, 3),
+                                   (self.inbox, None, 2), (self.spam, 5, 4),
+                                   (self.archive, 100, 0)]:
+            Message(store=self.store, folder=folder, size=size,
+                    received=Time.fromPOSIXTimestamp(when))
+
+
+    def test_groupBy(self):
+        """
+        Grouping a query gives the distinct values of the grouping columns.
+        """
+        query = self.store.query(
+            Message, sort=Message.folder.ascending).groupBy(Message.folder)
+        self.assertEqual(list(query),
+                         [(self.inbox,), (self.spam,), (self.archive,)])
+        self.assertEqual(query.count(), 3)
+
+
+    def test_aggregate(self):
+        """
+        Several aggregates of each group are computed in one statement, and
+        converted to the types of the attributes they aggregate.
+        """
+        query = self.store.query(
+            Message, Message.folder != self.archive,
+            sort=Message.folder.ascending).groupBy(Message.folder).aggregate(
+                ('count', Message.size.count),
+                ('messages', Message.storeID.count),
+                ('total', Message.size.sum),
+                ('newest', Message.received.max))
+        rows, statements = countStatements(self.store, list, query)
+        self.assertEqual(statements, 1)
+        self.assertEqual(
+            rows, [(self.inbox, 2, 3, 30, Time.fromPOSIXTimestamp(3)),
+                   (self.spam, 1, 1, 5, Time.fromPOSIXTimestamp(4))])
+        self.assertEqual(rows[0].total, 30)
+        self.assertEqual(rows[1].newest, Time.fromPOSIXTimestamp(4))
+
+
+    def test_aggregateWithoutGroups(self):
+        """
+        Aggregates of a whole query are computed together in one result.
+        """
+        [row] = self.store.query(Message).aggregate(
+            ('total', Message.size.sum), average=Message.size.average,
+            smallest=Message.size.min)
+        self.assertEqual(row, (135, 33.75, 5))
+        self.assertEqual(row.average, 33.75)
+
+
+    def test_aggregateOrder(self):
+        """
+        Aggregates given by keyword are computed in order of their names,
+        after those given as pairs.
+        """
+        [row] = self.store.query(Message).aggregate(
+            total=Message.size.sum, average=Message.size.average,
+            smallest=Message.size.min)
+        self.assertEqual(row, (33.75, 5, 135))
+        query = self.store.query(Message).groupBy(Message.folder).aggregate(
+            ('total', Message.size.sum)).aggregate(
+                smallest=Message.size.min, biggest=Message.size.max)
+        self.assertEqual(list(query)[0]._fields,
+                         ('folder', 'total', 'biggest', 'smallest'))
+
+
+    def test_having(self):
+        """
+        Groups can be filtered by their aggregates.
+        """
+        query = self.store.query(Message).groupBy(Message.folder).aggregate(
+            total=Message.size.sum)
+        self.assertEqual(
+            list(query.having(Message.size.sum > 10)
+                 .having(Message.storeID.count > 1)),
+            [(self.inbox, 30)])
+
+
+    def test_havingArguments(self):
+        """
+        The arguments of the C{HAVING} clause come after those of the
+        C{WHERE} clause.
+        """
+        query = self.store.query(
+            Message, Message.size < 50).groupBy(Message.folder).having(
+                Message.size.max > 6)
+        self.assertEqual(list(query), [(self.inbox,)])
+
+
+    def test_sortByAggregate(self):
+        """
+        A grouped query can be sorted on an aggregate.
+        """
+        query = self.store.query(Message).groupBy(Message.folder).aggregate(
+            total=Message.size.sum)
+        self.assertEqual(
+            [row.folder for row in query.cloneQuery(
+                sort=Message.size.sum.descending)],
+            [self.archive, self.inbox, self.spam])
+        self.assertEqual(
+            list(query.cloneQuery(sort=Message.size.sum.ascending, limit=1)),
+            [(self.spam, 5)])
+
+
+    def test_join(self):
+        """
+        Groups can be formed over a join.
+        """
+        query = self.store.query(
+            Message, AND(Message.folder == Folder.storeID,
+                         Folder.name != u'Spam'),
+            sort=Folder.name.ascending).groupBy(Folder.name).aggregate(
+                biggest=Message.size.max)
+        self.assertEqual(list(query), [(u'Archive', 100), (u'Inbox', 20)])
+
+
+    def test_excludedType(self):
+        """
+        Aggregates and C{HAVING} comparisons of item types not in the
+        comparison are rejected.
+        """
+        query = self.store.query(Message)
+        self.assertRaises(ValueError, query.aggregate, names=Folder.name.count)
+        self.assertRaises(
+            ValueError, query.groupBy(Message.folder).having,
+            Folder.name.count > 1)
@@ -0,0 +1,217 @@
+"""
+Tests for L{axiom.indexadvisor}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import AND, integer, text
+from axiom.indexadvisor import (
+    normalizeShape, QueryShape, QueryShapeRecorder, explainShape,
+    adviseIndexes)
+from axiom.plugins.axiom_plugins import Indexes
+from axiom.test.util import CommandStub, callWithStdoutRedirect
+
+
+
+class Advised(Item):
+    """
+    An item with one indexed attribute and two which are not.
+    """
+    typeName = 'test_indexadvisor_advised'
+    schemaVersion = 1
+
+    indexedValue = integer(indexed=True)
+    plainValue = integer()
+    name = text()
+
+
+
+class NormalizeShapeTests(TestCase):
+    """
+    Tests for L{normalizeShape}.
+    """
+    def test_parameterLists(self):
+        """
+        A list of placeholders is reduced to a single placeholder.
+        """
+        self.assertEqual(
+            normalizeShape('SELECT x FROM y WHERE z IN (?, ?, ?) AND w = ?'),
+            'SELECT x FROM y WHERE z IN (?) AND w = ?')
+
+
+
+class QueryShapeRecorderTests(TestCase):
+    """
+    Tests for L{QueryShapeRecorder}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.recorder = QueryShapeRecorder(self.store)
+        self.recorder.startService()
+        self.addCleanup(self.recorder.stopService)
+
+
+    def test_recordShapes(self):
+        """
+        Queries against the store are recorded by shape and counted.
+        """
+        for value in [1, 2, 3]:
+            list(self.store.query(Advised, Advised.plainValue == value))
+        list(self.store.query(Advised, Advised.plainValue.oneOf([1, 2])))
+        list(self.store.query(Advised, Advised.plainValue.oneOf([1, 2, 3])))
+        counts = sorted(
+            count for (count, totalTime) in self.recorder.shapes.values())
+        self.assertEqual(counts, [2, 3])
+
+
+    def test_otherStores(self):
+        """
+        Queries against other stores are not recorded.
+        """
+        other = Store()
+        list(other.query(Advised, Advised.plainValue == 1))
+        self.assertEqual(self.recorder.shapes, {})
+
+
+    def test_flush(self):
+        """
+        L{QueryShapeRecorder.flush} saves the accumulated shapes to the store,
+        adding to those saved before.
+        """
+        list(self.store.query(Advised, Advised.plainValue == 1))
+        self.recorder.flush()
+        list(self.store.query(Advised, Advised.plainValue == 2))
+        self.recorder.flush()
+        self.assertEqual(self.recorder.shapes, {})
+        [shape] = list(self.store.query(QueryShape))
+        self.assertEqual(shape.count, 2)
+        self.assertIn('WHERE', shape.sql)
+
+
+
+class AdviseIndexesTests(TestCase):
+    """
+    Tests for L{explainShape} and L{adviseIndexes}.
+    """
+    def setUp(self):
+        self.store = Store()
+        Advised(store=self.store, indexedValue=1, plainValue=1)
+
+
+    def record(self, query, count=1, totalTime=1.0):
+        """
+        Record the shape of C{query} as though it had been made C{count}
+        times.
+        """
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        QueryShape(store=self.store, sql=normalizeShape(sql), count=count,
+                   totalTime=totalTime)
+        return sql
+
+
+    def test_explainFullScan(self):
+        """
+        L{explainShape} reports the tables which are scanned in full.
+        """
+        sql = self.record(
+            self.store.query(Advised, Advised.plainValue == 1))
+        scanned, tempSort = explainShape(self.store, sql)
+        self.assertEqual(
+            scanned,
+            set([self.store.getTableName(Advised).split('.')[-1]]))
+        self.assertFalse(tempSort)
+
+
+    def test_explainIndexed(self):
+        """
+        L{explainShape} reports nothing for queries which use an index.
+        """
+        sql = self.record(
+            self.store.query(Advised, Advised.indexedValue == 1))
+        self.assertEqual(explainShape(self.store, sql), (set(), False))
+
+
+    def test_explainTemporarySort(self):
+        """
+        L{explainShape} reports when results are sorted in a temporary
+        B-tree.
+        """
+        sql = self.record(
+            self.store.query(Advised, Advised.indexedValue == 1,
+                             sort=Advised.plainValue.ascending))
+        self.assertEqual(explainShape(self.store, sql), (set(), True))
+
+
+    def test_suggestIndexed(self):
+        """
+        A full scan to compare a single attribute leads to a suggestion that
+        the attribute be indexed.
+        """
+        self.record(self.store.query(Advised, Advised.plainValue == 1), 3)
+        [suggestion] = adviseIndexes(self.store)
+        self.assertIdentical(suggestion.itemType, Advised)
+        self.assertEqual(suggestion.attributeNames, ('plainValue',))
+        self.assertEqual(suggestion.declaration(),
+                         'Advised.plainValue: indexed=True')
+        self.assertEqual(suggestion.count, 3)
+        self.assertEqual(suggestion.reasons, set(['full scan']))
+
+
+    def test_suggestCompoundIndex(self):
+        """
+        A temporary sort after a comparison leads to a suggestion of a compound
+        index on the compared attributes followed by the sorted ones.
+        """
+        self.record(self.store.query(
+            Advised, Advised.indexedValue == 1,
+            sort=Advised.plainValue.ascending))
+        [suggestion] = adviseIndexes(self.store)
+        self.assertEqual(suggestion.declaration(),
+                         'compoundIndex(Advised.indexedValue, '
+                         'Advised.plainValue)')
+        self.assertEqual(suggestion.reasons, set(['temporary sort']))
+
+
+    def test_ranking(self):
+        """
+        Suggestions are ranked by the total time spent on the queries they
+        would improve, combining queries which would benefit from the same
+        index.
+        """
+        self.record(self.store.query(Advised, Advised.name == u'x'),
+                    totalTime=3.0)
+        self.record(self.store.query(Advised, Advised.plainValue == 1),
+                    totalTime=2.0)
+        self.record(self.store.query(Advised, Advised.plainValue > 1),
+                    totalTime=2.0)
+        self.assertEqual(
+            [(suggestion.attributeNames, suggestion.totalTime)
+             for suggestion in adviseIndexes(self.store)],
+            [(('plainValue',), 4.0), (('name',), 3.0)])
+
+
+    def test_axiomaticIndexes(self):
+        """
+        I{axiomatic indexes} prints the ranked suggestions for a store.
+        """
+        self.record(self.store.query(
+            Advised, AND(Advised.name == u'x', Advised.plainValue == 1)), 5)
+        cmd = Indexes()
+        cmd.parent = CommandStub(self.store, 'indexes')
+        result, output = callWithStdoutRedirect(cmd.parseOptions, [])
+        self.assertEqual(
+            output.getvalue(),
+            '1. compoundIndex(Advised.name, Advised.plainValue) '
+            '(5 queries, 1.000s: full scan)\n')
+
+
+    def test_axiomaticIndexesNothing(self):
+        """
+        I{axiomatic indexes} says so when it has nothing to suggest.
+        """
+        cmd = Indexes()
+        cmd.parent = CommandStub(self.store, 'indexes')
+        result, output = callWithStdoutRedirect(cmd.parseOptions, [])
+        self.assertEqual(output.getvalue(), 'No index suggestions\n')
@@ -0,0 +1,295 @@
+"""
+Tests for partial and expression indexes declared with
+L{axiom.attributes.compoundIndex}.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.application.service import IService
+
+from axiom.store import Store
+from axiom.substore import SubStore
+from axiom.plugins.axiom_plugins import PrebuildIndexes
+from axiom.test.util import CommandStub, callWithStdoutRedirect
+from axiom.item import Item
+from axiom.attributes import (
+    AND, boolean, compoundIndex, integer, lower, text, timestamp)
+
+from epsilon.extime import Time
+
+
+
+class Message(Item):
+    """
+    An item with a partial index on the unread messages and an expression
+    index on the case-folded subject.
+    """
+    typeName = 'test_indexes_message'
+    schemaVersion = 1
+
+    read = boolean(default=False, allowNone=False)
+    received = timestamp()
+    subject = text()
+
+    compoundIndex(received, where=(read == False))
+    compoundIndex(lower(subject))
+
+
+
+class Other(Item):
+    """
+    An unrelated item type.
+    """
+    typeName = 'test_indexes_other'
+    schemaVersion = 1
+
+    value = integer()
+
+
+
+def indexSQL(store, itemType):
+    """
+    Return a C{dict} mapping the names of the indexes on C{itemType}'s table
+    to the SQL which created them.
+    """
+    tableName = store.getTableName(itemType).split('.')[-1]
+    return dict(store.querySQL(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = ?", [tableName]))
+
+
+
+def queryPlan(query):
+    """
+    Return the details of SQLite's plan for C{query}.
+    """
+    sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+    return [row[-1] for row in query.store.querySQL(
+        'EXPLAIN QUERY PLAN ' + sql, args)]
+
+
+
+class PartialIndexTests(TestCase):
+    """
+    Tests for indexes declared with a C{where} predicate.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.now = Time()
+        Message(store=self.store, read=True, received=self.now)
+        self.unread = Message(store=self.store, received=self.now)
+        [self.indexName] = [
+            name for name in indexSQL(self.store, Message)
+            if name.startswith(
+                self.store._indexNameOf(Message, ['received', 'where']))]
+
+
+    def test_created(self):
+        """
+        The index is created with the predicate as its C{WHERE} clause.
+        """
+        sql = indexSQL(self.store, Message)[self.indexName]
+        self.assertTrue(sql.endswith('WHERE ([read] = 0)'), sql)
+
+
+    def test_matchingQuery(self):
+        """
+        A query making the same comparison as the predicate has the value
+        written into its SQL, and can use the index.
+        """
+        query = self.store.query(
+            Message, AND(Message.read == False,
+                         Message.received < self.now))
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        self.assertIn('[read] = 0)', sql)
+        self.assertEqual(len(args), 1)
+        self.assertIn(self.indexName, ' '.join(queryPlan(query)))
+        self.assertEqual(
+            list(self.store.query(Message, Message.read == False)),
+            [self.unread])
+
+
+    def test_otherValues(self):
+        """
+        A comparison to a different value is still made with a parameter.
+        """
+        query = self.store.query(Message, Message.read == True)
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        self.assertEqual(args, [1])
+        self.assertNotIn(self.indexName, ' '.join(queryPlan(query)))
+
+
+    def test_recreatedOnOpen(self):
+        """
+        A missing partial index is created when the store is opened, like any
+        other index.
+        """
+        dbdir = self.mktemp()
+        store = Store(dbdir)
+        Message(store=store)
+        store.executeSQL('DROP INDEX %s' % (self.indexName,))
+        store.close()
+        store = Store(dbdir)
+        self.assertIn(self.indexName, indexSQL(store, Message))
+
+
+    def test_otherTypes(self):
+        """
+        A predicate which involves another item type is rejected when the table
+        is created.
+        """
+        class Misindexed(Item):
+            typeName = 'test_indexes_misindexed'
+            schemaVersion = 1
+
+            value = integer()
+            compoundIndex(value, where=(Other.value == 1))
+
+        self.assertRaises(ValueError, Misindexed, store=self.store)
+
+
+
+class ExpressionIndexTests(TestCase):
+    """
+    Tests for indexes on L{ColumnExpression}s.
+    """
+    def setUp(self):
+        self.store = Store()
+        for subject in [u'beta', u'Alpha', u'GAMMA']:
+            Message(store=self.store, subject=subject)
+
+
+    def test_created(self):
+        """
+        The index is created on the expression.
+        """
+        sql = indexSQL(self.store, Message)[
+            self.store._indexNameOf(Message, ['lower_subject'])]
+        self.assertTrue(sql.endswith('(lower([subject]))'), sql)
+
+
+    def test_sort(self):
+        """
+        Queries can be sorted on an expression, using its index.
+        """
+        query = self.store.query(
+            Message, sort=lower(Message.subject).ascending)
+        self.assertEqual([m.subject for m in query],
+                         [u'Alpha', u'beta', u'GAMMA'])
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', queryPlan(query))
+
+
+    def test_compare(self):
+        """
+        Expressions can be compared to values, using their index.
+        """
+        query = self.store.query(
+            Message, lower(Message.subject) == u'gamma')
+        self.assertEqual([m.subject for m in query], [u'GAMMA'])
+        self.assertIn(
+            self.store._indexNameOf(Message, ['lower_subject']),
+            ' '.join(queryPlan(query)))
+
+
+
+class BackgroundIndexTests(TestCase):
+    """
+    Tests for building missing indexes on large tables in the background.
+    """
+    def setUp(self):
+        self.patch(Store, 'backgroundIndexThreshold', 2)
+        self.dbdir = self.mktemp()
+        store = Store(self.dbdir)
+        for subject in [u'a', u'b', u'c']:
+            Message(store=store, subject=subject)
+        self.indexName = store._indexNameOf(Message, ['lower_subject'])
+        store.executeSQL('DROP INDEX %s' % (self.indexName,))
+        store.close()
+
+
+    def test_pending(self):
+        """
+        A missing index on a table with more than C{backgroundIndexThreshold}
+        rows is not built when the store is opened, but queries still work.
+        """
+        store = Store(self.dbdir)
+        self.assertEqual(store.pendingIndexes(), [self.indexName])
+        self.assertNotIn(self.indexName, indexSQL(store, Message))
+        self.assertEqual(
+            [m.subject for m in store.query(
+                Message, lower(Message.subject) == u'b')],
+            [u'b'])
+
+
+    def test_startupFailure(self):
+        """
+        If opening the store fails, indexes created by the store afterwards
+        are not left to be built in the background.
+        """
+        stores = []
+        def _startup(store):
+            stores.append(store)
+            raise ZeroDivisionError()
+        self.patch(Store, '_startup', _startup)
+        self.assertRaises(ZeroDivisionError, Store, self.dbdir)
+        self.assertFalse(stores[0]._backgroundIndexing)
+
+
+    def test_smallTables(self):
+        """
+        A missing index on a smaller table is built when the store is opened.
+        """
+        self.patch(Store, 'backgroundIndexThreshold', 3)
+        store = Store(self.dbdir)
+        self.assertEqual(store.pendingIndexes(), [])
+        self.assertIn(self.indexName, indexSQL(store, Message))
+
+
+    def test_builtInBackground(self):
+        """
+        Pending indexes are built once the store's service is started, after
+        which L{Store.whenIndexesBuilt} fires.
+        """
+        store = Store(self.dbdir)
+        service = IService(store)
+        service.startService()
+        self.addCleanup(service.stopService)
+        def built(ignored):
+            self.assertEqual(store.pendingIndexes(), [])
+            self.assertIn(self.indexName, indexSQL(store, Message))
+        return store.whenIndexesBuilt().addCallback(built)
+
+
+    def test_buildPendingIndexes(self):
+        """
+        L{Store.buildPendingIndexes} builds the pending indexes immediately.
+        """
+        store = Store(self.dbdir)
+        self.assertEqual(store.buildPendingIndexes(), 1)
+        self.assertEqual(store.pendingIndexes(), [])
+        self.assertIn(self.indexName, indexSQL(store, Message))
+        self.assertEqual(store.buildPendingIndexes(), 0)
+
+
+    def test_builtElsewhere(self):
+        """
+        An index which another Store object built first is skipped.
+        """
+        store = Store(self.dbdir)
+        Store(self.dbdir).buildPendingIndexes()
+        self.assertEqual(store.buildPendingIndexes(), 1)
+        self.assertIn(self.indexName, indexSQL(store, Message))
+
+
+    def test_prebuildCommand(self):
+        """
+        I{axiomatic prebuild-indexes} builds the pending indexes of a store
+        and its substores.
+        """
+        store = Store(self.dbdir)
+        SubStore.createNew(store, ['sub'])
+        cmd = PrebuildIndexes()
+        cmd.parent = CommandStub(store, 'prebuild-indexes')
+        result, output = callWithStdoutRedirect(cmd.parseOptions, [])
+        self.assertEqual(store.pendingIndexes(), [])
+        self.assertIn(self.indexName, output.getvalue())
+        self.assertEqual(output.getvalue().splitlines()[-1], 'Indexes built')
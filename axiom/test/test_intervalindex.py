@@ -0,0 +1,225 @@
+"""
+Tests for interval indexes declared with L{axiom.attributes.intervalIndex},
+and used by L{axiom.queryutil.overlapping} and L{axiom.queryutil.contains}.
+"""
+
+import random
+
+from twisted.trial.unittest import TestCase
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, intervalIndex, text, timestamp
+from axiom.queryutil import contains, overlapping
+
+
+
+class Lease(Item):
+    """
+    An item with an interval index on two of its attributes.
+    """
+    typeName = 'test_intervalindex_lease'
+    schemaVersion = 1
+
+    start = integer()
+    end = integer()
+    holder = text()
+
+    period = intervalIndex(start, end)
+
+
+
+class Appointment(Item):
+    """
+    An item with an interval index on two timestamps.
+    """
+    typeName = 'test_intervalindex_appointment'
+    schemaVersion = 1
+
+    start = timestamp()
+    end = timestamp()
+
+    period = intervalIndex(start, end)
+
+
+
+class IntervalIndexTests(TestCase):
+    """
+    Tests for L{axiom.attributes.IntervalIndex}.
+    """
+    def setUp(self):
+        self.store = Store()
+        rand = random.Random(1234)
+        def create():
+            leases = []
+            for i in range(200):
+                start = rand.randrange(1000)
+                leases.append(Lease(store=self.store, start=start,
+                                    end=start + rand.randrange(1, 50)))
+            return leases
+        self.leases = self.store.transact(create)
+
+
+    def overlapping(self, low, high):
+        """
+        Return the leases which overlap a range, in order of storeID.
+        """
+        return list(self.store.query(
+            Lease, overlapping(Lease.start, Lease.end, low, high),
+            sort=Lease.storeID.ascending))
+
+
+    def expectedOverlapping(self, low, high):
+        """
+        Compute the leases in C{self.leases} which overlap a range.
+        """
+        return [lease for lease in self.leases
+                if lease.start is not None and lease.end is not None
+                and lease.start <= high and lease.end >= low]
+
+
+    def test_overlapping(self):
+        """
+        L{overlapping} finds the items whose intervals overlap a range.
+        """
+        for low, high in [(0, 0), (10, 20), (500, 501), (990, 2000),
+                          (-10, -1)]:
+            self.assertEqual(self.overlapping(low, high),
+                             self.expectedOverlapping(low, high))
+
+
+    def test_contains(self):
+        """
+        L{contains} finds the items whose half-open intervals contain a
+        value.
+        """
+        for value in [0, 17, 500, 1048]:
+            self.assertEqual(
+                list(self.store.query(
+                    Lease, contains(Lease.start, Lease.end, value),
+                    sort=Lease.storeID.ascending)),
+                [lease for lease in self.leases
+                 if lease.start <= value < lease.end])
+
+
+    def test_indexUsed(self):
+        """
+        The items are found with the R*Tree.
+        """
+        query = self.store.query(
+            Lease, overlapping(Lease.start, Lease.end, 10, 20))
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        plan = ' '.join([row[-1] for row in self.store.querySQL(
+            'EXPLAIN QUERY PLAN ' + sql, args)])
+        self.assertIn('axiomrtree_', plan)
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+
+
+    def test_pending(self):
+        """
+        While a missing index on a large table is waiting to be built in the
+        background, the items are found without it.
+        """
+        self.patch(Store, 'backgroundIndexThreshold', 10)
+        dbdir = self.mktemp()
+        store = Store(dbdir)
+        leases = store.transact(lambda: [
+            Lease(store=store, start=start, end=start + 5)
+            for start in range(0, 100, 5)])
+        tableName = store.getIntervalTableName(Lease.period).split('.')[-1]
+        store.executeSQL('DROP TABLE %s' % (tableName,))
+        for suffix in 'insert', 'delete', 'update':
+            store.executeSQL('DROP TRIGGER %s_%s' % (tableName, suffix))
+        store.close()
+
+        store = Store(dbdir)
+        self.assertEqual(store.pendingIndexes(), [tableName])
+        expected = [lease.storeID for lease in leases
+                    if lease.start <= 12 and lease.end >= 7]
+        def overlappingIDs():
+            return list(store.query(
+                Lease, overlapping(Lease.start, Lease.end, 7, 12),
+                sort=Lease.storeID.ascending).getColumn('storeID'))
+        self.assertEqual(overlappingIDs(), expected)
+        self.assertEqual(store.buildPendingIndexes(), 1)
+        self.assertEqual(overlappingIDs(), expected)
+
+
+    def test_maintained(self):
+        """
+        The index follows items as they are changed and deleted, and leaves
+        out those with C{None} for either attribute.
+        """
+        lease = self.leases[0]
+        lease.start, lease.end = 5000, 5010
+        self.leases[1].deleteFromStore()
+        del self.leases[1]
+        self.leases[2].end = None
+        self.store.query(Lease, Lease.start > 900).deleteFromStore()
+        self.leases = [lease for lease in self.leases
+                       if lease.start is None or lease.start <= 900]
+        for low, high in [(5005, 5005), (0, 1000)]:
+            self.assertEqual(self.overlapping(low, high),
+                             self.expectedOverlapping(low, high))
+
+
+    def test_revert(self):
+        """
+        Changes to the index are reverted with the transaction which made
+        them.
+        """
+        def change():
+            self.leases[0].start, self.leases[0].end = 5000, 5010
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, change)
+        self.assertEqual(self.overlapping(5000, 5010), [])
+
+
+    def test_batchInsert(self):
+        """
+        Items created by L{Store.batchInsert} are indexed.
+        """
+        self.store.batchInsert(Lease, [Lease.start, Lease.end],
+                               [(3000, 3001), (3001, 3002)])
+        self.assertEqual(
+            [lease.start for lease in self.overlapping(3002, 3003)], [3001])
+
+
+    def test_precision(self):
+        """
+        Intervals are distinguished exactly, though the R*Tree only holds
+        approximate bounds of them.
+        """
+        base = 1600000000000000
+        first = Lease(store=self.store, start=base, end=base + 1)
+        second = Lease(store=self.store, start=base + 2, end=base + 3)
+        self.assertEqual(self.overlapping(base + 2, base + 2), [second])
+        self.assertEqual(
+            list(self.store.query(
+                Lease, contains(Lease.start, Lease.end, base))),
+            [first])
+
+
+    def test_timestamps(self):
+        """
+        Intervals of timestamps are indexed by their stored values.
+        """
+        def when(microseconds):
+            return Time.fromPOSIXTimestamp(
+                1600000000 + microseconds / 1000000.0)
+        first = Appointment(store=self.store, start=when(0), end=when(1))
+        Appointment(store=self.store, start=when(1), end=when(3))
+        self.assertEqual(
+            list(self.store.query(
+                Appointment, contains(Appointment.start, Appointment.end,
+                                      when(0)))),
+            [first])
+
+
+    def test_notNumeric(self):
+        """
+        Only numeric attributes can be indexed.
+        """
+        self.assertRaises(TypeError, intervalIndex, Lease.start, Lease.holder)
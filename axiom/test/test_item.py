@@ -656,3 +656,93 @@ class EmpowermentTests(SynchronousTestCase):
             [(TestInterface2, 20),
              (TestInterface, 0)])
         self.assertTrue(TestInterface.implementedBy(TI3))
+
+
+
+class LoadedItem(Item):
+    """
+    An item with a few attributes to load.
+    """
+    typeName = 'test_item_loaded_item'
+    schemaVersion = 1
+
+    number = integer()
+    name = text()
+    activated = inmemory()
+
+    def activate(self):
+        self.activated = True
+
+
+
+class countingInteger(integer):
+    """
+    An integer attribute which counts the values loaded into items.
+    """
+    loadedValues = []
+
+    def loaded(self, oself, dbval):
+        self.loadedValues.append(dbval)
+        integer.loaded(self, oself, dbval)
+
+
+
+class CustomLoadingItem(Item):
+    """
+    An item with an attribute which changes how items are loaded.
+    """
+    typeName = 'test_item_custom_loading_item'
+    schemaVersion = 1
+
+    number = countingInteger()
+
+
+
+class ExistingInStoreTests(SynchronousTestCase):
+    """
+    Tests for L{Item.existingInStore}.
+    """
+    def setUp(self):
+        self.store = Store()
+
+
+    def test_sameAsSlowPath(self):
+        """
+        An item loaded by the hydrator made for its type is the same as one
+        loaded by setting each of its attributes.
+        """
+        loaded = LoadedItem.existingInStore(self.store, 10, (u'three', 3))
+        self.assertIsNot(LoadedItem.__dict__['_hydrator'], None)
+        LoadedItem._hydrator = None
+        try:
+            slow = LoadedItem.existingInStore(self.store, 10, (u'three', 3))
+        finally:
+            del LoadedItem._hydrator
+        self.assertEqual(vars(loaded), vars(slow))
+        self.assertEqual((loaded.storeID, loaded.number, loaded.name),
+                         (10, 3, u'three'))
+        self.assertIdentical(loaded.store, self.store)
+        self.assertTrue(loaded.activated)
+
+
+    def test_statePerItem(self):
+        """
+        Items loaded by the same hydrator do not share mutable state.
+        """
+        first = LoadedItem.existingInStore(self.store, 10, (None, 1))
+        second = LoadedItem.existingInStore(self.store, 11, (None, 2))
+        self.assertIsNot(first.__dirty__, second.__dirty__)
+        self.assertIsNot(first._inMemoryPowerups, second._inMemoryPowerups)
+        self.assertEqual((first.number, second.number), (1, 2))
+
+
+    def test_customLoading(self):
+        """
+        Item types with attributes which change how values are loaded are
+        loaded by setting each attribute.
+        """
+        self.assertIdentical(item._hydratorFor(CustomLoadingItem), None)
+        self.addCleanup(setattr, countingInteger, 'loadedValues', [])
+        loaded = CustomLoadingItem.existingInStore(self.store, 10, (7,))
+        self.assertEqual(countingInteger.loadedValues, [7])
+        self.assertEqual(loaded.number, 7)
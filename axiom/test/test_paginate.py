@@ -7,9 +7,9 @@ This module contains tests for the L{axiom.store.ItemQuery.paginate} method.
 from twisted.trial.unittest import TestCase
 
 
-from axiom.store import Store
+from axiom.store import Store, _encodeResumeToken, _decodeResumeToken
 from axiom.item import Item
-from axiom.attributes import integer, compoundIndex
+from axiom.attributes import integer, text, bytes, compoundIndex, lower
 
 from axiom.test.util import QueryCounter
 
@@ -23,6 +23,12 @@ class MultiColumnSortHelper(Item):
     columnTwo = integer()
     compoundIndex(columnOne, columnTwo)
 
+class TextSortHelper(Item):
+    name = text()
+
+class BytesSortHelper(Item):
+    key = bytes()
+
 
 class CrossTransactionIteration(TestCase):
 
@@ -146,8 +152,6 @@ class CrossTransactionIteration(TestCase):
     def test_moreThanOneColumnSort(self):
         """
         Verify that paginate works with queries that have complex sort expressions.
-
-        Note: it doesn't.
         """
         s = Store()
 
@@ -164,8 +168,188 @@ class CrossTransactionIteration(TestCase):
                         ).paginate(pagesize=1)),
                           [x, y1, y2, y3, y4, z])
 
-    test_moreThanOneColumnSort.todo = (
-        "There's no use-case for this yet, but it would be a consistent "
-        "extension of the API.")
+    def test_mixedDirections(self):
+        """
+        Columns sorted in different directions are each paginated in their own
+        direction, with ties still broken by ascending storeID.
+        """
+        s = Store()
+        items = [MultiColumnSortHelper(store=s, columnOne=one, columnTwo=two)
+                 for (one, two) in [(1, 1), (1, 2), (2, 1), (2, 2), (2, 2),
+                                    (3, 1)]]
+        [a, b, c, d1, d2, e] = items
+        for pagesize in range(1, 8):
+            self.assertEqual(
+                list(s.query(MultiColumnSortHelper,
+                             sort=[MultiColumnSortHelper.columnOne.ascending,
+                                   MultiColumnSortHelper.columnTwo.descending]
+                             ).paginate(pagesize=pagesize)),
+                [b, a, d1, d2, c, e])
+            self.assertEqual(
+                list(s.query(MultiColumnSortHelper,
+                             sort=[MultiColumnSortHelper.columnOne.descending,
+                                   MultiColumnSortHelper.columnTwo.descending]
+                             ).paginate(pagesize=pagesize)),
+                [e, d1, d2, c, b, a])
+
+
+    def test_nulls(self):
+        """
+        Items whose sort columns are C{None} are paginated in the order SQLite
+        sorts them, first when ascending and last when descending.
+        """
+        s = Store()
+        items = [MultiColumnSortHelper(store=s, columnOne=one, columnTwo=two)
+                 for (one, two) in [(None, 1), (1, None), (1, 1), (None, None),
+                                    (2, None)]]
+        for sort in [[MultiColumnSortHelper.columnOne.ascending,
+                      MultiColumnSortHelper.columnTwo.ascending],
+                     [MultiColumnSortHelper.columnOne.descending,
+                      MultiColumnSortHelper.columnTwo.ascending],
+                     [MultiColumnSortHelper.columnOne.ascending,
+                      MultiColumnSortHelper.columnTwo.descending],
+                     [MultiColumnSortHelper.columnOne.descending,
+                      MultiColumnSortHelper.columnTwo.descending]]:
+            query = s.query(MultiColumnSortHelper, sort=sort)
+            expected = list(query.cloneQuery(
+                sort=sort + [MultiColumnSortHelper.storeID.ascending]))
+            self.assertEqual(len(expected), len(items))
+            for pagesize in range(1, 6):
+                self.assertEqual(list(query.paginate(pagesize=pagesize)),
+                                 expected)
 
 
+    def test_largeTieNotMoreWork(self):
+        """
+        Each page takes one statement, however many items share a sort value.
+        """
+        s = Store()
+        for i in range(20):
+            SingleColumnSortHelper(store=s, mainColumn=1)
+        qc = QueryCounter(s)
+        g = iter(s.query(SingleColumnSortHelper,
+                         sort=SingleColumnSortHelper.mainColumn.ascending
+                         ).paginate(pagesize=5))
+        next(g)
+        oneunit = qc.measure(lambda: [next(g) for i in range(5)])
+        for i in range(2):
+            self.assertEqual(qc.measure(lambda: [next(g) for i in range(5)]),
+                             oneunit)
+
+
+    def test_resumeToken(self):
+        """
+        A pagination can be resumed, by a new query, after the last item it
+        yielded, using the token it gives.
+        """
+        s = Store()
+        items = [MultiColumnSortHelper(store=s, columnOne=i // 3,
+                                       columnTwo=i % 2)
+                 for i in range(10)]
+        sort = [MultiColumnSortHelper.columnOne.descending,
+                MultiColumnSortHelper.columnTwo.ascending]
+        query = lambda: s.query(MultiColumnSortHelper, sort=sort)
+        expected = list(query().paginate())
+        self.assertEqual(len(expected), len(items))
+
+        pages = query().paginate(pagesize=3)
+        self.assertIdentical(pages.resumeToken(), None)
+        results = [next(pages) for i in range(4)]
+        token = pages.resumeToken()
+        self.assertIsInstance(token, str)
+        results.extend(query().paginate(pagesize=2, resumeToken=token))
+        self.assertEqual(results, expected)
+
+
+    def test_resumeTokenFromTheStart(self):
+        """
+        Resuming a pagination which had not yielded anything gives every
+        result.
+        """
+        s = Store()
+        items = [SingleColumnSortHelper(store=s, mainColumn=i)
+                 for i in range(3)]
+        pages = s.query(SingleColumnSortHelper).paginate(
+            resumeToken=None)
+        self.assertEqual(list(s.query(SingleColumnSortHelper).paginate(
+            resumeToken=pages.resumeToken())), items)
+
+
+    def test_expressionResumeToken(self):
+        """
+        Sorting on a column expression, the token holds the value of the
+        expression as stored, not one computed in Python.
+        """
+        s = Store()
+        names = [u'b', u'A', u'a', u'C', u'B']
+        for name in names:
+            TextSortHelper(store=s, name=name)
+        query = lambda: s.query(TextSortHelper,
+                                sort=lower(TextSortHelper.name).ascending)
+        pages = query().paginate(pagesize=1)
+        first = [next(pages).name for i in range(2)]
+        rest = [item.name for item in
+                query().paginate(resumeToken=pages.resumeToken())]
+        self.assertEqual(first + rest, [u'A', u'a', u'b', u'B', u'C'])
+
+
+    def test_bytesResumeToken(self):
+        """
+        Sorting on a C{bytes} column, the token holds the stored bytes, and
+        the pagination resumes after them.
+        """
+        s = Store()
+        keys = [b'\x00', b'\x00\xff', b'a', b'b\x80', b'\xff']
+        for key in reversed(keys):
+            BytesSortHelper(store=s, key=key)
+        query = lambda: s.query(BytesSortHelper,
+                                sort=BytesSortHelper.key.ascending)
+        pages = query().paginate(pagesize=2)
+        first = [next(pages).key for i in range(3)]
+        rest = [item.key for item in
+                query().paginate(resumeToken=pages.resumeToken())]
+        self.assertEqual(first + rest, keys)
+
+
+    def test_binaryValuesInResumeToken(self):
+        """
+        BLOBs may be given to L{_encodeResumeToken} as C{bytes} or as
+        C{memoryview} objects, and are decoded as values which are bound as
+        BLOBs, distinct from text.
+        """
+        token = _encodeResumeToken(
+            [b'\x00\xff', memoryview(b'ab'), u'\N{SNOWMAN}', 3])
+        blob, view, string, number = _decodeResumeToken(token, 4)
+        self.assertEqual(memoryview(blob).tobytes(), b'\x00\xff')
+        self.assertEqual(memoryview(view).tobytes(), b'ab')
+        self.assertEqual(string, u'\N{SNOWMAN}')
+        self.assertEqual(number, 3)
+        s = Store()
+        self.assertEqual(
+            s.querySQL('SELECT typeof(?), typeof(?)', [blob, string]),
+            [(u'blob', u'text')])
+
+
+    def test_invalidResumeToken(self):
+        """
+        Tokens which are not from a pagination of the same query are
+        rejected.
+        """
+        s = Store()
+        SingleColumnSortHelper(store=s, mainColumn=1)
+        pages = s.query(SingleColumnSortHelper).paginate()
+        next(pages)
+        token = pages.resumeToken()
+        query = s.query(SingleColumnSortHelper,
+                        sort=SingleColumnSortHelper.mainColumn.ascending)
+        self.assertRaises(ValueError, query.paginate, resumeToken=token)
+        self.assertRaises(ValueError, query.paginate, resumeToken=u'!')
+
+
+    def test_emptyPages(self):
+        """
+        Pages must hold at least one item.
+        """
+        s = Store()
+        self.assertRaises(
+            ValueError, s.query(SingleColumnSortHelper).paginate, pagesize=0)
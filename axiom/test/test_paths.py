@@ -0,0 +1,225 @@
+"""
+Tests for comparing and sorting on the attributes of referenced items, with
+L{axiom.attributes.reference.via}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import AND, OR, exists, integer, reference, text
+
+
+
+class Person(Item):
+    """
+    Someone who owns folders.
+    """
+    typeName = 'test_paths_person'
+    schemaVersion = 1
+
+    name = text()
+
+
+
+class Folder(Item):
+    """
+    A container of messages, which may be inside another folder.
+    """
+    typeName = 'test_paths_folder'
+    schemaVersion = 1
+
+    name = text()
+    owner = reference(reftype=Person)
+    parent = reference()
+
+
+
+class Message(Item):
+    """
+    An item in a folder.
+    """
+    typeName = 'test_paths_message'
+    schemaVersion = 1
+
+    subject = text()
+    size = integer()
+    folder = reference(reftype=Folder)
+    original = reference(reftype=Folder)
+
+
+
+class ReferencePathTests(TestCase):
+    """
+    Tests for L{axiom.item.ReferencePath}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.alice = Person(store=self.store, name=u'alice')
+        self.bob = Person(store=self.store, name=u'bob')
+        self.root = Folder(store=self.store, name=u'Root', owner=self.alice)
+        self.inbox = Folder(store=self.store, name=u'Inbox', owner=self.alice,
+                            parent=self.root)
+        self.spam = Folder(store=self.store, name=u'Spam', owner=self.bob,
+                           parent=self.inbox)
+        self.messages = [
+            Message(store=self.store, subject=u'one', size=1,
+                    folder=self.inbox, original=self.spam),
+            Message(store=self.store, subject=u'two', size=2,
+                    folder=self.spam, original=self.spam),
+            Message(store=self.store, subject=u'three', size=3,
+                    folder=self.root, original=self.inbox),
+            Message(store=self.store, subject=u'four', size=4)]
+
+
+    def query(self, comparison=None, **kw):
+        kw.setdefault('sort', Message.size.ascending)
+        return list(self.store.query(Message, comparison, **kw))
+
+
+    def test_compare(self):
+        """
+        Attributes of the items referred to can be compared, joining them to
+        the query.
+        """
+        self.assertEqual(
+            self.query(Message.folder.via(Folder).name == u'Inbox'),
+            [self.messages[0]])
+        self.assertEqual(
+            self.query(AND(Message.folder.via(Folder).name != u'Inbox',
+                           Message.size > 1)),
+            self.messages[1:3])
+
+
+    def test_severalComparisons(self):
+        """
+        Several attributes of the items at the end of a path can be compared
+        in one query, which joins them once.
+        """
+        folder = Message.folder.via(Folder)
+        self.assertEqual(
+            self.query(AND(folder.owner == self.alice, folder.name != u'Root'),
+                       sort=folder.name.ascending),
+            [self.messages[0]])
+
+
+    def test_sharedPath(self):
+        """
+        Following the same reference to the same type gives the same path.
+        """
+        self.assertIdentical(Message.folder.via(Folder),
+                             Message.folder.via())
+        self.assertIdentical(Message.folder.via(Folder).name,
+                             Message.folder.via(Folder).name)
+
+
+    def test_chained(self):
+        """
+        References of the items referred to can be followed in turn.
+        """
+        owner = Message.folder.via(Folder).owner.via(Person)
+        self.assertEqual(self.query(owner.name == u'alice'),
+                         [self.messages[0], self.messages[2]])
+        self.assertEqual(self.query(owner.name == u'bob'), [self.messages[1]])
+
+
+    def test_sameType(self):
+        """
+        Items of a type can be compared with the items of the same type they
+        refer to.
+        """
+        self.assertEqual(
+            list(self.store.query(
+                Folder, Folder.parent.via(Folder).name == u'Root')),
+            [self.inbox])
+        grandparent = Folder.parent.via(Folder).parent.via(Folder)
+        self.assertEqual(
+            list(self.store.query(
+                Folder, AND(grandparent.name == u'Root',
+                            Folder.owner == self.bob))),
+            [self.spam])
+
+
+    def test_twoPaths(self):
+        """
+        Two references to the same type can be followed in one query.
+        """
+        self.assertEqual(
+            self.query(AND(Message.folder.via(Folder).name == u'Spam',
+                           Message.original.via(Folder).name == u'Spam')),
+            [self.messages[1]])
+        self.assertEqual(
+            self.query(AND(Message.folder.via(Folder).owner == self.alice,
+                           Message.original.via(Folder).owner == self.bob)),
+            [self.messages[0]])
+
+
+    def test_otherComparisons(self):
+        """
+        C{oneOf} and C{like} comparisons of attributes of the items referred
+        to join them to the query too.
+        """
+        name = Message.folder.via(Folder).name
+        self.assertEqual(self.query(name.oneOf([u'Root', u'Spam'])),
+                         self.messages[1:3])
+        self.assertEqual(self.query(name.notOneOf([u'Root', u'Spam'])),
+                         [self.messages[0]])
+        self.assertEqual(self.query(name.like(u'%o%')),
+                         [self.messages[0], self.messages[2]])
+
+
+    def test_alternatives(self):
+        """
+        Comparisons of attributes of the items referred to can be one of
+        several alternatives, each item being found once.
+        """
+        name = Message.folder.via(Folder).name
+        self.assertEqual(self.query(OR(name == u'Archive', Message.size == 1)),
+                         [self.messages[0]])
+        self.assertEqual(self.query(OR(name == u'Spam', Message.size == 3)),
+                         self.messages[1:3])
+        self.assertEqual(
+            self.query(OR(name.notOneOf([u'Root', u'Spam']),
+                          Message.size == 2)),
+            self.messages[:2])
+
+
+    def test_subquery(self):
+        """
+        Attributes of the items referred to can be compared in a subquery,
+        which joins them itself.
+        """
+        self.assertEqual(
+            list(self.store.query(
+                Folder,
+                exists(Message,
+                       AND(Message.folder == Folder.storeID,
+                           Message.original.via(Folder).name == u'Spam')),
+                sort=Folder.storeID.ascending)),
+            [self.inbox, self.spam])
+
+
+    def test_sort(self):
+        """
+        Queries can be sorted by attributes of the items referred to, which
+        leaves out the items which refer to nothing.
+        """
+        name = Message.folder.via(Folder).name
+        self.assertEqual(self.query(sort=name.ascending),
+                         [self.messages[0], self.messages[2],
+                          self.messages[1]])
+        self.assertEqual(
+            self.query(Message.size > 1, sort=name.descending),
+            [self.messages[1], self.messages[2]])
+        self.assertEqual(
+            self.query(name != u'Root', sort=name.ascending),
+            [self.messages[0], self.messages[1]])
+
+
+    def test_noReftype(self):
+        """
+        A reference which does not declare the type it refers to cannot be
+        followed without being given it.
+        """
+        self.assertRaises(TypeError, Folder.parent.via)
+        self.assertRaises(TypeError, Message.folder.via(Folder).name.via)
@@ -0,0 +1,271 @@
+"""
+Tests for L{axiom.plannerstats}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer
+from axiom.substore import SubStore
+from axiom.iaxiom import IScheduler
+from axiom.dependency import installOn
+from axiom.plannerstats import (
+    TableStatistics, countRows, changedTables, analyzeTable,
+    PlannerStatistics)
+
+
+
+class Statistic(Item):
+    """
+    An item with an index for the planner to know about.
+    """
+    typeName = 'test_plannerstats_statistic'
+    schemaVersion = 1
+
+    value = integer(indexed=True)
+
+
+
+class Other(Item):
+    """
+    Another item with an index for the planner to know about.
+    """
+    typeName = 'test_plannerstats_other'
+    schemaVersion = 1
+
+    value = integer(indexed=True)
+
+
+
+def populate(store, itemType, count):
+    """
+    Create C{count} items of C{itemType} in C{store}.
+    """
+    store.transact(
+        lambda: [itemType(store=store, value=i % 10) for i in range(count)])
+
+
+
+def analyzedTables(store):
+    """
+    Return the names of the tables in C{store} which have planner statistics.
+    """
+    return sorted(set(
+        name for (name,) in store.querySQL('SELECT tbl FROM sqlite_stat1')))
+
+
+
+class ChangedTablesTests(TestCase):
+    """
+    Tests for L{countRows}, L{changedTables} and L{analyzeTable}.
+    """
+    def setUp(self):
+        self.store = Store()
+        populate(self.store, Statistic, 20)
+        self.tableName = self.store.getTableName(Statistic).split('.')[-1]
+
+
+    def test_smallTables(self):
+        """
+        Tables with fewer than C{minimumRows} rows are not reported.
+        """
+        self.assertEqual(changedTables(self.store, 50, 25), [])
+
+
+    def test_neverAnalyzed(self):
+        """
+        Tables which have never been analyzed are reported.
+        """
+        self.assertIn((self.tableName, 0, 20),
+                      changedTables(self.store, 10, 25))
+
+
+    def test_analyzed(self):
+        """
+        L{analyzeTable} gathers statistics for a table and records its size,
+        after which it is not reported until it grows significantly.
+        """
+        analyzeTable(self.store, self.tableName, 20)
+        self.assertEqual(analyzedTables(self.store), [self.tableName])
+        self.assertEqual(
+            self.store.findUnique(
+                TableStatistics,
+                TableStatistics.tableName == self.tableName).rowCount,
+            20)
+        self.assertNotIn(self.tableName, [
+            name for (name, before, after)
+            in changedTables(self.store, 10, 25)])
+
+        populate(self.store, Statistic, 4)
+        self.assertNotIn(self.tableName, [
+            name for (name, before, after)
+            in changedTables(self.store, 10, 25)])
+
+        populate(self.store, Statistic, 1)
+        self.assertIn((self.tableName, 20, 25),
+                      changedTables(self.store, 10, 25))
+
+
+    def test_countRows(self):
+        """
+        L{countRows} stops counting once its deadline has passed, having
+        counted at least one table, and counts the rest when called again.
+        """
+        populate(self.store, Other, 1)
+        rowCounts = {}
+        self.assertFalse(
+            countRows(self.store, rowCounts, deadline=0, clock=lambda: 1))
+        self.assertEqual(len(rowCounts), 1)
+        self.assertTrue(countRows(self.store, rowCounts))
+        self.assertEqual(rowCounts[self.tableName], 20)
+        self.assertIn((self.tableName, 0, 20),
+                      changedTables(self.store, 10, 25, rowCounts))
+
+
+    def test_largestChangeFirst(self):
+        """
+        Tables are reported in order of decreasing change in size.
+        """
+        populate(self.store, Other, 30)
+        otherName = self.store.getTableName(Other).split('.')[-1]
+        self.assertEqual(
+            [name for (name, before, after)
+             in changedTables(self.store, 20, 25)][:2],
+            [otherName, self.tableName])
+
+
+
+class FakeClock(object):
+    """
+    A clock which advances by one second for every table a store counts or
+    analyzes.
+    """
+    def __init__(self):
+        self.now = 0
+
+
+    def __call__(self):
+        return self.now
+
+
+    def charge(self, store):
+        """
+        Make each C{COUNT(*)} and C{ANALYZE} statement executed by C{store}
+        take one second, and record it in C{statements}.
+        """
+        self.statements = []
+        execute = store.cursor.execute
+        def chargingExecute(sql, args=()):
+            if sql.startswith(('SELECT COUNT(*)', 'ANALYZE')):
+                self.now += 1
+                self.statements.append(sql)
+            return execute(sql, args)
+        store.cursor.execute = chargingExecute
+
+
+
+class PlannerStatisticsTests(TestCase):
+    """
+    Tests for L{PlannerStatistics}.
+    """
+    def setUp(self):
+        self.store = Store(self.mktemp())
+        populate(self.store, Statistic, 20)
+        populate(self.store, Other, 20)
+        self.substore = SubStore.createNew(self.store, ['sub'])
+        populate(self.substore.open(), Statistic, 20)
+        self.planner = PlannerStatistics(store=self.store, minimumRows=10)
+
+
+    def test_installed(self):
+        """
+        Installing L{PlannerStatistics} schedules it to run.
+        """
+        installOn(self.planner, self.store)
+        self.assertEqual(
+            len(list(IScheduler(self.store).scheduledTimes(self.planner))), 1)
+
+
+    def test_completePass(self):
+        """
+        L{PlannerStatistics.run} analyzes the changed tables in the store and
+        its substores, then asks to be run again after C{interval} seconds.
+        """
+        nextRun = self.planner.run()
+        self.assertEqual(
+            nextRun.asPOSIXTimestamp() - self.planner.lastPass.asPOSIXTimestamp(),
+            self.planner.interval)
+        self.assertIdentical(self.planner.substoreCursor, None)
+        self.assertEqual(len(analyzedTables(self.store)), 2)
+        self.assertEqual(len(analyzedTables(self.substore.open())), 1)
+        self.assertEqual(self.planner.analyzedTables, 3)
+
+
+    def test_timeBudget(self):
+        """
+        When its time budget is used up, L{PlannerStatistics.run} stops and
+        asks to be run again right away, resuming where it left off.  The
+        time spent counting the rows of tables is part of the budget.
+        """
+        clock = self.planner._clock = FakeClock()
+        clock.charge(self.store)
+        clock.charge(self.substore.open())
+        self.planner.timeBudget = 3
+
+        # The store has five item tables to count.
+        nextRun = self.planner.run()
+        self.assertEqual(clock.now, 3)
+        self.assertEqual(len(self.planner._rowCounts), 3)
+        self.assertEqual(self.planner.analyzedTables, 0)
+        self.assertTrue(
+            nextRun.asPOSIXTimestamp() <= Time().asPOSIXTimestamp())
+
+        # Two are left to count, after which one of its two changed tables
+        # is analyzed.
+        self.planner.run()
+        self.assertEqual(clock.now, 6)
+        self.assertEqual(self.planner.analyzedTables, 1)
+        self.assertIdentical(self.planner.substoreCursor, None)
+
+        # The other is analyzed, and the substore's two tables counted.
+        self.planner.run()
+        self.assertEqual(clock.now, 9)
+        self.assertEqual(self.planner.analyzedTables, 2)
+        self.assertEqual(self.planner.substoreCursor, 0)
+        self.assertIdentical(self.planner.lastPass, None)
+
+        self.planner.run()
+        self.assertEqual(clock.now, 10)
+        self.assertEqual(self.planner.analyzedTables, 3)
+        self.assertNotIdentical(self.planner.lastPass, None)
+        self.assertEqual(len(analyzedTables(self.store)), 2)
+        self.assertEqual(len(analyzedTables(self.substore.open())), 1)
+        self.assertIdentical(self.planner.substoreCursor, None)
+
+
+    def test_unchangedNotCounted(self):
+        """
+        Tables which have not changed since they were last counted are not
+        counted again by the next pass.
+        """
+        self.planner.run()
+        clock = self.planner._clock = FakeClock()
+        clock.charge(self.store)
+        statistic = self.store.getTableName(Statistic)
+        other = self.store.getTableName(Other)
+
+        self.planner.run()
+        self.assertEqual(
+            [sql for sql in clock.statements
+             if statistic in sql or other in sql],
+            [])
+
+        populate(self.store, Statistic, 1)
+        self.planner.run()
+        self.assertEqual(
+            [sql for sql in clock.statements
+             if statistic in sql or other in sql],
+            ['SELECT COUNT(*) FROM ' + statistic])
@@ -1,11 +1,13 @@
 
 from twisted.trial import unittest
 from twisted.python.components import registerAdapter
+from twisted.python.reflect import qual
 
-from axiom.item import Item, empowerment
+from axiom.item import Item, empowerment, _PowerupConnector
 from axiom.store import Store
 from axiom.iaxiom import IPowerupIndirector
-from axiom.attributes import integer, inmemory, reference
+from axiom.test.util import countStatements
+from axiom.attributes import AND, integer, inmemory, reference
 
 from zope.interface import Interface, implementer, Attribute
 
@@ -350,3 +352,138 @@ class InMemoryPowerupTests(unittest.TestCase):
         """
         item = ItemWithAdapter()
         self.assertEqual(ISumProducer(item), 42)
+
+
+
+class PowerupCacheTests(unittest.TestCase):
+    """
+    Tests for the caching of powerup lookups by L{Item.powerupsFor}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.first = SumContributor(store=self.store, value=1)
+        self.second = SumContributor(store=self.store, value=2)
+        self.store.powerUp(self.first, IValueHaver)
+
+
+    def powerupsFor(self):
+        """
+        Look up the powerups for L{IValueHaver} on the store, returning them
+        and the number of queries the lookup made.
+        """
+        return countStatements(
+            self.store, lambda: list(self.store.powerupsFor(IValueHaver)))
+
+
+    def test_cached(self):
+        """
+        Once the powerups for an interface have been found, finding them again
+        makes no queries.
+        """
+        self.assertEqual(self.powerupsFor()[0], [self.first])
+        self.assertEqual(self.powerupsFor(), ([self.first], 0))
+        self.assertIdentical(IValueHaver(self.store), self.first)
+
+
+    def test_powerUp(self):
+        """
+        Installing a powerup, or changing its priority, is reflected in the
+        next lookup.
+        """
+        self.powerupsFor()
+        self.store.powerUp(self.second, IValueHaver, 1)
+        self.assertEqual(self.powerupsFor()[0], [self.second, self.first])
+        self.store.powerUp(self.second, IValueHaver, -1)
+        self.assertEqual(self.powerupsFor()[0], [self.first, self.second])
+
+
+    def test_powerDown(self):
+        """
+        Removing a powerup is reflected in the next lookup.
+        """
+        self.powerupsFor()
+        self.store.powerDown(self.first, IValueHaver)
+        self.assertEqual(self.powerupsFor()[0], [])
+
+
+    def test_deleteConnectors(self):
+        """
+        Deleting the connectors for powerups with a set-based deletion is
+        reflected in the next lookup.
+        """
+        self.powerupsFor()
+        self.store.query(_PowerupConnector).deleteFromStore()
+        self.assertEqual(self.powerupsFor()[0], [])
+
+
+    def test_batchInsert(self):
+        """
+        Connectors created with L{Store.batchInsert} are reflected in the next
+        lookup.
+        """
+        self.powerupsFor()
+        self.store.batchInsert(
+            _PowerupConnector,
+            [_PowerupConnector.item, _PowerupConnector.interface,
+             _PowerupConnector.powerup, _PowerupConnector.priority],
+            [(self.store, qual(IValueHaver), self.second, 1)])
+        self.assertEqual(self.powerupsFor()[0], [self.second, self.first])
+
+
+    def test_connectorOutsideTransaction(self):
+        """
+        Connectors created or changed directly outside a transaction are
+        reflected in the next lookup.
+        """
+        self.powerupsFor()
+        connector = _PowerupConnector(
+            store=self.store, item=self.store, interface=qual(IValueHaver),
+            powerup=self.second, priority=1)
+        self.assertEqual(self.powerupsFor()[0], [self.second, self.first])
+        connector.priority = -1
+        self.assertEqual(self.powerupsFor()[0], [self.first, self.second])
+
+
+    def test_deletePowerup(self):
+        """
+        A powerup which is deleted is no longer found, and its connector is
+        deleted once the deletion is committed.
+        """
+        self.powerupsFor()
+        def deletePowerup():
+            self.first.deleteFromStore()
+            self.assertEqual(self.powerupsFor()[0], [])
+        self.store.transact(deletePowerup)
+        self.assertEqual(self.powerupsFor()[0], [])
+        self.assertEqual(self.store.query(_PowerupConnector).count(), 0)
+
+
+    def test_revert(self):
+        """
+        Powerups installed by a transaction which is reverted are not found
+        afterwards, even if they were found during the transaction.
+        """
+        def powerUp():
+            self.store.powerUp(self.second, IValueHaver, 1)
+            self.assertEqual(self.powerupsFor()[0], [self.second, self.first])
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, powerUp)
+        self.assertEqual(self.powerupsFor()[0], [self.first])
+
+
+    def test_coveringIndex(self):
+        """
+        The query made to find the powerups for an interface is answered from
+        an index alone.
+        """
+        query = self.store.query(
+            _PowerupConnector,
+            AND(_PowerupConnector.interface == u'x',
+                _PowerupConnector.item == self.store),
+            sort=(_PowerupConnector.priority.descending +
+                  _PowerupConnector.storeID.ascending))
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        plan = ' '.join(
+            row[-1] for row in self.store.querySQL(
+                'EXPLAIN QUERY PLAN ' + sql, args))
+        self.assertIn('COVERING INDEX', plan)
@@ -0,0 +1,189 @@
+"""
+Tests for projection queries, made with L{axiom.store.BaseQuery.values}.
+"""
+
+import gc
+
+from twisted.trial.unittest import TestCase
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import AND, integer, reference, text, timestamp, lower
+from axiom.test.util import countStatements
+
+
+
+class Folder(Item):
+    """
+    A container of messages.
+    """
+    typeName = 'test_projection_folder'
+    schemaVersion = 1
+
+    name = text()
+
+
+
+class Person(Item):
+    """
+    An item with an attribute of the same name as one of L{Folder}'s.
+    """
+    typeName = 'test_projection_person'
+    schemaVersion = 1
+
+    name = text()
+
+
+
+class Message(Item):
+    """
+    An item with a few attributes to project.
+    """
+    typeName = 'test_projection_message'
+    schemaVersion = 1
+
+    subject = text()
+    size = integer()
+    received = timestamp()
+    folder = reference(reftype=Folder)
+
+
+
+class ProjectionTests(TestCase):
+    """
+    Tests for L{axiom.store.ProjectionQuery}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.inbox = Folder(store=self.store, name=u'Inbox')
+        self.spam = Folder(store=self.store, name=u'Spam')
+        self.received = Time.fromPOSIXTimestamp(1000)
+        for i, folder in enumerate([self.inbox, self.spam, self.inbox]):
+            Message(store=self.store, subject=u'Message %d' % (i,), size=i,
+                    received=self.received, folder=folder)
+        gc.collect()
+
+
+    def test_values(self):
+        """
+        The rows are tuples of the values of the columns, converted as the
+        attributes would convert them.
+        """
+        rows = list(self.store.query(
+            Message, Message.size < 2, sort=Message.size.ascending).values(
+                Message.subject, Message.received, Message.folder))
+        self.assertEqual(rows, [
+            (u'Message 0', self.received, self.inbox),
+            (u'Message 1', self.received, self.spam)])
+        self.assertEqual(type(rows[0]), tuple)
+
+
+    def test_noItemsLoaded(self):
+        """
+        Projecting attributes which are not references loads no Items, and
+        takes a single statement.
+        """
+        before = len(self.store.objectCache.data)
+        rows, statements = countStatements(
+            self.store, list, self.store.query(Message).values(
+                Message.storeID, Message.size))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(statements, 1)
+        self.assertEqual(len(self.store.objectCache.data), before)
+
+
+    def test_raw(self):
+        """
+        With C{raw=True}, the values are given as they are stored.
+        """
+        [row] = self.store.query(Message, Message.size == 1).values(
+            Message.received, Message.folder, raw=True)
+        self.assertEqual(
+            row, (self.received.asPOSIXTimestamp() * 1000000,
+                  self.spam.storeID))
+
+
+    def test_named(self):
+        """
+        With C{named=True}, the rows are named tuples.
+        """
+        [row] = self.store.query(Message, Message.size == 2).values(
+            Message.subject, Message.size, named=True)
+        self.assertEqual((row.subject, row.size), (u'Message 2', 2))
+        self.assertEqual(row, (u'Message 2', 2))
+
+
+    def test_namedDuplicates(self):
+        """
+        Fields of named rows for attributes of different item types with the
+        same name are qualified with the names of the types.
+        """
+        Person(store=self.store, name=u'alice')
+        [row] = self.store.query(
+            (Folder, Person), AND(Folder.name == u'Inbox',
+                                  Person.name == u'alice')).values(
+                Folder.name, Person.name, named=True)
+        self.assertEqual((row.Folder_name, row.Person_name),
+                         (u'Inbox', u'alice'))
+
+
+    def test_join(self):
+        """
+        Columns of other item types in the comparison can be projected.
+        """
+        query = self.store.query(
+            Message, AND(Message.folder == Folder.storeID,
+                         Folder.name == u'Inbox'),
+            sort=Message.size.descending)
+        self.assertEqual(
+            list(query.values(Message.size, Folder.name)),
+            [(2, u'Inbox'), (0, u'Inbox')])
+        query = self.store.query(
+            (Message, Folder), Message.folder == Folder.storeID,
+            sort=Message.size.ascending)
+        self.assertEqual(
+            list(query.values(Folder.name)),
+            [(u'Inbox',), (u'Spam',), (u'Inbox',)])
+
+
+    def test_excludedType(self):
+        """
+        Columns of item types not in the comparison cannot be projected.
+        """
+        self.assertRaises(
+            ValueError, self.store.query(Message).values, Folder.name)
+        self.assertRaises(ValueError, self.store.query(Message).values)
+
+
+    def test_expression(self):
+        """
+        Column expressions can be projected.
+        """
+        self.assertEqual(
+            list(self.store.query(Folder, sort=Folder.name.ascending).values(
+                lower(Folder.name))),
+            [(u'inbox',), (u'spam',)])
+
+
+    def test_countAndDistinct(self):
+        """
+        Projection queries can be counted, and made distinct.
+        """
+        query = self.store.query(
+            Message, Message.folder == Folder.storeID).values(Folder.name)
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.distinct().count(), 2)
+        self.assertEqual(sorted(query.distinct()), [(u'Inbox',), (u'Spam',)])
+
+
+    def test_cloneQuery(self):
+        """
+        Cloned projection queries project the same columns.
+        """
+        query = self.store.query(
+            Message, sort=Message.size.ascending).values(
+                Message.size, named=True)
+        self.assertEqual(list(query.cloneQuery(limit=1)), [(0,)])
+        self.assertEqual(list(query.cloneQuery(limit=1))[0].size, 0)
@@ -9,7 +9,9 @@ from axiom.item import Item, Placeholder
 
 from axiom import errors
 from axiom.attributes import (
-    reference, text, bytes, integer, AND, OR, TableOrderComparisonWrapper)
+    reference, text, bytes, integer, AND, OR, TableOrderComparisonWrapper,
+    SequenceComparison)
+from axiom._pysqlite2 import HAS_JSON
 from six.moves import map
 
 class A(Item):
@@ -1188,6 +1190,79 @@ class SetMembershipQuery(QueryingTestCase):
                           [cx, cz])
 
 
+    def test_oneOfLargeSequenceQueryGeneration(self):
+        """
+        Comparing an attribute for containment against more values than
+        L{SequenceComparison.largeSequenceThreshold} passes them as a single
+        JSON array.
+        """
+        self.patch(SequenceComparison, 'largeSequenceThreshold', 2)
+        comparison = C.name.oneOf([u'a', u'b', u'\N{SNOWMAN}'])
+        self.assertEqual(
+            comparison.getQuery(self.store),
+            '{} IN (SELECT value FROM json_each(?))'.format(
+                C.name.getColumnName(self.store)))
+        self.assertEqual(
+            comparison.getArgs(self.store),
+            [u'["a", "b", "\N{SNOWMAN}"]'])
+        self.assertEqual(
+            list(self.store.query(C, comparison)), [])
+    if not HAS_JSON:
+        test_oneOfLargeSequenceQueryGeneration.skip = (
+            "SQLite has no JSON functions")
+
+
+    def test_oneOfLargeBytesSequence(self):
+        """
+        Byte strings, which have no JSON form, are passed one parameter each
+        however many there are.
+        """
+        self.patch(SequenceComparison, 'largeSequenceThreshold', 2)
+        comparison = D.id.oneOf([b'1', b'3', b'4'])
+        self.assertEqual(
+            comparison.getQuery(self.store),
+            '{} IN (?, ?, ?)'.format(D.id.getColumnName(self.store)))
+        self.assertEqual(
+            list(self.store.query(D, comparison, sort=D.id.ascending)),
+            [self.d1, self.d3])
+
+
+    def test_oneOfLargeSequence(self):
+        """
+        An attribute can be compared for containment against more values than
+        SQLite accepts parameters.
+        """
+        items = self.store.transact(
+            lambda: [C(store=self.store, name=u'%d' % (i,))
+                     for i in range(10)])
+        names = [u'%d' % (i,) for i in range(0, 80000, 2)]
+        self.assertEqual(
+            list(self.store.query(C, C.name.oneOf(names),
+                                  sort=C.storeID.ascending)),
+            items[::2])
+        self.assertEqual(
+            list(self.store.query(C, C.name.notOneOf(names),
+                                  sort=C.storeID.ascending)),
+            items[1::2])
+
+
+    def test_deleteManyCachedItems(self):
+        """
+        Deleting more items than L{SequenceComparison.largeSequenceThreshold}
+        with a query, while they are in memory, removes each of them from the
+        object cache.
+        """
+        threshold = SequenceComparison.largeSequenceThreshold
+        items = self.store.transact(
+            lambda: [C(store=self.store, name=u'%d' % (i,))
+                     for i in range(threshold + 10)])
+        self.store.query(C).deleteFromStore()
+        self.assertEqual(self.store.query(C).count(), 0)
+        for item in items:
+            self.assertRaises(
+                KeyError, self.store.objectCache.get, item.storeID)
+
+
 class WildcardQueries(QueryingTestCase):
     def testNoConditions(self):
         self.assertRaises(TypeError, D.one.like)
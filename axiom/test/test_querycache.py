@@ -0,0 +1,262 @@
+"""
+Tests for the query result cache of L{axiom.store.Store}, and the table
+generations which invalidate it.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, text
+from axiom.plannerstats import analyzeTable
+from axiom.test.util import countStatements
+
+
+
+class Thing(Item):
+    """
+    An item to query for.
+    """
+    typeName = 'test_querycache_thing'
+    schemaVersion = 1
+
+    value = integer()
+    name = text()
+
+
+
+class Other(Item):
+    """
+    An item of another type.
+    """
+    typeName = 'test_querycache_other'
+    schemaVersion = 1
+
+    value = integer()
+
+
+
+class TableGenerationTests(TestCase):
+    """
+    Tests for L{Store.tableGeneration}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.thing = Thing(store=self.store, value=1)
+
+
+    def assertChanges(self, f, *a, **kw):
+        """
+        Assert that calling C{f} changes the generation of L{Thing}, and not
+        that of L{Other}.
+        """
+        thingGeneration = self.store.tableGeneration(Thing)
+        otherGeneration = self.store.tableGeneration(Other)
+        f(*a, **kw)
+        self.assertNotEqual(self.store.tableGeneration(Thing), thingGeneration)
+        self.assertEqual(self.store.tableGeneration(Other), otherGeneration)
+
+
+    def test_insert(self):
+        """
+        Creating an item changes the generation of its type.
+        """
+        self.assertChanges(Thing, store=self.store)
+
+
+    def test_update(self):
+        """
+        Changing an item changes the generation of its type.
+        """
+        self.assertChanges(setattr, self.thing, 'value', 2)
+
+
+    def test_delete(self):
+        """
+        Deleting an item, or a set of them, changes the generation of their
+        type.
+        """
+        self.assertChanges(self.thing.deleteFromStore)
+        Thing(store=self.store, value=3)
+        self.assertChanges(self.store.query(Thing).deleteFromStore)
+
+
+    def test_batchInsert(self):
+        """
+        L{Store.batchInsert} changes the generation of the type inserted.
+        """
+        self.assertChanges(
+            self.store.batchInsert, Thing, [Thing.value], [(4,), (5,)])
+
+
+    def test_revert(self):
+        """
+        Reverting a transaction puts the generations back.
+        """
+        generation = self.store.tableGeneration(Thing)
+        def change():
+            self.thing.value = 5
+            self.store.checkpoint()
+            self.assertNotEqual(
+                self.store.tableGeneration(Thing), generation)
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, change)
+        self.assertEqual(self.store.tableGeneration(Thing), generation)
+
+
+
+class QueryCacheTests(TestCase):
+    """
+    Tests for caching the results of queries, enabled by
+    C{Store.queryCacheSize}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.store.queryCacheSize = 10
+        self.things = [Thing(store=self.store, value=i) for i in range(3)]
+
+
+    def statementsFor(self, f, *a):
+        """
+        Return the number of statements C{f} makes.
+        """
+        return countStatements(self.store, f, *a)[1]
+
+
+    def test_cached(self):
+        """
+        Making the same query twice runs it only once, while the tables it
+        involves are unchanged.
+        """
+        query = lambda: list(self.store.query(Thing, Thing.value > 0))
+        self.assertEqual(self.statementsFor(query), 1)
+        self.assertEqual(self.statementsFor(query), 0)
+        self.assertEqual(query(), self.things[1:])
+        Other(store=self.store, value=1)
+        self.assertEqual(self.statementsFor(query), 0)
+
+
+    def test_counts(self):
+        """
+        Counts are cached too.
+        """
+        count = lambda: self.store.query(Thing, Thing.value > 0).count()
+        self.assertEqual(count(), 2)
+        self.assertEqual(self.statementsFor(count), 0)
+        self.things[0].value = 10
+        self.assertEqual(count(), 3)
+
+
+    def test_disabled(self):
+        """
+        Nothing is cached unless C{queryCacheSize} is set.
+        """
+        self.store.queryCacheSize = 0
+        query = lambda: list(self.store.query(Thing))
+        query()
+        self.assertEqual(self.statementsFor(query), 1)
+
+
+    def test_invalidated(self):
+        """
+        Changes to a table involved in a query, including those made in the
+        current transaction but not yet written, make it run again.
+        """
+        query = lambda: list(self.store.query(Thing, Thing.value >= 2))
+        self.assertEqual(query(), [self.things[2]])
+        def change():
+            self.things[0].value = 2
+            self.assertEqual(query(), self.things[::2])
+        self.store.transact(change)
+        self.store.query(Thing, Thing.value == 2).deleteFromStore()
+        self.assertEqual(query(), [])
+
+
+    def test_joins(self):
+        """
+        A change to any of the tables a query involves makes it run again.
+        """
+        other = Other(store=self.store, value=1)
+        query = lambda: list(
+            self.store.query(Thing, Thing.value == Other.value))
+        self.assertEqual(query(), [self.things[1]])
+        other.value = 2
+        self.assertEqual(query(), [self.things[2]])
+
+
+    def test_subquery(self):
+        """
+        A change to a table only a subquery of the comparison involves makes
+        the query run again.
+        """
+        query = lambda: list(self.store.query(
+            Thing, Thing.value.oneOf(self.store.query(Other).getColumn(
+                'value'))))
+        self.assertEqual(query(), [])
+        Other(store=self.store, value=2)
+        self.assertEqual(query(), [self.things[2]])
+
+
+    def test_revert(self):
+        """
+        Results cached in a transaction which is reverted are not used
+        afterwards, even if a later change brings the table back to the same
+        generation.
+        """
+        query = lambda: list(self.store.query(Thing, Thing.value == 7))
+        def change():
+            self.things[0].value = 7
+            self.assertEqual(query(), [self.things[0]])
+            raise RuntimeError()
+        self.assertRaises(RuntimeError, self.store.transact, change)
+        self.things[1].value = 8
+        self.assertEqual(query(), [])
+
+
+    def test_size(self):
+        """
+        No more than C{queryCacheSize} results are kept, discarding the least
+        recently used first.
+        """
+        self.store.queryCacheSize = 2
+        queries = [lambda i=i: list(self.store.query(Thing, Thing.value == i))
+                   for i in range(3)]
+        queries[0]()
+        queries[1]()
+        queries[0]()
+        queries[2]()
+        self.assertEqual(self.statementsFor(queries[0]), 0)
+        self.assertEqual(self.statementsFor(queries[1]), 1)
+
+
+
+class ApproximateCountTests(TestCase):
+    """
+    Tests for C{ItemQuery.count(approximate=True)}.
+    """
+    def setUp(self):
+        self.store = Store()
+        for i in range(5):
+            Thing(store=self.store, value=i)
+
+
+    def test_notAnalyzed(self):
+        """
+        Items are counted if the table has not been analyzed.
+        """
+        self.assertEqual(self.store.query(Thing).count(approximate=True), 5)
+
+
+    def test_analyzed(self):
+        """
+        The number of rows the table had when it was last analyzed is given,
+        without counting.
+        """
+        tableName = self.store.getTableName(Thing).split('.')[-1]
+        analyzeTable(self.store, tableName, 5)
+        Thing(store=self.store, value=5)
+        self.assertEqual(self.store.query(Thing).count(approximate=True), 5)
+        self.assertEqual(self.store.query(Thing).count(), 6)
+        self.assertEqual(
+            self.store.query(Thing, Thing.value > 2).count(approximate=True),
+            3)
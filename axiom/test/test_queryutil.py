@@ -5,8 +5,9 @@ from twisted.trial.unittest import TestCase
 
 from axiom.store import Store
 from axiom.item import Item
-from axiom.attributes import integer
+from axiom.attributes import integer, compoundIndex
 
+from axiom import queryutil
 from axiom.queryutil import overlapping, AttributeTuple
 
 class Segment(Item):
@@ -27,6 +28,14 @@ class ABC(Item):
     b = integer(allowNone=False)
     c = integer(allowNone=False)
 
+class Indexed(Item):
+    typeName = 'test_tuple_indexed'
+    schemaVersion = 1
+
+    a = integer()
+    b = integer()
+    compoundIndex(a, b)
+
 class TestQueryUtilities(TestCase):
 
     def testBetweenQuery(self):
@@ -144,3 +153,76 @@ class TestQueryUtilities(TestCase):
                 L[:L.index(comparee) + 1],
                 [(o.a, o.b, o.c) for o in qobj])
 
+    def testTupleQueryWithTuplesExpanded(self):
+        """
+        Where SQLite does not support row values, tuples are compared one
+        attribute at a time, with the same results.
+        """
+        self.patch(queryutil, '_rowValuesSupported', False)
+        s = Store()
+        s.transact(self._dotestTupleQueryWithTuples, s)
+
+
+
+class RowValueTests(TestCase):
+    """
+    Tests for comparing L{AttributeTuple}s as row values.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.items = [Indexed(store=self.store, a=a, b=b)
+                      for a in range(5) for b in range(5)]
+
+
+    def test_indexUsed(self):
+        """
+        Inequalities are made with a single row value comparison, which SQLite
+        answers by searching a matching index.
+        """
+        query = self.store.query(
+            Indexed, AttributeTuple(Indexed.a, Indexed.b) > (3, 2),
+            sort=[Indexed.a.ascending, Indexed.b.ascending])
+        self.assertEqual([(i.a, i.b) for i in query],
+                         [(3, 3), (3, 4), (4, 0), (4, 1), (4, 2), (4, 3),
+                          (4, 4)])
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        self.assertIn(') > (?, ?)', sql)
+        self.assertEqual(args, [3, 2])
+        plan = ' '.join([row[-1] for row in self.store.querySQL(
+            'EXPLAIN QUERY PLAN ' + sql, args)])
+        self.assertIn('SEARCH', plan)
+        self.assertIn('INDEX', plan)
+
+
+    def test_attributes(self):
+        """
+        Tuples of attributes can be compared with each other.
+        """
+        self.assertEqual(
+            self.store.query(
+                Indexed,
+                AttributeTuple(Indexed.a, Indexed.b) <=
+                AttributeTuple(Indexed.b, Indexed.a)).count(),
+            15)
+
+
+    def test_none(self):
+        """
+        Comparing a tuple for equality with values including C{None} compares
+        those attributes with C{NULL}.
+        """
+        item = Indexed(store=self.store, a=None, b=2)
+        self.assertEqual(
+            list(self.store.query(
+                Indexed, AttributeTuple(Indexed.a, Indexed.b) == (None, 2))),
+            [item])
+        self.assertRaises(
+            TypeError, lambda: AttributeTuple(Indexed.a, Indexed.b) > (None, 2))
+
+
+    def test_lengthMismatch(self):
+        """
+        Tuples can only be compared with tuples of the same length.
+        """
+        self.assertRaises(
+            ValueError, lambda: AttributeTuple(Indexed.a, Indexed.b) > (1,))
@@ -33,6 +33,28 @@ class DependentReferent(Item):
 class DisallowReferent(Item):
     ref = reference(whenDeleted=reference.DISALLOW, reftype=Referee)
 
+class SecondOrderReferent(Item):
+    ref = reference(whenDeleted=reference.CASCADE, reftype=DependentReferent)
+
+class SecondOrderDisallowReferent(Item):
+    ref = reference(whenDeleted=reference.DISALLOW, reftype=DependentReferent)
+
+class NullifyReferent(Item):
+    ref = reference(whenDeleted=reference.NULLIFY, reftype=Referee)
+
+class RecursiveReferent(Item):
+    parent = reference(whenDeleted=reference.CASCADE)
+
+class NotifyingReferent(Item):
+    ref = reference(whenDeleted=reference.CASCADE, reftype=Referee)
+    deletions = []
+
+    def deleted(self):
+        self.deletions.append(self.storeID)
+
+class UntypedCascadeReferent(Item):
+    ref = reference(whenDeleted=reference.CASCADE)
+
 class BadReferenceTestCase(TestCase):
     ntimes = 10
 
@@ -161,6 +183,179 @@ class BadReferenceTestCase(TestCase):
         self.assertRaises(KeyError, store.getItemByID, sid)
 
 
+    def test_batchReferenceDeletionChained(self):
+        """
+        L{ItemQuery.deleteFromStore} follows C{whenDeleted=CASCADE} references
+        through more than one type, removing cached instances of the deleted
+        items from the object cache.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        dep = DependentReferent(store=store, ref=referee)
+        second = SecondOrderReferent(store=store, ref=dep)
+        store.query(Referee).deleteFromStore()
+        self.assertRaises(KeyError, store.getItemByID, dep.storeID)
+        self.assertRaises(KeyError, store.getItemByID, second.storeID)
+        self.assertEqual(list(store.query(DependentReferent)), [])
+        self.assertEqual(list(store.query(SecondOrderReferent)), [])
+
+
+    def test_batchReferenceDeletionDoesNotLoad(self):
+        """
+        Dependent items deleted by L{ItemQuery.deleteFromStore} are not loaded
+        from the database.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        depID = DependentReferent(store=store, ref=referee).storeID
+        gc.collect()
+        loaded = []
+        self.patch(DependentReferent, 'existingInStore',
+                   classmethod(lambda cls, *a: loaded.append(a)))
+        store.query(Referee).deleteFromStore()
+        self.assertEqual(loaded, [])
+        self.assertEqual(store.query(DependentReferent).count(), 0)
+        self.assertRaises(KeyError, store.getItemByID, depID)
+
+
+    def test_batchReferenceDeletionSelected(self):
+        """
+        Only the dependents of the items matched by the query are deleted.
+        """
+        store = Store()
+        keep = Referee(store=store, topSecret=1)
+        drop = Referee(store=store, topSecret=2)
+        kept = DependentReferent(store=store, ref=keep)
+        DependentReferent(store=store, ref=drop)
+        store.query(Referee, Referee.topSecret == 2).deleteFromStore()
+        self.assertEqual(list(store.query(Referee)), [keep])
+        self.assertEqual(list(store.query(DependentReferent)), [kept])
+
+
+    def test_batchDeletionDisallowedTransitively(self):
+        """
+        A C{whenDeleted=DISALLOW} reference to an item which would be deleted
+        by a cascade prevents the deletion, and nothing is deleted.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        dep = DependentReferent(store=store, ref=referee)
+        SecondOrderDisallowReferent(store=store, ref=dep)
+        self.assertRaises(DeletionDisallowed,
+                          store.query(Referee).deleteFromStore)
+        self.assertEqual(list(store.query(Referee)), [referee])
+        self.assertEqual(list(store.query(DependentReferent)), [dep])
+        self.assertIdentical(store.getItemByID(dep.storeID), dep)
+
+
+    def test_batchDeletionEagerNullify(self):
+        """
+        With C{eagerNullify=True}, C{whenDeleted=NULLIFY} references to the
+        deleted items are set to C{None} in the database.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        referent = NullifyReferent(store=store, ref=referee)
+        store.query(Referee).deleteFromStore(eagerNullify=True)
+        self.assertEqual(
+            list(store.query(NullifyReferent,
+                             NullifyReferent.ref == None)),
+            [referent])
+        self.assertIdentical(referent.ref, None)
+
+
+    def test_batchDeletionAfterBrokenType(self):
+        """
+        The references of item types whose definitions failed are not
+        examined when items are deleted.
+        """
+        def brokenBody():
+            class Broken(Item):
+                ref = reference(reftype=Referee)
+                raise ZeroDivisionError()
+        def duplicateTypeName():
+            class Duplicate(Item):
+                typeName = NullifyReferent.typeName
+                ref = reference(reftype=Referee)
+        self.assertRaises(ZeroDivisionError, brokenBody)
+        self.assertRaises(RuntimeError, duplicateTypeName)
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        referent = NullifyReferent(store=store, ref=referee)
+        store.query(Referee).deleteFromStore(eagerNullify=True)
+        self.assertEqual(
+            list(store.query(NullifyReferent,
+                             NullifyReferent.ref == None)),
+            [referent])
+
+
+    def test_batchDeletionLazyNullify(self):
+        """
+        By default, C{whenDeleted=NULLIFY} references are left in the database
+        and read as C{None}.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        referent = NullifyReferent(store=store, ref=referee)
+        store.query(Referee).deleteFromStore()
+        self.assertEqual(
+            list(store.query(NullifyReferent,
+                             NullifyReferent.ref == None)),
+            [])
+        self.assertIdentical(referent.ref, None)
+
+
+    def test_batchDeletionRecursive(self):
+        """
+        A C{whenDeleted=CASCADE} reference from a type to itself is followed
+        to any depth.
+        """
+        store = Store()
+        root = RecursiveReferent(store=store)
+        child = RecursiveReferent(store=store, parent=root)
+        RecursiveReferent(store=store, parent=child)
+        store.query(RecursiveReferent,
+                    RecursiveReferent.storeID == root.storeID).deleteFromStore()
+        self.assertEqual(list(store.query(RecursiveReferent)), [])
+
+
+    def test_batchDeletionOverriddenDeleted(self):
+        """
+        Dependents whose type overrides C{deleted} are deleted one at a time,
+        so that their callback is invoked.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        dep = NotifyingReferent(store=store, ref=referee)
+        self.patch(NotifyingReferent, 'deletions', [])
+        store.query(Referee).deleteFromStore()
+        self.assertEqual(NotifyingReferent.deletions, [dep.storeID])
+
+
+    def test_deletionSkipsAbsentTables(self):
+        """
+        Deleting an item does not create tables for item types with untyped
+        C{whenDeleted=CASCADE} references which have never been stored.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        store.query(Referee).deleteFromStore()
+        Referee(store=store, topSecret=1).deleteFromStore()
+        self.assertFalse(store._hasTableFor(UntypedCascadeReferent))
+
+
+    def test_untypedReferenceDeletion(self):
+        """
+        Untyped C{whenDeleted=CASCADE} references are followed when their
+        table exists.
+        """
+        store = Store()
+        referee = Referee(store=store, topSecret=0)
+        UntypedCascadeReferent(store=store, ref=referee)
+        store.query(Referee).deleteFromStore()
+        self.assertEqual(list(store.query(UntypedCascadeReferent)), [])
+
+
     def test_dummyItemReference(self):
         """
         Getting the value of a reference attribute which has previously been
@@ -0,0 +1,192 @@
+"""
+Tests for L{axiom.tombstone}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer
+from axiom.substore import SubStore
+from axiom.tombstone import collectTombstones, TombstoneCollector
+from axiom.plugins.axiom_plugins import Compact
+from axiom.test.util import CommandStub, callWithStdoutRedirect
+
+
+
+class Headstone(Item):
+    """
+    An item to be deleted.
+    """
+    typeName = 'test_tombstone_headstone'
+    schemaVersion = 1
+
+    value = integer()
+
+
+
+def objectRows(store):
+    """
+    Return the storeIDs of all the rows in the objects table of C{store}.
+    """
+    return [oid for (oid,) in store.querySchemaSQL(
+        'SELECT oid FROM *DATABASE*.axiom_objects ORDER BY oid')]
+
+
+
+class CollectTombstonesTests(TestCase):
+    """
+    Tests for L{collectTombstones}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.items = [Headstone(store=self.store, value=i) for i in range(10)]
+        self.storeIDs = [it.storeID for it in self.items]
+
+
+    def test_deadRows(self):
+        """
+        Rows for items deleted with L{Item.deleteFromStore} are removed.
+        """
+        for it in self.items[:5]:
+            it.deleteFromStore()
+        self.assertEqual(collectTombstones(self.store), 5)
+        for storeID in self.storeIDs[:5]:
+            self.assertNotIn(storeID, objectRows(self.store))
+        for storeID in self.storeIDs[5:]:
+            self.assertIn(storeID, objectRows(self.store))
+
+
+    def test_orphanedRows(self):
+        """
+        Rows for items deleted in bulk with L{ItemQuery.deleteFromStore} are
+        removed.
+        """
+        self.store.query(Headstone, Headstone.value < 5).deleteFromStore()
+        self.assertEqual(collectTombstones(self.store), 5)
+        for storeID in self.storeIDs[:5]:
+            self.assertNotIn(storeID, objectRows(self.store))
+        self.assertEqual(
+            [it.value for it in self.store.query(
+                Headstone, sort=Headstone.value.ascending)],
+            list(range(5, 10)))
+
+
+    def test_limit(self):
+        """
+        No more than C{limit} rows are removed by a single call.
+        """
+        for it in self.items[:3]:
+            it.deleteFromStore()
+        self.store.query(Headstone, Headstone.value >= 7).deleteFromStore()
+        self.assertEqual(collectTombstones(self.store, 2), 2)
+        self.assertEqual(collectTombstones(self.store, 2), 2)
+        self.assertEqual(collectTombstones(self.store, 2), 1)
+        self.assertEqual(collectTombstones(self.store, 2), 0)
+
+
+    def test_storeIDsNotReused(self):
+        """
+        The row for the most recently allocated storeID is kept, so that it
+        cannot be handed out again.
+        """
+        self.items[-1].deleteFromStore()
+        self.assertEqual(collectTombstones(self.store), 0)
+        self.assertEqual(objectRows(self.store)[-1], self.storeIDs[-1])
+        self.assertTrue(
+            Headstone(store=self.store).storeID > self.storeIDs[-1])
+
+
+    def test_uncheckpointedItems(self):
+        """
+        Items which have not yet been written to their table are not treated
+        as orphans.
+        """
+        def txn():
+            new = Headstone(store=self.store, value=100)
+            new.value = 101
+            collectTombstones(self.store)
+            return new.storeID
+        storeID = self.store.transact(txn)
+        self.assertEqual(self.store.getItemByID(storeID).value, 101)
+
+
+    def test_incrementalVacuum(self):
+        """
+        Free pages are released when C{incrementalVacuum} is true and the
+        database uses incremental auto-vacuuming.
+        """
+        store = Store(self.mktemp())
+        store.executeSQL('PRAGMA auto_vacuum = INCREMENTAL')
+        store.executeSQL('VACUUM')
+        store.transact(
+            lambda: [Headstone(store=store, value=i) for i in range(2000)])
+        store.query(Headstone).deleteFromStore()
+        [(before,)] = store.querySQL('PRAGMA freelist_count')
+        self.assertTrue(before > 0)
+        collectTombstones(store, incrementalVacuum=True)
+        [(after,)] = store.querySQL('PRAGMA freelist_count')
+        self.assertEqual(after, 0)
+
+
+
+class TombstoneCollectorTests(TestCase):
+    """
+    Tests for L{TombstoneCollector}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.store.transact(
+            lambda: [Headstone(store=self.store, value=i) for i in range(10)])
+        self.store.query(Headstone, Headstone.value < 5).deleteFromStore()
+        self.collector = TombstoneCollector(store=self.store, batchSize=3)
+
+
+    def test_runAgainImmediately(self):
+        """
+        L{TombstoneCollector.run} removes a batch of rows and, if there may be
+        more, asks to be run again right away.
+        """
+        nextRun = self.collector.run()
+        self.assertEqual(self.collector.reclaimed, 3)
+        self.assertEqual(nextRun, self.collector.lastRun)
+
+
+    def test_runAgainLater(self):
+        """
+        Once there is nothing left to collect, L{TombstoneCollector.run} asks
+        to be run again after C{interval} seconds.
+        """
+        self.collector.run()
+        nextRun = self.collector.run()
+        self.assertEqual(self.collector.reclaimed, 5)
+        self.assertTrue(
+            nextRun.asPOSIXTimestamp() - self.collector.lastRun.asPOSIXTimestamp()
+            == self.collector.interval)
+
+
+
+class CompactCommandTests(TestCase):
+    """
+    Tests for the I{axiomatic compact} command.
+    """
+    def test_compact(self):
+        """
+        I{axiomatic compact} removes all of the dead rows from a store and its
+        substores, and reports how many were removed.
+        """
+        siteStore = Store(self.mktemp())
+        substore = SubStore.createNew(siteStore, ['sub']).open()
+        for s in siteStore, substore:
+            s.transact(lambda: [Headstone(store=s) for i in range(5)])
+            s.query(Headstone).deleteFromStore()
+
+        cmd = Compact()
+        cmd.parent = CommandStub(siteStore, 'compact')
+        result, output = callWithStdoutRedirect(
+            cmd.parseOptions, ['--count', '2'])
+        self.assertEqual(
+            output.getvalue().splitlines()[-1],
+            'Compaction complete: 8 rows reclaimed')
+        self.assertEqual(collectTombstones(siteStore), 0)
+        self.assertEqual(collectTombstones(substore), 0)
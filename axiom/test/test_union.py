@@ -0,0 +1,182 @@
+"""
+Tests for queries of several item types merged together, made with
+L{axiom.store.Store.queryUnion}.
+"""
+
+import gc
+
+from twisted.trial.unittest import TestCase
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, text, timestamp
+from axiom.test.util import countStatements
+
+
+
+class Message(Item):
+    """
+    An item with a time it was received.
+    """
+    typeName = 'test_union_message'
+    schemaVersion = 1
+
+    subject = text()
+    received = timestamp(indexed=True)
+    body = text(deferred=True)
+
+
+
+class Event(Item):
+    """
+    An item with a time it starts, and fewer attributes.
+    """
+    typeName = 'test_union_event'
+    schemaVersion = 1
+
+    start = timestamp(indexed=True)
+
+
+
+class Note(Item):
+    """
+    An item with a number to sort by.
+    """
+    typeName = 'test_union_note'
+    schemaVersion = 1
+
+    priority = integer()
+    title = text()
+
+
+
+def when(seconds):
+    return Time.fromPOSIXTimestamp(seconds)
+
+
+
+class UnionQueryTests(TestCase):
+    """
+    Tests for L{axiom.store.UnionQuery}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.messages = [
+            Message(store=self.store, subject=u'm%d' % (i,),
+                    received=when(i * 2), body=u'body %d' % (i,))
+            for i in range(5)]
+        self.events = [Event(store=self.store, start=when(i * 3))
+                       for i in range(4)]
+        self.sort = [Message.received.descending, Event.start.descending]
+
+
+    def union(self, **kw):
+        return self.store.queryUnion(
+            [(Message, Message.subject != u'm4'), (Event, None)],
+            sort=self.sort, **kw)
+
+
+    def expected(self):
+        """
+        The results of L{union}, sorted in Python.
+        """
+        results = [(message.received, message.storeID, message)
+                   for message in self.messages[:4]]
+        results.extend([(event.start, event.storeID, event)
+                        for event in self.events])
+        results.sort(key=lambda result: (-result[0].asPOSIXTimestamp(),
+                                         result[1]))
+        return [result[2] for result in results]
+
+
+    def test_merged(self):
+        """
+        The items matched by each query are merged in the order of their
+        sort columns, ties being ordered by storeID.
+        """
+        self.assertEqual(list(self.union()), self.expected())
+
+
+    def test_limit(self):
+        """
+        A limited union is found, and its items loaded, with a single
+        statement.
+        """
+        results, statements = countStatements(
+            self.store, list, self.union(limit=4))
+        self.assertEqual(statements, 1)
+        self.assertEqual(results, self.expected()[:4])
+
+
+    def test_loadedItems(self):
+        """
+        The results are the items already in memory, and items loaded by the
+        union have their attributes, including deferred ones.
+        """
+        message = self.messages[3]
+        self.assertIdentical(list(self.union(limit=2))[1], message)
+        storeID = message.storeID
+        del message, self.messages
+        gc.collect()
+        self.assertRaises(KeyError, self.store.objectCache.get, storeID)
+        results = list(self.union(limit=2))
+        self.assertEqual(results[1].storeID, storeID)
+        self.assertEqual(results[1].subject, u'm3')
+        self.assertEqual(results[1].body, u'body 3')
+
+
+    def test_paginate(self):
+        """
+        A union can be iterated a page at a time, and resumed from a token.
+        """
+        pagination = self.union().paginate(pagesize=3)
+        results = [next(pagination) for i in range(4)]
+        token = pagination.resumeToken()
+        results.extend(self.union().paginate(pagesize=2, resumeToken=token))
+        self.assertEqual(results, self.expected())
+
+
+    def test_paginateStatements(self):
+        """
+        Each page of a union is found with a single statement.
+        """
+        results, statements = countStatements(
+            self.store, list, self.union().paginate(pagesize=3))
+        self.assertEqual(results, self.expected())
+        self.assertEqual(statements, 3)
+
+
+    def test_severalColumns(self):
+        """
+        Queries can be sorted by several corresponding columns, and the same
+        item type can be in a union more than once.
+        """
+        notes = [Note(store=self.store, priority=priority, title=title)
+                 for (priority, title) in [(1, u'b'), (2, u'a'), (1, u'a'),
+                                           (2, u'c')]]
+        union = self.store.queryUnion(
+            [(Note, Note.priority == 1), (Note, Note.priority == 2)],
+            sort=[(Note.priority.descending, Note.title.ascending)] * 2)
+        expected = [notes[1], notes[3], notes[2], notes[0]]
+        self.assertEqual(list(union), expected)
+        self.assertEqual(list(union.paginate(pagesize=1)), expected)
+
+
+    def test_invalid(self):
+        """
+        A union needs an ordering for each query, and those orderings must
+        correspond.
+        """
+        self.assertRaises(ValueError, self.store.queryUnion, [], sort=[])
+        self.assertRaises(
+            ValueError, self.store.queryUnion,
+            [(Message, None), (Event, None)],
+            sort=[Message.received.descending])
+        self.assertRaises(
+            ValueError, self.store.queryUnion,
+            [(Message, None), (Event, None)],
+            sort=[Message.received.descending, Event.start.ascending])
+        self.assertRaises(
+            ValueError, self.union().paginate, pagesize=0)
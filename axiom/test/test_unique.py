@@ -0,0 +1,283 @@
+"""
+Tests for unique indexes, declared with C{unique=True} on an attribute or
+with L{axiom.attributes.compoundIndex}.
+"""
+
+from zope.interface import Interface
+
+from twisted.trial.unittest import TestCase
+
+from axiom.store import Store
+from axiom.item import Item, _PowerupConnector
+from axiom.attributes import boolean, compoundIndex, integer, text
+from axiom.errors import SQLError, UniqueConstraintViolation
+from axiom.tags import _TagName
+from axiom.listversions import SoftwareVersion
+from axiom.scheduler import _SubSchedulerParentHook
+from axiom.test.test_indexes import indexSQL
+
+
+
+class IUnique(Interface):
+    """
+    An interface to install powerups for.
+    """
+
+
+
+class Tag(Item):
+    """
+    An item with a unique name.
+    """
+    typeName = 'test_unique_tag'
+    schemaVersion = 1
+
+    name = text(unique=True)
+
+
+
+class Version(Item):
+    """
+    An item unique by several attributes, and among the current items by
+    another.
+    """
+    typeName = 'test_unique_version'
+    schemaVersion = 1
+
+    package = text()
+    major = integer()
+    minor = integer()
+    current = boolean(default=False)
+
+    compoundIndex(package, major, minor, unique=True)
+    compoundIndex(package, where=(current == True), unique=True)
+
+
+
+class UniqueAttributeTests(TestCase):
+    """
+    Tests for attributes declared with C{unique=True}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.tag = Tag(store=self.store, name=u'red')
+
+
+    def test_created(self):
+        """
+        A unique index is created on the attribute.
+        """
+        [sql] = indexSQL(self.store, Tag).values()
+        self.assertTrue(sql.startswith('CREATE UNIQUE INDEX'), sql)
+
+
+    def test_duplicate(self):
+        """
+        Creating an item with the same value as another raises
+        L{UniqueConstraintViolation}, an L{SQLError}, and leaves nothing of
+        the item in the store.
+        """
+        error = self.assertRaises(
+            UniqueConstraintViolation, Tag, store=self.store, name=u'red')
+        self.assertIsInstance(error, SQLError)
+        self.assertEqual(list(self.store.query(Tag)), [self.tag])
+        self.assertRaises(
+            KeyError, self.store.getItemByID, self.tag.storeID + 1)
+
+
+    def test_none(self):
+        """
+        Any number of items may have no value.
+        """
+        Tag(store=self.store)
+        Tag(store=self.store)
+        self.assertEqual(self.store.query(Tag).count(), 3)
+
+
+    def test_change(self):
+        """
+        Changing an item to have the same value as another raises
+        L{UniqueConstraintViolation}.
+        """
+        blue = Tag(store=self.store, name=u'blue')
+        self.assertRaises(
+            UniqueConstraintViolation, setattr, blue, 'name', u'red')
+
+
+    def test_transaction(self):
+        """
+        A violation in a transaction raises L{UniqueConstraintViolation} from
+        the transaction, whose changes are reverted.
+        """
+        def create():
+            Tag(store=self.store, name=u'blue')
+            Tag(store=self.store, name=u'red')
+        self.assertRaises(
+            UniqueConstraintViolation, self.store.transact, create)
+        self.assertEqual(list(self.store.query(Tag)), [self.tag])
+
+
+
+class UniqueCompoundIndexTests(TestCase):
+    """
+    Tests for indexes declared with C{compoundIndex(..., unique=True)}.
+    """
+    def setUp(self):
+        self.store = Store()
+        Version(store=self.store, package=u'axiom', major=1, minor=0)
+
+
+    def test_duplicate(self):
+        """
+        Items may share the values of some of the columns of a unique index,
+        but not all of them.
+        """
+        Version(store=self.store, package=u'axiom', major=1, minor=1)
+        Version(store=self.store, package=u'epsilon', major=1, minor=0)
+        self.assertRaises(
+            UniqueConstraintViolation, Version, store=self.store,
+            package=u'axiom', major=1, minor=0)
+        self.assertEqual(self.store.query(Version).count(), 3)
+
+
+    def test_partial(self):
+        """
+        A unique index with a predicate only constrains the items which
+        match it.
+        """
+        Version(store=self.store, package=u'axiom', major=2, minor=0,
+                current=True)
+        Version(store=self.store, package=u'axiom', major=3, minor=0)
+        self.assertRaises(
+            UniqueConstraintViolation, Version, store=self.store,
+            package=u'axiom', major=4, minor=0, current=True)
+
+
+
+class FindOrCreateTests(TestCase):
+    """
+    Tests for L{Store.findOrCreate} of items with unique indexes.
+    """
+    def test_created(self):
+        """
+        An item which does not exist is created, and found afterwards.
+        """
+        store = Store()
+        tag = store.findOrCreate(Tag, name=u'red')
+        self.assertIdentical(store.findOrCreate(Tag, name=u'red'), tag)
+
+
+    def test_createdElsewhere(self):
+        """
+        If another process creates a matching item after the search finds
+        none, that item is returned rather than a violation raised.
+        """
+        dbdir = self.mktemp()
+        store = Store(dbdir)
+        other = Store(dbdir)
+        Tag(store=store, name=u'blue')
+        query = store.query
+        created = []
+        def raceQuery(*a, **kw):
+            if not created:
+                created.append(Tag(store=other, name=u'red'))
+                return iter([])
+            return query(*a, **kw)
+        store.query = raceQuery
+        new = []
+        tag = store.findOrCreate(Tag, new.append, name=u'red')
+        self.assertEqual(tag.storeID, created[0].storeID)
+        self.assertEqual(new, [])
+        del store.query
+        self.assertEqual(store.query(Tag, Tag.name == u'red').count(), 1)
+
+
+    def test_insertOrIgnore(self):
+        """
+        Outside a transaction, an item unique by the given attributes is
+        inserted with C{ON CONFLICT DO NOTHING}, and is otherwise created as
+        usual, with defaults for the attributes not given.
+        """
+        store = Store()
+        statements = []
+        execute = store.cursor.execute
+        def recordingExecute(sql, args=()):
+            statements.append(sql)
+            return execute(sql, args)
+        store.cursor.execute = recordingExecute
+        new = []
+        version = store.findOrCreate(
+            Version, new.append, package=u'axiom', major=1, minor=2)
+        del store.cursor.execute
+        self.assertEqual(new, [version])
+        self.assertEqual(version.current, False)
+        self.assertEqual(
+            len([sql for sql in statements
+                 if sql.endswith('ON CONFLICT DO NOTHING')]), 1)
+        self.assertIdentical(
+            store.findOrCreate(Version, package=u'axiom', major=1, minor=2),
+            version)
+
+
+    def test_notUnique(self):
+        """
+        Attributes which do not cover a unique index are created as usual.
+        """
+        store = Store()
+        version = store.findOrCreate(Version, package=u'axiom', major=1)
+        self.assertEqual(
+            store.findOrCreate(Version, package=u'axiom', major=1), version)
+        self.assertEqual(store.query(Version).count(), 1)
+
+
+    def test_existingDuplicates(self):
+        """
+        A store whose table holds duplicates from before a unique index was
+        declared can still be opened, without the index.
+        """
+        dbdir = self.mktemp()
+        store = Store(dbdir)
+        [name] = indexSQL(store, Tag)
+        store.executeSQL('DROP INDEX %s' % (name,))
+        Tag(store=store, name=u'red')
+        Tag(store=store, name=u'red')
+        store.close()
+        store = Store(dbdir)
+        self.assertEqual(indexSQL(store, Tag), {})
+        self.assertEqual(store.query(Tag).count(), 2)
+
+
+
+class BuiltinUniqueTests(TestCase):
+    """
+    Tests for the unique indexes of Axiom's own item types.
+    """
+    def test_indexes(self):
+        """
+        Tag names, software versions, sub-scheduler hooks and powerup
+        connectors each have a unique index.
+        """
+        store = Store()
+        for itemType in [_TagName, SoftwareVersion, _SubSchedulerParentHook,
+                         _PowerupConnector]:
+            store.getTypeID(itemType)
+            self.assertTrue(
+                [sql for sql in indexSQL(store, itemType).values()
+                 if sql.startswith('CREATE UNIQUE INDEX')],
+                itemType)
+
+
+    def test_powerUpTwice(self):
+        """
+        Installing a powerup twice changes its priority, rather than adding a
+        second connector.
+        """
+        store = Store()
+        powerup = Tag(store=store, name=u'red')
+        store.powerUp(powerup, IUnique, 1)
+        store.powerUp(powerup, IUnique, 2)
+        [connector] = store.query(_PowerupConnector)
+        self.assertEqual(connector.priority, 2)
+        self.assertRaises(
+            UniqueConstraintViolation, _PowerupConnector, store=store,
+            item=store, interface=connector.interface, powerup=powerup)
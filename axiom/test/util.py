@@ -182,3 +182,24 @@ def callWithStdoutRedirect(f, *a, **kw):
     finally:
         sys.stdout = stdout
     return result, output
+
+
+
+def countStatements(store, f, *a, **kw):
+    """
+    Invoke C{f}, counting the SQL statements which C{store} executes
+    meanwhile.
+
+    @returns: C{(returnValue, count)}
+    """
+    statements = []
+    execute = store.cursor.execute
+    def countingExecute(sql, args=()):
+        statements.append(sql)
+        return execute(sql, args)
+    store.cursor.execute = countingExecute
+    try:
+        result = f(*a, **kw)
+    finally:
+        del store.cursor.execute
+    return result, len(statements)
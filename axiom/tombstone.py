@@ -0,0 +1,173 @@
+# -*- test-case-name: axiom.test.test_tombstone -*-
+
+"""
+Garbage collection of dead rows in the C{axiom_objects} table.
+
+Every item is assigned its storeID by inserting a row into C{axiom_objects}.
+When an item is deleted with L{Item.deleteFromStore
+<axiom.item.Item.deleteFromStore>} that row is not removed; its C{type_id} is
+set to C{-1} instead, leaving a tombstone behind.  Items deleted in bulk with
+L{ItemQuery.deleteFromStore <axiom.store.ItemQuery.deleteFromStore>} leave
+their row in place altogether, still pointing at a type whose table no longer
+holds them.  In long-lived stores these rows can come to dominate the table and
+its index.
+
+L{collectTombstones} removes a bounded number of such rows in a single
+transaction, and L{TombstoneCollector} uses the scheduler to do so
+incrementally in the background::
+
+    collector = TombstoneCollector(store=store)
+    IScheduler(store).schedule(collector, Time())
+
+Neither ever removes the most recently allocated row, so storeIDs are not
+reused even by stores whose C{axiom_objects} table was created before it was
+declared C{AUTOINCREMENT}.
+"""
+
+from datetime import timedelta
+
+from twisted.python import log
+
+from epsilon.extime import Time
+
+from axiom import _schema
+from axiom.item import Item
+from axiom.attributes import integer, boolean, timestamp
+
+
+
+def _collectableTables(store):
+    """
+    Find the item tables which exist in C{store}.
+
+    @return: A C{list} of two-tuples of the type ID and the fully qualified
+        table name of each type known to the store whose table exists.
+    """
+    tables = []
+    for typeID, module, typename, version in store.querySchemaSQL(
+            _schema.ALL_TYPES):
+        [(exists,)] = store.querySchemaSQL(
+            _schema.HAS_SCHEMA_FEATURE,
+            ['table', store._tableNameOnlyFor(typename, version)])
+        if exists:
+            tables.append((typeID, store._tableNameFor(typename, version)))
+    return tables
+
+
+
+def _purge(store, sql, args):
+    """
+    Run a tombstone-collecting statement and report how many rows it removed.
+    """
+    store.executeSchemaSQL(sql, args)
+    [(changed,)] = store.querySQL(_schema.CHANGED_ROWS)
+    return changed
+
+
+
+def _collect(store, limit, incrementalVacuum):
+    if not store.autocommit:
+        store.checkpoint()
+    if limit is None:
+        # A negative LIMIT means no limit at all to SQLite.
+        limit = -1
+    reclaimed = _purge(store, _schema.COLLECT_DEAD_OBJECTS, [limit])
+    for typeID, tableName in _collectableTables(store):
+        if limit >= 0:
+            if reclaimed >= limit:
+                break
+            remaining = limit - reclaimed
+        else:
+            remaining = limit
+        reclaimed += _purge(
+            store,
+            _schema.COLLECT_ORPHANED_OBJECTS.format(table=tableName),
+            [typeID, remaining])
+    if incrementalVacuum:
+        _incrementalVacuum(store)
+    return reclaimed
+
+
+
+def _incrementalVacuum(store):
+    """
+    Release all of the free pages in C{store}'s database file, if it uses
+    incremental auto-vacuuming.
+    """
+    [(mode,)] = store.querySchemaSQL(_schema.AUTO_VACUUM_MODE)
+    if mode != _schema.AUTO_VACUUM_INCREMENTAL:
+        return
+    [(free,)] = store.querySchemaSQL(_schema.FREE_PAGE_COUNT)
+    for i in range(free):
+        store.querySchemaSQL(_schema.INCREMENTAL_VACUUM)
+
+
+
+def collectTombstones(store, limit=None, incrementalVacuum=False):
+    """
+    Remove rows from C{axiom_objects} which no longer correspond to any item:
+    those marked as deleted and those whose item's row is gone from its type's
+    table.
+
+    @param store: The L{axiom.store.Store} to collect.
+
+    @param limit: The maximum number of rows to remove, or C{None} to remove
+        all of them.
+    @type limit: C{int} or C{NoneType}
+
+    @param incrementalVacuum: If true, also return free pages to the
+        filesystem with C{PRAGMA incremental_vacuum}.  This has no effect
+        unless the database was created with C{auto_vacuum} set to
+        C{INCREMENTAL}.
+
+    @return: The number of rows removed.
+    @rtype: C{int}
+    """
+    return store.transact(
+        store._logMaintenance, _collect, store, limit, incrementalVacuum)
+
+
+
+class TombstoneCollector(Item):
+    """
+    Incrementally remove dead rows from C{axiom_objects} whenever scheduled.
+
+    Each run removes at most C{batchSize} rows.  If that many were found, the
+    collector asks to be run again as soon as possible; otherwise it is run
+    again after C{interval} seconds.
+
+    @ivar batchSize: The maximum number of rows to remove per run.
+    @ivar interval: The number of seconds to wait between runs once there is
+        nothing left to collect.
+    @ivar incrementalVacuum: Whether to run C{PRAGMA incremental_vacuum} after
+        each batch.
+    @ivar reclaimed: The total number of rows removed by this collector.
+    @ivar lastRun: The time at which this collector last ran.
+    """
+    typeName = 'axiom_tombstone_collector'
+    schemaVersion = 1
+
+    batchSize = integer(default=1000, allowNone=False)
+    interval = integer(default=60 * 60 * 24, allowNone=False)
+    incrementalVacuum = boolean(default=False, allowNone=False)
+    reclaimed = integer(default=0, allowNone=False)
+    lastRun = timestamp()
+
+    def run(self):
+        """
+        Collect one batch of tombstones.
+        """
+        count = collectTombstones(
+            self.store, self.batchSize, self.incrementalVacuum)
+        self.reclaimed += count
+        self.lastRun = Time()
+        if count:
+            log.msg("Reclaimed %d axiom_objects rows in %r." % (
+                count, self.store))
+        if count >= self.batchSize:
+            return self.lastRun
+        return self.lastRun + timedelta(seconds=self.interval)
+
+
+
+__all__ = ['collectTombstones', 'TombstoneCollector']
@@ -4,11 +4,12 @@ Helper functions useful to more than one benchmark script.
 """
 
 from itertools import count
+from functools import partial
 
 from axiom.item import Item
 from axiom.attributes import integer
 
-typeNameCounter = count(0).next
+typeNameCounter = partial(next, count(0))
 
 def itemTypeWithSomeAttributes(attributeTypes):
     """